@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The workflow modules are scripts in workflow/scripts/python, which
+# import one another by name
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'workflow', 'scripts', 'python'
+))
@@ -0,0 +1,158 @@
+import datetime
+import numpy as np
+import netCDF4
+import pytest
+
+from climatology import (
+    ClimatologyAccessor, cyclic_weights, interpolate_block,
+    noleap_day_of_year
+)
+
+def dekads(year=2015):
+    return [
+        datetime.datetime(year, month, day)
+        for month in range(1, 13) for day in (1, 11, 21)
+    ]
+
+def baseline_interpolate(tms, clim):
+    """The temporal interpolation of the original
+    07_select-wfdei-ancil-data.py: wrap the first and last points
+    round by a year, resample to daily, interpolate linearly and
+    select 2015-01-01 to 2016-01-01."""
+    days = days_since(tms)
+    days = np.concatenate([[days[-1] - 365], days, [days[0] + 365]])
+    clim = np.concatenate([clim[-1:], clim, clim[:1]])
+    daily = np.arange(days[0], days[-1] + 1)
+    x = np.stack(
+        [np.interp(daily, days, col) for col in clim.T], axis=-1
+    )
+    first, last = days_since([
+        datetime.datetime(2015, 1, 1), datetime.datetime(2016, 1, 1)
+    ])
+    return x[(daily >= first) & (daily <= last)]
+
+def days_since(tms, origin=datetime.datetime(1970, 1, 1)):
+    return np.array([(tm - origin).days for tm in tms], dtype=np.float64)
+
+def test_interpolate_matches_wrap_and_resample():
+    tms = dekads()
+    clim = np.random.default_rng(0).uniform(0., 5., (len(tms), 4))
+    expected = baseline_interpolate(tms, clim)
+    days = days_since([datetime.datetime(2015, 1, 1)]) + np.arange(366)
+    i0, i1, w1 = cyclic_weights(days_since(tms), days)
+    out = interpolate_block(clim, i0, i1, w1)
+    assert out.shape == expected.shape
+    np.testing.assert_allclose(out, expected, rtol=2e-15, atol=0.)
+
+def test_interpolate_blocks():
+    tms = dekads()
+    clim = np.random.default_rng(1).uniform(0., 5., (len(tms), 2, 3))
+    days = days_since([datetime.datetime(2015, 1, 1)]) + np.arange(366)
+    i0, i1, w1 = cyclic_weights(days_since(tms), days)
+    full = interpolate_block(clim, i0, i1, w1)
+    for start in range(0, 366, 50):
+        k = slice(start, start + 50)
+        np.testing.assert_array_equal(
+            interpolate_block(clim, i0[k], i1[k], w1[k]), full[k]
+        )
+    # the climatological points themselves are reproduced exactly
+    i0, i1, w1 = cyclic_weights(days_since(tms), days_since(tms))
+    np.testing.assert_array_equal(interpolate_block(clim, i0, i1, w1), clim)
+
+def test_cyclic_weights_rejects_unordered_times():
+    with pytest.raises(ValueError):
+        cyclic_weights([10., 5.], [0.])
+    with pytest.raises(ValueError):
+        cyclic_weights([0., 365.], [0.])
+
+def write_climatology(fpath, seed=0, shape=(3, 4)):
+    """A 36-step climatology at 10-day intervals from 10 January
+    2015, as written by write_jules_lai.py, with a missing cell."""
+    tms = [
+        datetime.datetime(2015, 1, 10) + datetime.timedelta(days=10 * k)
+        for k in range(36)
+    ]
+    clim = np.random.default_rng(seed).uniform(0., 5., (36,) + shape)
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.createDimension('time', None)
+        nco.createDimension('lat', shape[0])
+        nco.createDimension('lon', shape[1])
+        var = nco.createVariable('time', 'i4', ('time',))
+        var.units = 'hours since 1970-01-01 00:00:00'
+        var.calendar = 'gregorian'
+        var[:] = netCDF4.date2num(tms, var.units, var.calendar)
+        var = nco.createVariable(
+            'leaf_area_index', 'f8', ('time', 'lat', 'lon'), fill_value=-1.
+        )
+        data = np.ma.array(clim)
+        data[:, 1, 0] = np.ma.masked
+        var[:] = data
+    clim[:, 1, 0] = np.nan
+    return tms, clim
+
+def test_noleap_day_of_year():
+    tms = [
+        datetime.datetime(2015, 1, 1), datetime.datetime(2015, 3, 1, 12),
+        datetime.datetime(2016, 2, 28), datetime.datetime(2016, 2, 29, 6),
+        datetime.datetime(2016, 3, 1), datetime.datetime(2016, 12, 31),
+        datetime.datetime(2000, 3, 1), datetime.datetime(2100, 3, 1)
+    ]
+    np.testing.assert_array_equal(
+        noleap_day_of_year(tms),
+        [0., 59.5, 58., 58.25, 59., 364., 59., 59.]
+    )
+
+def test_accessor_matches_cyclic_weights(tmp_path):
+    fpath = str(tmp_path / 'lai.nc')
+    clim_tms, clim = write_climatology(fpath)
+    # in a common (non-leap) year, day of year and days since an
+    # origin agree
+    days = days_since([datetime.datetime(2015, 1, 1)]) + np.arange(365)
+    i0, i1, w1 = cyclic_weights(days_since(clim_tms), days)
+    expected = interpolate_block(clim, i0, i1, w1)
+    with ClimatologyAccessor(fpath, 'leaf_area_index') as acc:
+        tms, out = acc.between(
+            datetime.datetime(2015, 1, 1), datetime.datetime(2015, 12, 31)
+        )
+        assert tms == [
+            datetime.datetime(2015, 1, 1) + datetime.timedelta(days=k)
+            for k in range(365)
+        ]
+        np.testing.assert_allclose(out, expected, rtol=1e-15, atol=0.)
+        for k in [0, 9, 10, 100, 360, 364]:
+            np.testing.assert_array_equal(acc.at(tms[k]), out[k])
+        # the climatological points are reproduced
+        np.testing.assert_allclose(
+            acc.at(clim_tms[5]), clim[5], rtol=1e-15, atol=0.
+        )
+        assert len(acc._cache) <= acc.cache_size
+
+def test_accessor_leap_years(tmp_path):
+    fpath = str(tmp_path / 'lai.nc')
+    write_climatology(fpath, seed=1)
+    with ClimatologyAccessor(fpath, 'leaf_area_index', cache_size=4) as acc:
+        def same(tm0, tm1):
+            np.testing.assert_array_equal(acc.at(tm0), acc.at(tm1))
+        # 29 February takes the values of 28 February, and the cycle
+        # does not drift over the following years
+        same(datetime.datetime(2016, 2, 29), datetime.datetime(2016, 2, 28))
+        for tm0, tm1 in [
+                ((2016, 2, 29, 12), (2015, 2, 28, 12)),
+                ((2016, 3, 1), (2015, 3, 1)),
+                ((2040, 12, 31), (2015, 12, 31)),
+                ((1980, 7, 1, 3), (2015, 7, 1, 3)),
+                ((2100, 3, 1), (2015, 3, 1))]:
+            same(datetime.datetime(*tm0), datetime.datetime(*tm1))
+
+        tms, out = acc.between(
+            datetime.datetime(2016, 2, 27), datetime.datetime(2016, 3, 2),
+            step=datetime.timedelta(hours=6)
+        )
+        assert len(tms) == 17 and tms[-1] == datetime.datetime(2016, 3, 2)
+        for tm, x in zip(tms, out):
+            np.testing.assert_array_equal(x, acc.at(tm))
+        assert np.isnan(out[:, 1, 0]).all()
+        tms, out = acc.between(
+            datetime.datetime(2016, 3, 2), datetime.datetime(2016, 3, 1)
+        )
+        assert tms == [] and out.shape == (0, 3, 4)
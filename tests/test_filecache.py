@@ -0,0 +1,114 @@
+import os
+import time
+import pytest
+
+import filecache
+from filecache import ArtifactCache, copy_file, read_manifest
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make the cache's clock tick by one second per call, so that
+    the order of use is unambiguous."""
+    now = [1e9]
+    def tick():
+        now[0] += 1.
+        return now[0]
+    monkeypatch.setattr(filecache.time, 'time', tick)
+    return now
+
+def write(fpath, text, mtime=None):
+    with open(fpath, 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(fpath, (mtime, mtime))
+    return str(fpath)
+
+def read(fpath):
+    with open(fpath, 'r') as f:
+        return f.read()
+
+def test_key(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    a = write(tmp_path / 'a.txt', 'a')
+    b = write(tmp_path / 'b.txt', 'b')
+    code = write(tmp_path / 'code.py', 'x = 1')
+    key = cache.key([a, b], {'n': 1}, [code])
+    assert key == cache.key([a, b], {'n': 1}, [code])
+    # a copy of an input elsewhere has the same key
+    c = write(tmp_path / 'c.txt', 'a')
+    assert cache.key([c, b], {'n': 1}, [code]) == key
+    assert cache.key([b, a], {'n': 1}, [code]) != key
+    assert cache.key([a, b], {'n': 2}, [code]) != key
+    write(code, 'x = 2')
+    assert cache.key([a, b], {'n': 1}, [code]) != key
+    write(a, 'changed', mtime=time.time() + 10)
+    assert cache.key([a, b], {'n': 1}, [code]) not in (
+        key, cache.key([c, b], {'n': 1}, [code])
+    )
+
+def test_store_restore(tmp_path, clock):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    # outputs with an old modification time
+    outputs = [
+        write(tmp_path / 'x.nc', 'xx', mtime=1e8),
+        write(tmp_path / 'y.nc', 'yyy', mtime=1e8)
+    ]
+    assert not cache.restore('k', outputs)
+    cache.store('k', outputs)
+    manifest = read_manifest(
+        os.path.join(str(tmp_path), 'cache', 'k', 'manifest.json')
+    )
+    assert manifest['size'] == 5
+    restored = [str(tmp_path / 'x2.nc'), str(tmp_path / 'y2.nc')]
+    # (the clock of the filesystem, not the cache's)
+    before = os.path.getmtime(write(tmp_path / 'before', ''))
+    assert cache.restore('k', restored)
+    assert [read(f) for f in restored] == ['xx', 'yyy']
+    # restored copies are newer than anything they were made from
+    for fpath in restored:
+        assert os.path.getmtime(fpath) >= before
+        assert not os.path.exists(fpath + '.tmp')
+    last_used = read_manifest(
+        os.path.join(str(tmp_path), 'cache', 'k', 'manifest.json')
+    )['last_used']
+    assert last_used > manifest['last_used']
+    # a second store of the same key keeps the entry
+    write(outputs[0], 'zz')
+    cache.store('k', outputs)
+    assert cache.restore('k', restored) and read(restored[0]) == 'xx'
+    # the number of outputs must match
+    assert not cache.restore('k', restored[:1])
+
+def test_evict_least_recently_used(tmp_path, clock):
+    cache = ArtifactCache(str(tmp_path / 'cache'), max_bytes=30)
+    outputs = {
+        key: [write(tmp_path / (key + '.txt'), key * 10)]
+        for key in ['a', 'b', 'c', 'd']
+    }
+    for key in ['a', 'b', 'c']:
+        cache.store(key, outputs[key])
+    # a is now the most recently used
+    assert cache.restore('a', [str(tmp_path / 'out.txt')])
+    cache.store('d', outputs['d'])
+    assert sorted(os.listdir(cache.cache_dir)) == ['a', 'c', 'd']
+    # b is gone, and the least recently used entry goes next
+    assert not cache.restore('b', [str(tmp_path / 'out.txt')])
+    cache.max_bytes = 20
+    cache.evict()
+    assert sorted(os.listdir(cache.cache_dir)) == ['a', 'd']
+    # an entry which is kept survives even if it is the oldest
+    cache.max_bytes = 10
+    cache.evict(keep='a')
+    assert sorted(os.listdir(cache.cache_dir)) == ['a']
+
+def test_copy_file_is_independent(tmp_path):
+    src = write(tmp_path / 'a.nc', 'a')
+    dst = str(tmp_path / 'b.nc')
+    # e.g. a hard link left by an earlier run
+    os.link(src, dst)
+    os.link(src, dst + '.tmp')
+    copy_file(src, dst)
+    assert read(dst) == 'a' and not os.path.exists(dst + '.tmp')
+    assert not os.path.samefile(src, dst)
+    write(dst, 'b')
+    assert read(src) == 'a'
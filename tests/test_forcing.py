@@ -0,0 +1,123 @@
+import datetime
+import os
+import numpy as np
+import netCDF4
+import pytest
+
+from forcing import (
+    TIME_UNITS, build_forcing_store, load_forcing_index, read_point_series,
+    store_index_fpath
+)
+
+LAT = np.array([20.25, 20.75, 21.25])
+LON = np.array([70.25, 70.75, 71.25, 71.75, 72.25])
+# Unequal months of 3-hourly steps, which do not align with chunks
+LENGTHS = [7, 12, 5]
+
+def write_sources(tmp_path):
+    """Monthly-style files of a (tstep, lat, lon) variable, whose
+    time axis is given relative to the start of each file."""
+    rng = np.random.default_rng(0)
+    fpaths, data, times = [], [], []
+    start = datetime.datetime(1979, 1, 1)
+    for i, n in enumerate(LENGTHS):
+        fpath = str(tmp_path / ('Tair_%d.nc' % i))
+        x = rng.random((n, len(LAT), len(LON))).astype(np.float32)
+        with netCDF4.Dataset(fpath, 'w') as nco:
+            nco.title = 'WFDEI'
+            nco.createDimension('tstep', None)
+            nco.createDimension('lat', len(LAT))
+            nco.createDimension('lon', len(LON))
+            var = nco.createVariable('lat', 'f8', ('lat',))
+            var[:] = LAT
+            var = nco.createVariable('lon', 'f8', ('lon',))
+            var[:] = LON
+            var = nco.createVariable('time', 'i4', ('tstep',))
+            var.units = 'seconds since ' + start.strftime('%Y-%m-%d %H:%M:%S')
+            var[:] = np.arange(n) * 10800
+            var = nco.createVariable(
+                'Tair', 'f4', ('tstep', 'lat', 'lon'), fill_value=1e20
+            )
+            var.units = 'K'
+            var[:] = x
+        times.append(netCDF4.date2num(
+            [start + datetime.timedelta(hours=3 * k) for k in range(n)],
+            TIME_UNITS, 'gregorian'
+        ))
+        fpaths.append(fpath)
+        data.append(x)
+        start += datetime.timedelta(hours=3 * n)
+    return fpaths, np.concatenate(data), np.concatenate(times)
+
+def test_build_forcing_store(tmp_path):
+    fpaths, data, times = write_sources(tmp_path)
+    store_fpath = str(tmp_path / 'store.nc')
+    index = build_forcing_store(
+        fpaths, store_fpath, time_chunk=10, space_chunk=2, complevel=1
+    )
+    with netCDF4.Dataset(store_fpath, 'r') as nc:
+        assert nc.title == 'WFDEI'
+        var = nc['Tair']
+        assert var.units == 'K'
+        assert var.chunking() == [10, 2, 2]
+        assert var.filters()['zlib'] and var.filters()['complevel'] == 1
+        np.testing.assert_array_equal(var[:], data)
+        np.testing.assert_array_equal(nc['time'][:], times)
+        np.testing.assert_array_equal(nc['lat'][:], LAT)
+    # the index points at time chunks rather than source files
+    assert index['length'] == sum(LENGTHS)
+    assert index['chunk_offsets'] == [0, 10, 20]
+    assert index['chunk_first_times'] == list(times[[0, 10, 20]])
+    assert os.path.exists(store_index_fpath(store_fpath))
+    assert not os.path.exists(store_fpath + '.tmp')
+
+def test_load_forcing_index(tmp_path):
+    fpaths, _, _ = write_sources(tmp_path)
+    store_fpath = str(tmp_path / 'store.nc')
+    storage = dict(time_chunk=10, space_chunk=2, complevel=0)
+    assert load_forcing_index(fpaths, store_fpath, **storage) is None
+    index = build_forcing_store(fpaths, store_fpath, **storage)
+    assert load_forcing_index(fpaths, store_fpath, **storage) == index
+    # other storage options
+    assert load_forcing_index(
+        fpaths, store_fpath, **dict(storage, time_chunk=8)
+    ) is None
+    assert load_forcing_index(
+        fpaths, store_fpath, **dict(storage, space_chunk=3)
+    ) is None
+    assert load_forcing_index(
+        fpaths, store_fpath, **dict(storage, complevel=4)
+    ) is None
+    # a changed source
+    st = os.stat(fpaths[1])
+    os.utime(fpaths[1], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert load_forcing_index(fpaths, store_fpath, **storage) is None
+
+def test_read_point_series(tmp_path):
+    fpaths, data, times = write_sources(tmp_path)
+    store_fpath = str(tmp_path / 'store.nc')
+    index = build_forcing_store(fpaths, store_fpath, time_chunk=10)
+    tms, x = read_point_series(store_fpath, index, 20.8, 71.3)
+    np.testing.assert_array_equal(tms, times)
+    np.testing.assert_array_equal(x, data[:, 1, 2])
+    origin = datetime.datetime(1979, 1, 1)
+    for k0, k1 in [(0, 23), (3, 9), (9, 10), (10, 19), (12, 12), (5, 21)]:
+        tms, x = read_point_series(
+            store_fpath, index, 21.25, 70.25,
+            start=origin + datetime.timedelta(hours=3 * k0),
+            end=origin + datetime.timedelta(hours=3 * k1)
+        )
+        np.testing.assert_array_equal(tms, times[k0:k1 + 1])
+        np.testing.assert_array_equal(x, data[k0:k1 + 1, 2, 0])
+    # between time steps
+    tms, _ = read_point_series(
+        store_fpath, index, 21.25, 70.25,
+        start=origin + datetime.timedelta(hours=31),
+        end=origin + datetime.timedelta(hours=59)
+    )
+    np.testing.assert_array_equal(tms, times[11:20])
+    with pytest.raises(ValueError):
+        read_point_series(
+            store_fpath, index, 21.25, 70.25,
+            start=datetime.datetime(1978, 12, 31)
+        )
@@ -0,0 +1,280 @@
+import numpy as np
+import netCDF4
+import pytest
+
+from icrisat import (
+    LAND_COVERS, AGRI_LAND_COVERS, CAN_VARY, CANNOT_VARY, INDEX,
+    get_static_terms, adjust_frac, adjust_frac_tile, iter_adjusted_tiles,
+    create_multi_year_frac_netcdf, write_frac_year, write_frac_times,
+    write_frac_rows, read_frac_year, export_frac_year, export_frac_template
+)
+
+NTYPE = len(LAND_COVERS)
+
+def baseline_adjust_frac(current_frac, india_frac, targets):
+    """One year of the per-year loop of the original
+    04_adjust_jules_frac_w_icrisat.py; `targets` are the rainfed,
+    single, double, triple and continuous ICRISAT fractions."""
+    target_sum = np.sum(np.ma.stack(targets, axis=0), axis=0)
+
+    def div_fun(x):
+        res = np.divide(
+            x.data, target_sum.data,
+            out=np.zeros_like(target_sum.data), where=target_sum > 0
+        )
+        return np.ma.array(res, mask=x.mask)
+
+    (target_rain_frac, target_irr1_frac, target_irr2_frac,
+     target_irr3_frac, target_cont_frac) = [div_fun(x) for x in targets]
+    target = {nm: np.zeros_like(target_sum) for nm in LAND_COVERS}
+
+    current_frac_india = current_frac * india_frac
+    current_frac_not_india = current_frac * (1. - india_frac)
+    grass_idx = (INDEX['c3_grass'], INDEX['c4_grass'])
+    c3_grass_idx, c4_grass_idx = grass_idx
+
+    current_frac_india_sum = np.sum(current_frac_india, axis=0)
+    current_frac_india_rel = np.divide(
+        current_frac_india.data, current_frac_india_sum.data,
+        out=np.zeros_like(current_frac_india.data),
+        where=current_frac_india_sum.data > 0
+    )
+    current_frac_india_rel = np.ma.array(
+        current_frac_india_rel, mask=current_frac.mask
+    )
+    india_rel_sum = np.sum(current_frac_india_rel, axis=0)
+    cannot_vary_idx = tuple(INDEX[nm] for nm in CANNOT_VARY)
+    cannot_vary_sum = np.sum(
+        current_frac_india_rel[cannot_vary_idx, ...], axis=0
+    )
+    max_agri_frac = np.clip(india_rel_sum - cannot_vary_sum, 0, 1.)
+    target_sum_adj = np.clip(target_sum, 0., max_agri_frac)
+    target_rain_frac *= target_sum_adj
+    target_irr1_frac *= target_sum_adj
+    target_irr2_frac *= target_sum_adj
+    target_irr3_frac *= target_sum_adj
+    target_cont_frac *= target_sum_adj
+    remaining_area = np.clip(
+        india_rel_sum - cannot_vary_sum - target_sum, 0., 1.
+    )
+
+    fallow_idx = INDEX['fallow']
+    grass_sum = np.sum(current_frac_india_rel[grass_idx, ...], axis=0)
+    c3_grass_frac = np.divide(
+        current_frac_india_rel[c3_grass_idx, ...].data, grass_sum.data,
+        out=np.ones_like(grass_sum.data), where=grass_sum > 0
+    )
+    current_frac_india_rel[c3_grass_idx, ...] += (
+        current_frac_india_rel[fallow_idx, ...] * c3_grass_frac
+    )
+    current_frac_india_rel[c4_grass_idx, ...] += (
+        current_frac_india_rel[fallow_idx, ...] * (1 - c3_grass_frac)
+    )
+    current_frac_india_rel[fallow_idx, ...] *= 0.
+
+    can_vary_idx = tuple(INDEX[nm] for nm in CAN_VARY)
+    other_frac = current_frac_india_rel[can_vary_idx, ...]
+    other_frac_sum = np.sum(other_frac, axis=0)
+    other_frac_rel = np.divide(
+        other_frac, other_frac_sum[None, ...],
+        out=np.zeros_like(other_frac), where=other_frac_sum > 0
+    )
+    agri_idx = tuple(INDEX[nm] for nm in AGRI_LAND_COVERS)
+    agri_frac_sum = np.sum(current_frac_india_rel[agri_idx, ...], axis=0)
+    lt_index = target_sum <= agri_frac_sum
+    gt_index = target_sum > agri_frac_sum
+    for frac_idx, frac_nm in enumerate(CAN_VARY):
+        idx = INDEX[frac_nm]
+        target[frac_nm][lt_index] = current_frac_india_rel[idx, ...][lt_index]
+        target[frac_nm][gt_index] = (
+            other_frac_rel[frac_idx, ...] * remaining_area
+        )[gt_index]
+    diff = remaining_area - np.sum(np.stack(list(target.values())), axis=0)
+    target['c3_grass'][lt_index] += (diff * c3_grass_frac)[lt_index]
+    target['c4_grass'][lt_index] += (diff * (1. - c3_grass_frac))[lt_index]
+    for frac_nm in CANNOT_VARY:
+        target[frac_nm] = current_frac_india_rel[INDEX[frac_nm], ...]
+    target['rainfed'] = target_rain_frac
+    target['irrigated_single_season'] = target_irr1_frac
+    target['irrigated_double_season'] = target_irr2_frac
+    target['irrigated_triple_season'] = target_irr3_frac
+    target['irrigated_continuous'] = target_cont_frac
+
+    updated_india_frac = np.ma.stack(list(target.values()))
+    updated_india_frac *= india_frac
+    updated_frac = current_frac_not_india + updated_india_frac
+    updated_frac[7, ...] += updated_frac[8, ...]
+    updated_frac[7, ...] += updated_frac[9, ...]
+    updated_frac[8, ...] *= 0.
+    updated_frac[9, ...] *= 0.
+    updated_frac_sum = np.sum(updated_frac, axis=0)
+    if np.any(~np.isclose(updated_frac_sum, 1.0)):
+        raise ValueError
+    updated_frac = np.divide(
+        updated_frac.data, updated_frac_sum.data,
+        out=np.zeros_like(updated_frac.data),
+        where=updated_frac_sum.data > 0
+    )
+    return np.ma.array(updated_frac, mask=current_frac.mask)
+
+def random_inputs(seed=0, nyear=3, shape=(5, 6)):
+    """A template whose first row is ocean (masked), with no shrub
+    (which the reallocation drops within India), an ICRISAT
+    coverage fraction with cells fully and partly in India, and
+    targets which leave room for the unvarying covers. Some cells
+    have more, and some less, cropland than targeted. Coverage is
+    nonzero, as the baseline loses the natural covers of unmasked
+    cells outside India."""
+    rng = np.random.default_rng(seed)
+    alpha = np.ones(NTYPE)
+    alpha[INDEX['shrub']] = 1e-300
+    # C order, as read from the template
+    current = np.moveaxis(rng.dirichlet(alpha, size=shape), -1, 0).copy()
+    current[INDEX['shrub']] = 0.
+    current /= current.sum(axis=0)
+    mask = np.zeros((NTYPE,) + shape, dtype=bool)
+    mask[:, 0, :] = True
+    current_frac = np.ma.array(current, mask=mask)
+    india_frac = rng.uniform(0.05, 1., shape)
+    india_frac[2, :2] = 1.
+    target_frac = rng.uniform(0., 0.15, (nyear, 5) + shape)
+    target_frac[:, :, 3, :2] = 0.
+    return current_frac, india_frac, target_frac
+
+def test_adjust_frac_matches_baseline():
+    current_frac, india_frac, target_frac = random_inputs()
+    static = get_static_terms(current_frac, india_frac)
+    updated = adjust_frac(target_frac, static)
+    assert updated.shape == (target_frac.shape[0], NTYPE) + india_frac.shape
+    for yr in range(target_frac.shape[0]):
+        targets = [np.ma.array(x) for x in target_frac[yr]]
+        expected = baseline_adjust_frac(current_frac, india_frac, targets)
+        np.testing.assert_allclose(
+            updated[yr], np.ma.filled(expected, 0.), rtol=0., atol=2e-16
+        )
+
+def test_adjust_frac_float32():
+    current_frac, india_frac, target_frac = random_inputs(1)
+    expected = adjust_frac(
+        target_frac, get_static_terms(current_frac, india_frac)
+    )
+    static = get_static_terms(current_frac, india_frac, dtype=np.float32)
+    updated = adjust_frac(target_frac.astype(np.float32), static)
+    assert updated.dtype == np.float32
+    np.testing.assert_allclose(updated, expected, rtol=0., atol=1e-6)
+
+def write_template(fpath, current_frac):
+    """An ANTS fraction file, with latitude decreasing."""
+    ntype, nlat, nlon = current_frac.shape
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.createDimension('dim0', ntype)
+        nco.createDimension('latitude', nlat)
+        nco.createDimension('longitude', nlon)
+        var = nco.createVariable('pseudo_level', 'i4', ('dim0',))
+        var.units = '1'
+        var.long_name = 'pseudo_level'
+        var[:] = np.arange(1, ntype + 1)
+        var = nco.createVariable('latitude', 'f8', ('latitude',))
+        var[:] = np.linspace(30., 20., nlat)
+        var = nco.createVariable('longitude', 'f8', ('longitude',))
+        var[:] = np.linspace(70., 90., nlon)
+        var = nco.createVariable(
+            'land_cover_lccs', 'f8', ('dim0', 'latitude', 'longitude'),
+            fill_value=1e20
+        )
+        var.standard_name = 'land_cover_lccs'
+        var.units = '1'
+        var[:] = current_frac
+
+@pytest.mark.parametrize('block_rows', [1, 2, 5])
+def test_iter_adjusted_tiles_matches_adjust_frac(tmp_path, block_rows):
+    current_frac, india_frac, target_frac = random_inputs(2)
+    template_fn = str(tmp_path / 'template.nc')
+    write_template(template_fn, current_frac)
+    static = get_static_terms(current_frac, india_frac)
+    expected = adjust_frac(target_frac, static)
+    nrow = 0
+    tiles = iter_adjusted_tiles(
+        template_fn, target_frac, india_frac, block_rows
+    )
+    for row0, row1, frac, land in tiles:
+        assert row0 == nrow
+        np.testing.assert_array_equal(frac, expected[:, :, row0:row1, :])
+        np.testing.assert_array_equal(land, static['land'][row0:row1])
+        nrow = row1
+    assert nrow == india_frac.shape[0]
+
+def test_adjust_frac_tile_from_stores(tmp_path):
+    current_frac, india_frac, target_frac = random_inputs(3)
+    template_fn = str(tmp_path / 'template.nc')
+    write_template(template_fn, current_frac)
+    target_fpath = str(tmp_path / 'target.npy')
+    india_fpath = str(tmp_path / 'india.npy')
+    np.save(target_fpath, target_frac)
+    np.save(india_fpath, india_frac)
+    expected = adjust_frac(
+        target_frac, get_static_terms(current_frac, india_frac)
+    )
+    frac, _ = adjust_frac_tile(template_fn, target_fpath, india_fpath, 1, 4)
+    np.testing.assert_array_equal(frac, expected[:, :, 1:4, :])
+    tiles = iter_adjusted_tiles(
+        template_fn, target_fpath, india_fpath, 2, n_workers=2
+    )
+    frac = np.concatenate([frac for _, _, frac, _ in tiles], axis=2)
+    np.testing.assert_array_equal(frac, expected)
+
+def read_jules_frac(fpath):
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        return {nm: nc[nm][:] for nm in nc.variables}
+
+@pytest.mark.parametrize('tiled', [False, True])
+def test_multi_year_file_matches_per_year_files(tmp_path, tiled):
+    current_frac, india_frac, target_frac = random_inputs(4)
+    yrs = [2000, 2001, 2002]
+    template_fn = str(tmp_path / 'template.nc')
+    write_template(template_fn, current_frac)
+    static = get_static_terms(current_frac, india_frac)
+    mask = np.broadcast_to(~static['land'], current_frac.shape)
+    frac = np.ma.array(
+        adjust_frac(target_frac, static),
+        mask=np.broadcast_to(mask, target_frac.shape[:1] + mask.shape)
+    )
+    # written by year, or by blocks of rows for all years at once
+    multi_fpath = str(tmp_path / 'multi.nc')
+    if tiled:
+        nco = create_multi_year_frac_netcdf(
+            multi_fpath, template_fn, chunk_rows=2
+        )
+        write_frac_times(nco, yrs)
+        for row0, row1 in [(0, 2), (2, 4), (4, 5)]:
+            write_frac_rows(nco, row0, row1, frac[:, :, row0:row1])
+    else:
+        nco = create_multi_year_frac_netcdf(multi_fpath, template_fn)
+        for i, yr in enumerate(yrs):
+            write_frac_year(nco, i, yr, frac[i])
+    nco.close()
+    for i, yr in enumerate(yrs):
+        # a template copy per year, as with `--output-mode per-year`
+        year_fpath = str(tmp_path / ('year_%d.nc' % yr))
+        write_template(year_fpath, frac[i])
+        expected_fpath = str(tmp_path / ('expected_%d.nc' % yr))
+        export_frac_template(year_fpath, expected_fpath)
+        out_fpath = str(tmp_path / ('out_%d.nc' % yr))
+        export_frac_year(multi_fpath, yr, out_fpath)
+
+        expected = read_jules_frac(expected_fpath)
+        out = read_jules_frac(out_fpath)
+        assert sorted(out) == sorted(expected)
+        for nm in expected:
+            np.testing.assert_array_equal(
+                np.ma.getmaskarray(out[nm]), np.ma.getmaskarray(expected[nm])
+            )
+            np.testing.assert_array_equal(out[nm], expected[nm])
+        # latitude is increasing, and the fractions flipped to match
+        assert np.all(np.diff(out['lat']) > 0)
+        np.testing.assert_array_equal(
+            out['land_cover_lccs'], np.flip(frac[i], axis=1)
+        )
+        np.testing.assert_array_equal(
+            read_frac_year(multi_fpath, yr), out['land_cover_lccs']
+        )
@@ -0,0 +1,184 @@
+import os
+import numpy as np
+import netCDF4
+import pytest
+
+import irrigation
+from irrigation import (
+    SCENARIOS, IRR_INDEX, scenario_intervals, expand_intervals,
+    expand_intervals_blocks, irrigated_frac_index
+)
+
+NT = 366
+NTYPE = 15
+
+def baseline_schedules(onset, irr_mask):
+    """The dense standard and policy schedules of the original
+    09_create-irrig-schedule.py."""
+    ny, nx = onset.shape
+    onset = onset * irr_mask
+    jd = (np.arange(0, NT) + 1)[:, None, None] * np.ones((ny, nx))
+    single = (jd >= onset) & (jd <= 304)
+    double = single | (jd >= 305) | (jd <= 90)
+    continuous = jd >= 1
+    standard = np.zeros((NT, NTYPE, ny, nx))
+    standard[:, 6, :, :][single] = 1
+    standard[:, 7, :, :][double] = 1
+    standard[:, 9, :, :][continuous] = 1
+    policy = np.copy(standard)
+    policy[standard == 1] = 2
+    policy[:, 6, :, :][single] = 1
+    policy[:, 7, :, :][single] = 1
+    policy[:, 9, :, :][single] = 1
+    return {
+        'standard': standard * irr_mask[None, None, :, :],
+        'policy': policy * irr_mask[None, None, :, :]
+    }
+
+def random_inputs(seed=0, shape=(6, 7)):
+    rng = np.random.default_rng(seed)
+    onset = rng.uniform(-5., 330., shape)
+    onset[0, :3] = np.nan
+    irr_mask = rng.random(shape) > 0.3
+    irr_mask[0, :3] = True
+    return onset, irr_mask
+
+def test_expand_intervals_matches_baseline():
+    onset, irr_mask = random_inputs()
+    scenarios = {nm: SCENARIOS[nm] for nm in ['standard', 'policy']}
+    intervals = scenario_intervals(onset, irr_mask, NTYPE, scenarios)
+    expected = baseline_schedules(onset, irr_mask.astype(float))
+    jd = np.arange(1, NT + 1)
+    for name, iv in intervals.items():
+        dense = expand_intervals(iv, jd)
+        assert dense.dtype == np.int8
+        np.testing.assert_array_equal(dense, expected[name])
+
+def test_expand_intervals_blocks():
+    onset, irr_mask = random_inputs(1)
+    iv = scenario_intervals(onset, irr_mask, NTYPE, SCENARIOS)['policy']
+    full = expand_intervals(iv, np.arange(1, NT + 1))
+    blocks = [dense for _, _, dense in expand_intervals_blocks(iv, NT, 31)]
+    np.testing.assert_array_equal(np.concatenate(blocks), full)
+
+def test_no_onset_has_no_kharif_window():
+    onset = np.array([[np.nan, 150.], [np.nan, 400.]])
+    irr_mask = np.ones((2, 2), dtype=bool)
+    iv = scenario_intervals(onset, irr_mask, NTYPE, SCENARIOS)['standard']
+    dense = expand_intervals(iv, np.arange(1, NT + 1))
+    jd = np.arange(1, NT + 1)
+    # single season (kharif only): never irrigated without an onset
+    assert not dense[:, 6, 0, 0].any()
+    assert not dense[:, 6, 1, :].any()
+    assert dense[:, 6, 0, 1].sum() == 304 - 150 + 1
+    # double season: rabi only
+    rabi = (jd >= 305) | (jd <= 90)
+    np.testing.assert_array_equal(dense[:, 7, 0, 0], rabi)
+    # continuous: every day
+    assert dense[:, 9, 0, 0].all()
+
+def test_masked_onset_has_no_kharif_window():
+    onset = np.ma.array([[150., 160.]], mask=[[False, True]])
+    irr_mask = np.ones((1, 2), dtype=bool)
+    iv = scenario_intervals(onset, irr_mask, NTYPE, SCENARIOS)['standard']
+    dense = expand_intervals(iv, np.arange(1, NT + 1))
+    assert dense[:, 6, 0, 0].any()
+    assert not dense[:, 6, 0, 1].any()
+
+def write_frac(fpath, irr_frac, mtime):
+    """A land cover fraction file whose irrigated types sum to
+    `irr_frac`, with modification time `mtime`."""
+    frac = np.zeros((NTYPE,) + irr_frac.shape)
+    frac[IRR_INDEX[0]] = irr_frac
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.createDimension('dim0', NTYPE)
+        nco.createDimension('lat', irr_frac.shape[0])
+        nco.createDimension('lon', irr_frac.shape[1])
+        var = nco.createVariable('land_cover_lccs', 'f8', ('dim0', 'lat', 'lon'))
+        var[:] = frac
+    os.utime(fpath, (mtime, mtime))
+
+@pytest.fixture
+def frac_files(tmp_path, monkeypatch):
+    """Three years of fraction files, in which cells are first
+    irrigated in different years, and a count of the files read."""
+    fracs = {
+        2000: np.array([[0.5, 0., 0.]]),
+        2001: np.array([[0.2, 0.3, 0.]]),
+        2002: np.array([[0., 0.1, 0.]])
+    }
+    fpaths = {}
+    for yr, irr_frac in fracs.items():
+        fpaths[yr] = str(tmp_path / ('frac_' + str(yr) + '.nc'))
+        write_frac(fpaths[yr], irr_frac, 1e9 + yr)
+    reads = []
+    read_irrigated_frac = irrigation.read_irrigated_frac
+    def counted(fpath):
+        reads.append(fpath)
+        return read_irrigated_frac(fpath)
+    monkeypatch.setattr(irrigation, 'read_irrigated_frac', counted)
+    return fpaths, fracs, reads, str(tmp_path / 'cache')
+
+def check_index(index, fracs, years):
+    irr_frac = np.stack([fracs[yr] for yr in years])
+    irrigated = irr_frac > 0
+    np.testing.assert_array_equal(index['ever_irrigated'], irrigated.any(axis=0))
+    np.testing.assert_array_equal(index['max_irrigated_frac'], irr_frac.max(axis=0))
+    first = [min([yr for yr, x in zip(years, col) if x] or [0])
+             for col in irrigated[:, 0, :].T]
+    last = [max([yr for yr, x in zip(years, col) if x] or [0])
+            for col in irrigated[:, 0, :].T]
+    np.testing.assert_array_equal(index['first_irrigated_year'][0], first)
+    np.testing.assert_array_equal(index['last_irrigated_year'][0], last)
+
+def test_irrigated_frac_index_cache_hit(frac_files):
+    fpaths, fracs, reads, cache_dir = frac_files
+    years = [2000, 2001, 2002]
+    check_index(
+        irrigated_frac_index([fpaths[yr] for yr in years], years, cache_dir),
+        fracs, years
+    )
+    assert len(reads) == 3
+    mtimes = {
+        fname: os.stat(os.path.join(cache_dir, fname)).st_mtime_ns
+        for fname in os.listdir(cache_dir)
+    }
+    check_index(
+        irrigated_frac_index([fpaths[yr] for yr in years], years, cache_dir),
+        fracs, years
+    )
+    # nothing is read or written
+    assert len(reads) == 3
+    assert mtimes == {
+        fname: os.stat(os.path.join(cache_dir, fname)).st_mtime_ns
+        for fname in os.listdir(cache_dir)
+    }
+
+def test_irrigated_frac_index_changed_file(frac_files):
+    fpaths, fracs, reads, cache_dir = frac_files
+    years = [2000, 2001, 2002]
+    irrigated_frac_index([fpaths[yr] for yr in years], years, cache_dir)
+    fracs[2001] = np.array([[0., 0., 0.9]])
+    write_frac(fpaths[2001], fracs[2001], 2e9)
+    del reads[:]
+    check_index(
+        irrigated_frac_index([fpaths[yr] for yr in years], years, cache_dir),
+        fracs, years
+    )
+    assert reads == [fpaths[2001]]
+    # one entry per year, and one index
+    assert len(os.listdir(cache_dir)) == 4
+
+def test_irrigated_frac_index_changed_years(frac_files):
+    fpaths, fracs, reads, cache_dir = frac_files
+    irrigated_frac_index(
+        [fpaths[yr] for yr in [2000, 2001, 2002]], [2000, 2001, 2002],
+        cache_dir
+    )
+    del reads[:]
+    for years in [[2001, 2002], [2002, 2000]]:
+        check_index(
+            irrigated_frac_index([fpaths[yr] for yr in years], years, cache_dir),
+            fracs, years
+        )
+    assert reads == []
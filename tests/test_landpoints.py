@@ -0,0 +1,102 @@
+import numpy as np
+import netCDF4
+import pytest
+
+from landpoints import (
+    LAND_DIM, LandIndex, is_land_points, read_grid, to_land_points
+)
+
+def random_grid(seed=0, shape=(5, 7)):
+    rng = np.random.default_rng(seed)
+    mask = rng.random(shape) > 0.4
+    mask[2, :] = False
+    lat_vals = np.linspace(30., 20., shape[0])
+    lon_vals = np.linspace(70., 90., shape[1])
+    return LandIndex(mask, lat_vals, lon_vals), mask, rng
+
+def test_gather_scatter():
+    li, mask, rng = random_grid()
+    x = rng.random((3, 4) + mask.shape)
+    points = li.gather(x)
+    assert points.shape == (3, 4, mask.sum())
+    np.testing.assert_array_equal(points, x[..., mask])
+    grid = li.scatter(points)
+    np.testing.assert_array_equal(np.ma.getmaskarray(grid)[0, 0], ~mask)
+    np.testing.assert_array_equal(grid.data[..., mask], x[..., mask])
+    np.testing.assert_array_equal(grid.data[..., ~mask], 0)
+
+def test_scatter_keeps_mask_of_points():
+    li, mask, rng = random_grid(1)
+    points = np.ma.masked_less(rng.random(li.nland), 0.5)
+    grid = li.scatter(points)
+    np.testing.assert_array_equal(
+        np.ma.getmaskarray(grid)[mask], np.ma.getmaskarray(points)
+    )
+    assert np.ma.getmaskarray(grid)[~mask].all()
+
+def test_gather_rows():
+    li, mask, rng = random_grid(2)
+    x = rng.random((2,) + mask.shape)
+    points = li.gather(x)
+    for row0, row1 in [(0, 2), (2, 3), (3, 5), (0, 5)]:
+        k = li.row_slice(row0, row1)
+        np.testing.assert_array_equal(
+            li.gather_rows(x[:, row0:row1], row0, row1), points[:, k]
+        )
+    assert li.row_slice(2, 3).start == li.row_slice(2, 3).stop
+
+def test_write_read(tmp_path):
+    li, mask, _ = random_grid(3)
+    fpath = str(tmp_path / 'land_index.nc')
+    li.write(fpath)
+    li2 = LandIndex.read(fpath)
+    assert li2.shape == li.shape
+    np.testing.assert_array_equal(li2.index, li.index)
+    np.testing.assert_array_equal(li2.lat_vals, li.lat_vals)
+    np.testing.assert_array_equal(li2.lon_vals, li.lon_vals)
+
+def test_to_land_points_round_trip(tmp_path):
+    li, mask, rng = random_grid(4)
+    fpath = str(tmp_path / 'soil.nc')
+    x = rng.random((3,) + mask.shape)
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.title = 'soil'
+        nco.createDimension('soil', 3)
+        nco.createDimension('lat', mask.shape[0])
+        nco.createDimension('lon', mask.shape[1])
+        var = nco.createVariable('lat', 'f8', ('lat',))
+        var[:] = li.lat_vals
+        var = nco.createVariable('lon', 'f8', ('lon',))
+        var[:] = li.lon_vals
+        var = nco.createVariable(
+            'b', 'f8', ('soil', 'lat', 'lon'), fill_value=-1e20
+        )
+        var.units = '1'
+        var[:] = x
+        var = nco.createVariable('dz', 'f8', ('soil',))
+        var[:] = [0.1, 0.25, 0.65]
+    to_land_points(fpath, li)
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        assert nc.title == 'soil'
+        assert LAND_DIM in nc.dimensions and 'lat' not in nc.dimensions
+        assert is_land_points(nc['b']) and not is_land_points(nc['dz'])
+        assert nc['b'].units == '1'
+        assert nc['b']._FillValue == -1e20
+        np.testing.assert_array_equal(nc['dz'][:], [0.1, 0.25, 0.65])
+        rows, cols = np.nonzero(mask)
+        np.testing.assert_allclose(nc['lat'][:], li.lat_vals[rows])
+        np.testing.assert_allclose(nc['lon'][:], li.lon_vals[cols])
+        grid = read_grid(nc, 'b')
+        np.testing.assert_array_equal(grid.data[:, mask], x[:, mask])
+        np.testing.assert_array_equal(np.ma.getmaskarray(grid)[0], ~mask)
+        np.testing.assert_array_equal(read_grid(nc, 'b', 1), grid[1])
+
+def test_to_land_points_rejects_other_grid(tmp_path):
+    li, mask, _ = random_grid(5)
+    fpath = str(tmp_path / 'other.nc')
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.createDimension('lat', mask.shape[0] + 1)
+        nco.createDimension('lon', mask.shape[1])
+    with pytest.raises(ValueError):
+        to_land_points(fpath, li)
+    assert [p.name for p in tmp_path.iterdir()] == ['other.nc']
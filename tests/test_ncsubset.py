@@ -0,0 +1,120 @@
+import numpy as np
+import netCDF4
+import pytest
+
+from ncsubset import coord_window, netcdf_window, subset_netcdf, subset_many
+
+LAT = np.arange(-89.75, 90., 0.5)
+LON = np.arange(-179.75, 180., 0.5)
+REGION = dict(xmin=70., xmax=90.25, ymin=20.25, ymax=31.)
+
+def write_source(fpath, format='NETCDF4', coords=True):
+    """A small global file: a compressed, chunked (time, lat, lon)
+    variable with a record dimension, and a scalar."""
+    rng = np.random.default_rng(0)
+    lat_dim, lon_dim = ('lat', 'lon') if coords else ('y', 'x')
+    x = rng.random((3, len(LAT), len(LON))).astype(np.float32)
+    storage = {}
+    if format == 'NETCDF4':
+        storage = dict(
+            zlib=True, complevel=4, shuffle=True, chunksizes=(1, 90, 720)
+        )
+    with netCDF4.Dataset(fpath, 'w', format=format) as nco:
+        nco.title = 'WFDEI'
+        nco.createDimension('time', None)
+        nco.createDimension(lat_dim, len(LAT))
+        nco.createDimension(lon_dim, len(LON))
+        if coords:
+            var = nco.createVariable('lat', 'f8', ('lat',))
+            var[:] = LAT
+            var = nco.createVariable('lon', 'f8', ('lon',))
+            var[:] = LON
+        var = nco.createVariable(
+            'Tair', 'f4', ('time', lat_dim, lon_dim), fill_value=1e20,
+            **storage
+        )
+        var.units = 'K'
+        var[:] = x
+        var = nco.createVariable('crs', 'i4')
+        var.assignValue(1)
+    return x
+
+def expected_window():
+    lat = (LAT >= REGION['ymin']) & (LAT <= REGION['ymax'])
+    lon = (LON >= REGION['xmin']) & (LON <= REGION['xmax'])
+    return lat, lon
+
+def test_coord_window_is_inclusive():
+    vals = np.arange(10.)
+    assert coord_window(vals, 2., 5.) == slice(2, 6)
+    assert coord_window(vals, 2.5, 5.5) == slice(3, 6)
+    with pytest.raises(ValueError):
+        coord_window(vals, 20., 30.)
+
+def test_subset_netcdf_window(tmp_path):
+    src_fpath = str(tmp_path / 'global.nc')
+    dst_fpath = str(tmp_path / 'igp.nc')
+    x = write_source(src_fpath)
+    subset_netcdf(src_fpath, dst_fpath, **REGION)
+    lat, lon = expected_window()
+    with netCDF4.Dataset(dst_fpath, 'r') as nc:
+        assert nc.title == 'WFDEI'
+        assert nc.dimensions['time'].isunlimited()
+        np.testing.assert_array_equal(nc['lat'][:], LAT[lat])
+        np.testing.assert_array_equal(nc['lon'][:], LON[lon])
+        var = nc['Tair']
+        assert var.units == 'K' and var._FillValue == np.float32(1e20)
+        np.testing.assert_array_equal(var[:], x[:, lat][:, :, lon])
+        assert nc['crs'].getValue() == 1
+    window = netcdf_window(src_fpath, **REGION)
+    np.testing.assert_array_equal(
+        np.arange(len(LAT))[window['lat']], np.flatnonzero(lat)
+    )
+    np.testing.assert_array_equal(
+        np.arange(len(LON))[window['lon']], np.flatnonzero(lon)
+    )
+    # no temporary file is left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['global.nc', 'igp.nc']
+
+def test_subset_netcdf_keeps_filters_and_chunks(tmp_path):
+    src_fpath = str(tmp_path / 'global.nc')
+    dst_fpath = str(tmp_path / 'igp.nc')
+    write_source(src_fpath)
+    subset_netcdf(src_fpath, dst_fpath, **REGION)
+    lat, lon = expected_window()
+    with netCDF4.Dataset(dst_fpath, 'r') as nc:
+        filters = nc['Tair'].filters()
+        assert filters['zlib'] and filters['shuffle']
+        assert filters['complevel'] == 4
+        # chunks clipped to the window
+        assert nc['Tair'].chunking() == [1, lat.sum(), lon.sum()]
+
+def test_subset_netcdf3(tmp_path):
+    src_fpath = str(tmp_path / 'global.nc')
+    dst_fpath = str(tmp_path / 'igp.nc')
+    x = write_source(src_fpath, format='NETCDF3_CLASSIC')
+    subset_netcdf(src_fpath, dst_fpath, **REGION)
+    lat, lon = expected_window()
+    with netCDF4.Dataset(dst_fpath, 'r') as nc:
+        assert nc.data_model == 'NETCDF3_CLASSIC'
+        np.testing.assert_array_equal(nc['Tair'][:], x[:, lat][:, :, lon])
+
+def test_subset_netcdf_renames_and_adds_coords(tmp_path):
+    src_fpath = str(tmp_path / 'global.nc')
+    x = write_source(src_fpath, coords=False)
+    lat, lon = expected_window()
+    jobs = [
+        dict(
+            src_fpath=src_fpath, dst_fpath=str(tmp_path / fn),
+            rename_dims={'x': 'lon', 'y': 'lat'},
+            lat_vals=LAT, lon_vals=LON, **REGION
+        )
+        for fn in ['a.nc', 'b.nc']
+    ]
+    for dst_fpath in subset_many(jobs, n_workers=2):
+        with netCDF4.Dataset(dst_fpath, 'r') as nc:
+            assert nc['Tair'].dimensions == ('time', 'lat', 'lon')
+            assert nc['lat'].dtype == np.float32
+            np.testing.assert_array_equal(nc['lat'][:], LAT[lat])
+            np.testing.assert_array_equal(nc['lon'][:], LON[lon])
+            np.testing.assert_array_equal(nc['Tair'][:], x[:, lat][:, :, lon])
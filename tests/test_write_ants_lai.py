@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import netCDF4
+import pytest
+
+# The LAI directory is read from the environment on import; tests
+# point the module at a temporary one
+os.environ.setdefault('DATADIR', os.curdir)
+import write_ants_lai
+from write_ants_lai import LYRS, write_lai
+
+class FakeGrid(object):
+    def __init__(self, nlat, nlon):
+        self.nlat, self.nlon = nlat, nlon
+        self.lat_vals = np.linspace(30., 20., nlat)
+        self.lon_vals = np.linspace(70., 90., nlon)
+        self.lat_bnds = np.stack(
+            [self.lat_vals + 0.5, self.lat_vals - 0.5], axis=-1
+        )
+        self.lon_bnds = np.stack(
+            [self.lon_vals - 0.5, self.lon_vals + 0.5], axis=-1
+        )
+
+class FakeRaster(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, band, window=None, masked=False):
+        x = self.data[window.row_off:window.row_off + window.height,
+                      window.col_off:window.col_off + window.width]
+        return np.ma.masked_less(x, 0.) if masked else x.copy()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+@pytest.fixture
+def fake_lai(tmp_path, monkeypatch):
+    """Serve one LAI raster per time point, with some missing cells,
+    on a 7 x 5 grid."""
+    rng = np.random.default_rng(0)
+    lai = rng.uniform(0., 6., (len(LYRS), 7, 5))
+    lai[:, 2, :2] = -1.
+    rasters = {
+        os.path.join(
+            str(tmp_path), 'lai_natural_avg_%d_igp_0.041667Deg.tif' % lyr
+        ): lai[i]
+        for i, lyr in enumerate(LYRS)
+    }
+    monkeypatch.setattr(write_ants_lai, 'DATADIR', str(tmp_path))
+    monkeypatch.setattr(write_ants_lai, 'GRID', FakeGrid(7, 5))
+    monkeypatch.setattr(
+        write_ants_lai.rasterio, 'open',
+        lambda fpath: FakeRaster(rasters[fpath])
+    )
+    return lai
+
+@pytest.mark.parametrize('block_rows', [1, 3, 7])
+def test_write_lai_blocks(tmp_path, fake_lai, block_rows):
+    fpath = write_lai('natural', block_rows=7)
+    expected_fpath = str(tmp_path / 'unblocked.nc')
+    os.replace(fpath, expected_fpath)
+    assert write_lai('natural', block_rows=block_rows) == fpath
+    with netCDF4.Dataset(fpath, 'r') as nc, \
+         netCDF4.Dataset(expected_fpath, 'r') as expected:
+        var = nc['leaf_area_index']
+        assert var.chunking() == [1, block_rows, 5]
+        for nm in expected.variables:
+            np.testing.assert_array_equal(
+                np.ma.getmaskarray(nc[nm][:]),
+                np.ma.getmaskarray(expected[nm][:])
+            )
+            np.testing.assert_array_equal(nc[nm][:], expected[nm][:])
+        lai = var[:]
+        np.testing.assert_array_equal(
+            np.ma.getmaskarray(lai), fake_lai < 0.
+        )
+        valid = fake_lai >= 0.
+        np.testing.assert_array_equal(lai[valid], fake_lai[valid])
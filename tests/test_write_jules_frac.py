@@ -0,0 +1,204 @@
+import numpy as np
+import netCDF4
+import pytest
+
+import write_jules_frac
+from write_jules_frac import (
+    normalise_jules_frac, get_jules_frac, iter_jules_frac_blocks
+)
+from icrisat import export_frac_template
+from landpoints import LandIndex
+
+def baseline_normalise(frac):
+    """The normalisation of the original get_jules_frac."""
+    frac = frac.copy()
+    frac_sum = frac.sum(axis=0)
+    frac_sum = np.nan_to_num(frac_sum)
+    frac = np.divide(frac, frac_sum, out=np.zeros_like(frac), where=frac_sum>0)
+    ice_orig = frac[-1, ...]
+    soil_orig = frac[-2, ...]
+    ice = np.zeros_like(ice_orig).astype(bool)
+    ice[ice_orig > 0.5] = True
+    not_ice = np.logical_not(ice)
+    frac *= not_ice[None, ...]
+    frac[-1][ice] = 1
+    frac[-1][not_ice] = 0
+    frac[-2] = (soil_orig + ice_orig) * not_ice
+    frac_sum = frac.sum(axis=0)
+    return np.divide(frac, frac_sum, out=np.zeros_like(frac), where=frac_sum>0)
+
+def random_frac(seed=0, ntype=5, shape=(7, 9)):
+    """Unnormalised fractions with some empty, some ice and some
+    partly icy cells, and a land mask."""
+    rng = np.random.default_rng(seed)
+    frac = rng.uniform(0., 2., (ntype,) + shape)
+    frac[:, 0, :2] = 0.
+    frac[-1, 1, :3] = 50.
+    frac[-1, 2, :3] = 0.5
+    land = rng.random(shape) > 0.2
+    return frac, land
+
+class FakeGrid(object):
+    """A north-up raster grid."""
+    def __init__(self, land_frac):
+        self.land_frac = land_frac
+        self.nlat, self.nlon = land_frac.shape
+        self.lat_vals = np.linspace(30., 20., self.nlat)
+        self.lon_vals = np.linspace(70., 90., self.nlon)
+
+    def land_frac_rows(self, row0, row1):
+        return self.land_frac[row0:row1]
+
+class FakeRaster(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, band, out=None, masked=False, window=None):
+        x = self.data
+        if window is not None:
+            x = x[window.row_off:window.row_off + window.height,
+                  window.col_off:window.col_off + window.width]
+        if out is None:
+            return x.copy()
+        out[...] = x
+        return out
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+@pytest.fixture
+def fake_rasters(monkeypatch):
+    """Serve the fractions of `random_frac` as rasters named
+    'lc0', 'lc1', ..., on a grid with its land mask."""
+    frac, land = random_frac()
+    names = ['lc' + str(i) for i in range(frac.shape[0])]
+    rasters = dict(zip(names, frac))
+    monkeypatch.setattr(
+        write_jules_frac, 'lc_frac_fn', lambda nm, year: nm
+    )
+    monkeypatch.setattr(
+        write_jules_frac.rasterio, 'open',
+        lambda fpath: FakeRaster(rasters[fpath])
+    )
+    grid = FakeGrid(land.astype(np.float64))
+    monkeypatch.setattr(write_jules_frac, 'region_grid', lambda: grid)
+    return names, frac, land
+
+def test_normalise_jules_frac_matches_baseline():
+    frac, land = random_frac()
+    expected = baseline_normalise(frac)
+    expected[:, ~land] = 0.
+    out = normalise_jules_frac(frac.copy(), land)
+    np.testing.assert_array_equal(out, expected)
+
+def test_normalise_jules_frac_float32():
+    frac, land = random_frac(1)
+    expected = normalise_jules_frac(frac.copy(), land)
+    out = normalise_jules_frac(frac.astype(np.float32), land)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, expected, rtol=0., atol=1e-6)
+
+def test_get_jules_frac(fake_rasters):
+    names, frac, land = fake_rasters
+    out = get_jules_frac(2000, names)
+    expected = baseline_normalise(frac)
+    np.testing.assert_array_equal(np.ma.getmaskarray(out)[0], ~land)
+    np.testing.assert_array_equal(out[:, land], expected[:, land])
+
+@pytest.mark.parametrize('block_rows', [1, 3, 7, 10])
+def test_iter_jules_frac_blocks(fake_rasters, block_rows):
+    names, frac, land = fake_rasters
+    expected = get_jules_frac(2000, names)
+    nrow = 0
+    for row0, row1, block in iter_jules_frac_blocks(2000, names, block_rows):
+        assert row0 == nrow and row1 - row0 <= block_rows
+        np.testing.assert_array_equal(
+            np.ma.getmaskarray(block), np.ma.getmaskarray(expected)[:, row0:row1]
+        )
+        np.testing.assert_array_equal(block.data, expected.data[:, row0:row1])
+        nrow = row1
+    assert nrow == frac.shape[1]
+
+def write_ants_template(fpath, frac, lat_vals, lon_vals):
+    """The fractions as an ANTS-format file, as read by
+    07_select-wfdei-ancil-data.py."""
+    with netCDF4.Dataset(fpath, 'w') as nco:
+        nco.createDimension('dim0', frac.shape[0])
+        nco.createDimension('latitude', len(lat_vals))
+        nco.createDimension('longitude', len(lon_vals))
+        var = nco.createVariable('pseudo_level', 'i4', ('dim0',))
+        var.units = '1'
+        var.long_name = 'pseudo_level'
+        var[:] = np.arange(1, frac.shape[0] + 1)
+        var = nco.createVariable('latitude', 'f8', ('latitude',))
+        var[:] = lat_vals
+        var = nco.createVariable('longitude', 'f8', ('longitude',))
+        var[:] = lon_vals
+        var = nco.createVariable(
+            'land_cover_lccs', 'f8', ('dim0', 'latitude', 'longitude'),
+            fill_value=1e20
+        )
+        var.standard_name = 'land_cover_lccs'
+        var.units = '1'
+        var[:] = frac
+
+@pytest.mark.parametrize('block_rows', [None, 2, 7])
+def test_write_jules_frac_land_points_line_up(tmp_path, fake_rasters,
+                                              block_rows):
+    names, frac, land = fake_rasters
+    grid = write_jules_frac.region_grid()
+    # The shared index, as written by 07_select-wfdei-ancil-data.py:
+    # latitude increasing, and a (basin) mask within the raster's land
+    mask = np.flip(land, axis=0).copy()
+    mask[0, :] = False
+    index_fpath = str(tmp_path / 'land_index.nc')
+    LandIndex(mask, np.flip(grid.lat_vals), grid.lon_vals).write(index_fpath)
+    land_index = LandIndex.read(index_fpath)
+
+    frac_fpath = str(tmp_path / 'frac.nc')
+    write_jules_frac.write_jules_frac(
+        2000, names, frac_fpath, land_index=land_index,
+        block_rows=block_rows
+    )
+    ancil_fpath = str(tmp_path / 'veg_frac.nc')
+    template_fpath = str(tmp_path / 'template.nc')
+    write_ants_template(
+        template_fpath, get_jules_frac(2000, names),
+        grid.lat_vals, grid.lon_vals
+    )
+    export_frac_template(template_fpath, ancil_fpath, land_index)
+
+    with netCDF4.Dataset(frac_fpath, 'r') as nc, \
+         netCDF4.Dataset(ancil_fpath, 'r') as ancil:
+        np.testing.assert_array_equal(
+            nc['land_index'][:], ancil['land_index'][:]
+        )
+        np.testing.assert_array_equal(nc['latitude'][:], ancil['lat'][:])
+        np.testing.assert_array_equal(nc['longitude'][:], ancil['lon'][:])
+        out = nc['frac'][:]
+        assert not np.ma.getmaskarray(out).any()
+        np.testing.assert_array_equal(out, ancil['land_cover_lccs'][:])
+        # each point holds the raster cell at its coordinates
+        rows = np.abs(
+            nc['latitude'][:][:, None] - grid.lat_vals
+        ).argmin(axis=1)
+        cols = np.abs(
+            nc['longitude'][:][:, None] - grid.lon_vals
+        ).argmin(axis=1)
+        expected = get_jules_frac(2000, names)
+        np.testing.assert_array_equal(out, expected[:, rows, cols])
+
+def test_write_jules_frac_rejects_other_grid(tmp_path, fake_rasters):
+    names, frac, land = fake_rasters
+    grid = write_jules_frac.region_grid()
+    land_index = LandIndex(land, grid.lat_vals + 0.5, grid.lon_vals)
+    with pytest.raises(ValueError):
+        write_jules_frac.write_jules_frac(
+            2000, names, str(tmp_path / 'frac.nc'), land_index=land_index
+        )
@@ -2,337 +2,182 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import shutil
+import click
 import numpy as np
 import netCDF4
-import rasterio
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python')
+)
+from icrisat import (
+    load_icrisat_store, icrisat_store_fpaths, get_static_terms,
+    adjust_frac_parallel, iter_adjusted_tiles, create_multi_year_frac_netcdf,
+    write_frac_year, write_frac_times, write_frac_rows
+)
 
 DATADIR = '/home/sm510/projects/ganges-water-machine/data'
 
 # The purpose of this script is to adjust the calculated
 # agricultural land cover fractions with fractions derived
 # from ICRISAT.
-# 
+#
 # Notes:
 # ======
 # 1. Double, triple and continuous irrigated areas are derived
 #    from time series of vegetation indices
 # 2. Currently we add triple and continuous irrigated areas
 #    to double irrigated areas
-
-# ##################################### #
-# Define some constants
-# ##################################### #
-
-# '**' = irrigated
-land_covers = [
-    'tree_broadleaf',           # 0  | 1
-    'tree_needleleaf',          # 1  | 2
-    'c3_grass',                 # 2  | 3
-    'c4_grass',                 # 3  | 4
-    'shrub',                    # 4  | 5
-    'rainfed',                  # 5  | 6
-    'irrigated_single_season',  # 6  | 7 **  [kharif]
-    'irrigated_double_season',  # 7  | 8 **  [kharif, rabi]
-    'irrigated_triple_season',  # 8  | 9 **  [kharif, rabi, zaid]
-    'irrigated_continuous',     # 9  | 10 ** [continuous]
-    'fallow',                   # 10 | 11
-    'urban',                    # 11 | 12
-    'water',                    # 12 | 13
-    'bare_soil',                # 13 | 14
-    'snow_ice'                  # 14 | 15
-]
-
-# Agricultural land covers
-agri_land_covers = [
-    'rainfed',
-    'irrigated_single_season',
-    'irrigated_double_season',
-    'irrigated_triple_season',
-    'irrigated_continuous',
-    'fallow'
-]
-
-# Land covers which can change to accommodate
-# changes in agricultural area
-can_vary = [
-    'tree_broadleaf',
-    'tree_needleleaf',
-    'c3_grass',
-    'c4_grass',
-    'bare_soil'
-]
-
-# Land covers which cannot be changed
-cannot_vary = [
-    'urban',
-    'water',
-    'snow_ice'
-]
-
-# ##################################### #
-# Loop through years
-# ##################################### #
-
-def read_icrisat_frac(yr, nm):
-    fn = "icrisat_" + nm + "_frac_" + str(yr) + "_india_0.500000Deg.tif"
-    fpath = os.path.join(DATADIR, "irrigated_area_maps", fn)
-    with rasterio.open(fpath) as ds:
-        x = ds.read(1, masked=True).squeeze()
-    return x
-
-india_frac_fpath = os.path.join(
-    DATADIR,
-    "irrigated_area_maps",
-    "icrisat_india_frac.tif"
-)
-with rasterio.open(india_frac_fpath) as ds:
-    india_frac = ds.read(1, masked=True).squeeze()
-    india_mask = (india_frac > 0) * 1.
+# 3. The terms which do not depend on the ICRISAT data are
+#    computed once, and all years are then adjusted in a
+#    single vectorized pass (see python/icrisat.py)
+# 4. The ICRISAT rasters are decoded once into a memory-mapped
+#    store, which is only rebuilt when the rasters change
+# 5. By default all years are written to a single file, in the
+#    orientation read by JULES, with one chunk per year. Single
+#    year files can be exported from it (see icrisat.export_frac_year)
+#    or written directly with `--output-mode per-year`
+# 6. With `--float32` the reallocation is carried out in single
+#    precision; results differ from double precision by at most
+#    ~1e-6 (see icrisat.adjust_frac)
+# 7. With `--block-rows` the domain is processed in blocks of rows,
+#    read from the template and the ICRISAT store and written to the
+#    output by hyperslab, so that memory use does not depend on the
+#    size of the domain. Blocks are split across the `-j` workers
 
 ICRISAT_START_YEAR = 1979
 ICRISAT_END_YEAR = 2015
-icrisat_yrs = np.arange(
-    ICRISAT_START_YEAR,
-    ICRISAT_END_YEAR + 1
-)
-
-for yr in icrisat_yrs:
-    
-    # Load the new irrigated area fractions with which
-    # we are to replace the current JULES fractions
-    target_rain_frac = read_icrisat_frac(yr, "rainfed")
-    target_irr1_frac = read_icrisat_frac(yr, "irrigated_single")
-    target_irr2_frac = read_icrisat_frac(yr, "irrigated_double")
-    target_irr3_frac = read_icrisat_frac(yr, "irrigated_triple")
-    target_cont_frac = read_icrisat_frac(yr, "irrigated_continuous")
 
-    target_sum = np.sum(
-        np.ma.stack(
-            [target_rain_frac,
-             target_irr1_frac,
-             target_irr2_frac,
-             target_irr3_frac,
-             target_cont_frac], axis=0
-        ), axis=0
+def multi_year_frac_fn(datadir, yrs):
+    return os.path.join(
+        datadir,
+        'jules_frac_5pft_ants_' + str(yrs[0]) + '_'
+        + str(yrs[-1]) + '_CUSTOM_igp_adjusted.nc'
     )
 
-    # Convert the target fractions to fractions
-    # of the total cropland area
-    def div_fun(x):
-        res = np.divide(
-            x.data,
-            target_sum.data,
-            out=np.zeros_like(target_sum.data),
-            where=target_sum>0
-        )
-        res = np.ma.array(res, mask=x.mask)
-        return res
-    
-    target_rain_frac = div_fun(target_rain_frac)
-    target_irr1_frac = div_fun(target_irr1_frac)
-    target_irr2_frac = div_fun(target_irr2_frac)
-    target_irr3_frac = div_fun(target_irr3_frac)
-    target_cont_frac = div_fun(target_cont_frac)
-    
-    # Preallocate dict to store new land cover fractions
-    target = {}
-    index = {}
-    for idx, val in enumerate(land_covers):
-        target[val] = np.zeros_like(target_sum)
-        index[val] = idx
-
-    # Copy JULES input file
-    jules_frac_fn = os.path.join(
-        DATADIR, 'netcdf', 'jules_frac_5pft_ants_2015_CUSTOM_igp.nc'
-    )
-    new_jules_frac_fn = os.path.join(
-        DATADIR,
+def year_frac_fn(datadir, yr):
+    return os.path.join(
+        datadir,
         'jules_frac_5pft_ants_' + str(yr) + '_CUSTOM_igp_adjusted.nc'
-    )    
-    # Copy file
-    shutil.copyfile(jules_frac_fn, new_jules_frac_fn)
-    ds = netCDF4.Dataset(new_jules_frac_fn, 'r+')
-    
-    # Extract the portion of the data covered by ICRISAT data
-    current_frac = ds['land_cover_lccs'][:]
-    current_frac_india = current_frac * india_frac
-    current_frac_not_india = current_frac * (1. - india_frac)
-
-    grass_idx = tuple(index[nm] for nm in ['c3_grass', 'c4_grass'])
-    c3_grass_idx = grass_idx[0]
-    c4_grass_idx = grass_idx[1]
-
-    # TODO: implement changing irrigated area in Pakistan, Bangladesh, Nepal
-    
-    # EXPERIMENT: remove this section [i.e. keep agricultural land]
-    # *For now*, remove agricultural land from outside India,
-    # and add them to C3/C4 grass
-    # Add fallow to natural grass
-    # grass_idx = tuple(index[nm] for nm in ['c3_grass', 'c4_grass'])
-    # c3_grass_idx = grass_idx[0]
-    # c4_grass_idx = grass_idx[1]
-    # grass_sum = np.sum(current_frac_not_india[grass_idx, ...], axis=0)
-    # c3_grass_frac = np.divide(
-    #     current_frac_not_india[c3_grass_idx, ...].data,
-    #     grass_sum.data,
-    #     out=np.ones_like(grass_sum.data),
-    #     where=grass_sum>0
-    # )
-    # agri_idx = tuple(index[nm] for nm in agri_land_covers)
-    # agri_not_india = np.sum(current_frac_not_india[agri_idx, ...], axis=0)
-    # current_frac_not_india[c3_grass_idx, ...] += (
-    #     agri_not_india * c3_grass_frac
-    # )
-    # current_frac_not_india[c4_grass_idx, ...] += (
-    #     agri_not_india * (1 - c3_grass_frac)
-    # )    
-    # current_frac_not_india[agri_idx, ...] *= 0.  # set to zero
-    
-    # Get relative quantities, and work with these
-    current_frac_india_sum = np.sum(
-        current_frac_india, axis=0
-    )
-    # np.divide(...) does not preserve mask, so work
-    # with data only then reapply mask
-    current_frac_india_rel = np.divide(
-        current_frac_india.data,
-        current_frac_india_sum.data,
-        out=np.zeros_like(current_frac_india.data),
-        where=current_frac_india_sum.data>0
     )
-    current_frac_india_rel = np.ma.array(
-        current_frac_india_rel,
-        mask=current_frac.mask
-    )
-    india_rel_sum = np.sum(
-        current_frac_india_rel,
-        axis=0
-    )    
-    # These fractions must stay the same
-    cannot_vary_idx = tuple([index[nm] for nm in cannot_vary])
-    cannot_vary_sum = np.sum(
-        current_frac_india_rel[cannot_vary_idx, ...],
-        axis=0
-    )
-
-    # The maximum fraction available for agriculture is the
-    # total (i.e. 1.) minus the sum of land covers which are
-    # not allowed to change
-    max_agri_frac = np.clip(india_rel_sum - cannot_vary_sum, 0, 1.)
-    target_sum_adj = np.clip(target_sum, 0., max_agri_frac)
-    # Multiply target fractions by the revised target sum
-    target_rain_frac *= target_sum_adj
-    target_irr1_frac *= target_sum_adj
-    target_irr2_frac *= target_sum_adj
-    target_irr3_frac *= target_sum_adj
-    target_cont_frac *= target_sum_adj
 
-    # Calculate the area remaining after having
-    # allocated unvarying and agricultural land covers
-    remaining_area = np.clip(india_rel_sum - cannot_vary_sum - target_sum, 0., 1.)
+def adjust_tiled(datadir, jules_frac_fn, cache_dir, icrisat_yrs,
+                 output_mode, dtype, block_rows, n_workers):
+    """As `main`, processing the domain in blocks of `block_rows`
+    rows (see icrisat.iter_adjusted_tiles)."""
+    target_frac_fpath, india_frac_fpath = icrisat_store_fpaths(cache_dir)
+    if output_mode == 'multi-year':
+        ncos = [create_multi_year_frac_netcdf(
+            multi_year_frac_fn(datadir, icrisat_yrs), jules_frac_fn,
+            chunk_rows=block_rows
+        )]
+        write_frac_times(ncos[0], icrisat_yrs)
+    else:
+        ncos = []
+        for yr in icrisat_yrs:
+            shutil.copyfile(jules_frac_fn, year_frac_fn(datadir, yr))
+            ncos.append(netCDF4.Dataset(year_frac_fn(datadir, yr), 'r+'))
+    for row0, row1, frac, land in iter_adjusted_tiles(
+            jules_frac_fn, target_frac_fpath, india_frac_fpath,
+            block_rows, dtype, n_workers):
+        frac = np.ma.array(
+            frac, mask=np.broadcast_to(~land, frac.shape)
+        )
+        if output_mode == 'multi-year':
+            write_frac_rows(ncos[0], row0, row1, frac)
+        else:
+            for i, nco in enumerate(ncos):
+                nco['land_cover_lccs'][:, row0:row1, :] = frac[i, ...]
+    for nco in ncos:
+        nco.close()
+
+@click.command()
+@click.option(
+    '--datadir', 'datadir', default=DATADIR, type=str,
+    help='Data directory containing the ICRISAT maps and JULES template.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of processes across which years are split.'
+)
+@click.option(
+    '--cache-dir', 'cache_dir', default=None, type=str,
+    help='Directory in which to keep the decoded ICRISAT rasters '
+    '(default: <datadir>/cache/icrisat).'
+)
+@click.option(
+    '--output-mode', 'output_mode', default='multi-year',
+    type=click.Choice(['multi-year', 'per-year']),
+    help='Write one multi-year file, or one template copy per year.'
+)
+@click.option(
+    '--float32', 'float32', is_flag=True, default=False,
+    help='Carry out the reallocation in single precision.'
+)
+@click.option(
+    '--block-rows', 'block_rows', default=None, type=int,
+    help='Process the domain in blocks of this many rows, for grids '
+    'too large to hold in memory.'
+)
+def main(datadir, n_workers, cache_dir, output_mode, float32, block_rows):
+    if cache_dir is None:
+        cache_dir = os.path.join(datadir, 'cache', 'icrisat')
 
-    # Add fallow to natural grass
-    fallow_idx = index['fallow']
-    grass_sum = np.sum(current_frac_india_rel[grass_idx, ...], axis=0)
-    c3_grass_frac = np.divide(
-        current_frac_india_rel[c3_grass_idx, ...].data,
-        grass_sum.data,
-        out=np.ones_like(grass_sum.data),
-        where=grass_sum>0
-    )
-    current_frac_india_rel[c3_grass_idx, ...] += (
-        current_frac_india_rel[fallow_idx, ...] * c3_grass_frac
+    icrisat_yrs = np.arange(
+        ICRISAT_START_YEAR,
+        ICRISAT_END_YEAR + 1
     )
-    current_frac_india_rel[c4_grass_idx, ...] += (
-        current_frac_india_rel[fallow_idx, ...] * (1 - c3_grass_frac)
+    target_frac, india_frac, target_frac_fpath = load_icrisat_store(
+        datadir, icrisat_yrs, cache_dir, block_rows
     )
-    current_frac_india_rel[fallow_idx, ...] *= 0.
-    
-    # Find the current fractions of land covers which can vary
-    can_vary_idx = tuple(index[nm] for nm in can_vary)
-    other_frac = current_frac_india_rel[can_vary_idx, ...]
-    other_frac_sum = np.sum(other_frac, axis=0)
-    other_frac_rel = np.divide(
-        other_frac,
-        other_frac_sum[None, ...],
-        out=np.zeros_like(other_frac),
-        where=other_frac_sum>0
-    )
-
-    # Calculate whether the target agricultural fraction
-    # is greater or less than the current agricultural fraction
-    agri_idx = tuple(index[nm] for nm in agri_land_covers)
-    agri_frac = current_frac_india_rel[agri_idx, ...]
-    agri_frac_sum = np.sum(agri_frac, axis=0)
-    # The target agri area is less than the current agri area
-    lt_index = target_sum <= agri_frac_sum
-    # The target agri area is greater than the current agri area
-    gt_index = target_sum > agri_frac_sum
-    # Modify values
-    for frac_idx, frac_nm in enumerate(can_vary):
-        idx = index[frac_nm]
-        # In the case where target sum is less than the
-        # current agricultural fraction, we will use
-        # natural c3/c4 grass as fill, to avoid increasing
-        # the forest area without justification
-        target[frac_nm][lt_index] = current_frac_india_rel[idx, ...][lt_index]
-        # Otherwise, scale all natural land covers
-        target[frac_nm][gt_index] = (
-            other_frac_rel[frac_idx, ...]
-            * remaining_area
-        )[gt_index]
-
-    diff = remaining_area - np.sum(np.stack(target.values()), axis=0)
-    target['c3_grass'][lt_index] += (diff * c3_grass_frac)[lt_index]
-    target['c4_grass'][lt_index] += (diff * (1. - c3_grass_frac))[lt_index]
-        
-    # Add other land covers
-    for frac_idx, frac_nm in enumerate(cannot_vary):
-        idx = index[frac_nm]
-        target[frac_nm] = current_frac_india_rel[idx, ...]
-        
-    # Add agricultural land covers
-    target['rainfed'] = target_rain_frac
-    target['irrigated_single_season'] = target_irr1_frac
-    target['irrigated_double_season'] = target_irr2_frac
-    target['irrigated_triple_season'] = target_irr3_frac
-    target['irrigated_continuous'] = target_cont_frac
-
-    updated_india_frac = np.ma.stack(target.values())
-
-    # Multiply by india_frac to convert relative values to actual values
-    updated_india_frac *= india_frac
 
-    # Add to current_frac_not_india to combine datasets
-    updated_frac = (
-        current_frac_not_india + updated_india_frac
+    # JULES input file used as a template
+    jules_frac_fn = os.path.join(
+        datadir, 'netcdf', 'jules_frac_5pft_ants_2015_CUSTOM_igp.nc'
     )
+    if block_rows is not None:
+        adjust_tiled(
+            datadir, jules_frac_fn, cache_dir, icrisat_yrs, output_mode,
+            np.float32 if float32 else np.float64, block_rows, n_workers
+        )
+        return
 
-    # THIS IS WHERE THE PROBLEM OCCURS
-    # It happens because `current_frac_not_india` actually contains values > 0 for grid cells in India, because ICRISAT is incomplete
-
-    # FIXME (we can definitely improve this method)
-    # Add triple and continuous irrigated area to double
-    updated_frac[7, ...] += updated_frac[8, ...]
-    updated_frac[7, ...] += updated_frac[9, ...]
-    updated_frac[8, ...] *= 0.
-    updated_frac[9, ...] *= 0.
+    with netCDF4.Dataset(jules_frac_fn, 'r') as ds:
+        current_frac = ds['land_cover_lccs'][:]
 
-    # Cover any precision errors by dividing by sum
-    updated_frac_sum = np.sum(updated_frac, axis=0)
-    if np.any(~np.isclose(updated_frac_sum, 1.0)):
-        raise ValueError    
-    updated_frac = np.divide(
-        updated_frac.data,
-        updated_frac_sum.data,
-        out=np.zeros_like(updated_frac.data),
-        where=updated_frac_sum.data > 0
+    static = get_static_terms(
+        current_frac, india_frac,
+        dtype=np.float32 if float32 else np.float64
     )
-    updated_frac = np.ma.array(
-        updated_frac,
-        mask=current_frac.mask
-    )    
-    # Now add target back to netCDF4
-    ds['land_cover_lccs'][:] = updated_frac
-    ds.close()
+    mask = np.broadcast_to(~static['land'], current_frac.shape)
+    if n_workers > 1:
+        # Let each worker map its own years from the store
+        target_frac = target_frac_fpath
+    updated_frac = adjust_frac_parallel(target_frac, static, n_workers)
+
+    if output_mode == 'multi-year':
+        new_jules_frac_fn = multi_year_frac_fn(datadir, icrisat_yrs)
+        nco = create_multi_year_frac_netcdf(new_jules_frac_fn, jules_frac_fn)
+        for i, yr in enumerate(icrisat_yrs):
+            write_frac_year(
+                nco, i, yr,
+                np.ma.array(updated_frac[i, ...], mask=mask)
+            )
+        nco.close()
+        return
+
+    for i, yr in enumerate(icrisat_yrs):
+        new_jules_frac_fn = year_frac_fn(datadir, yr)
+        # Copy file
+        shutil.copyfile(jules_frac_fn, new_jules_frac_fn)
+        ds = netCDF4.Dataset(new_jules_frac_fn, 'r+')
+        # Now add target back to netCDF4
+        ds['land_cover_lccs'][:] = np.ma.array(
+            updated_frac[i, ...],
+            mask=mask
+        )
+        ds.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import click
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python')
+)
+from ncsubset import netcdf_window, subset_netcdf
+from filecache import read_manifest, write_manifest
+
+DATADIR = '/mnt/scratch/scratch/data/WFDEI/WFDEI_3h'
+OUTDIR = os.path.join(
+    os.environ['HOME'],
+    'projects/ganges-water-machine/data/wfdei/WFDEI_3h_IGP/WFDEI_3h_IGP'
+)
+
+YEAR0 = 1979
+YEAR1 = 2016
+
+XMIN = 60.0
+XMAX = 100.0
+YMIN = 20.0
+YMAX = 40.0
+
+VARS = [
+    'LWdown_WFDEI', 'Rainf_WFDEI_CRU', 'Rainf_WFDEI_GPCC', 'SWdown_WFDEI',
+    'PSurf_WFDEI', 'Wind_WFDEI', 'Snowf_WFDEI_CRU', 'Snowf_WFDEI_GPCC',
+    'Qair_WFDEI', 'Tair_WFDEI'
+]
+
+# Cut the 3-hourly WFDEI forcing to the IGP region, one monthly file
+# per variable, as `ncks -d lon,XMIN,XMAX -d lat,YMIN,YMAX` did:
+#
+# 1. (variable, month) jobs run on a process pool; the lat/lon
+#    window is computed once per variable
+# 2. An output is skipped if it is newer than its input and than
+#    the time the region was last changed (recorded in
+#    `<VAR>/subset.json`), so an interrupted run resumes where it
+#    stopped. Outputs of the former `ncks` script, which have no
+#    manifest, count as up to date if the region is the default
+#    one it used; those of an earlier version of this script (see
+#    SUBSET_VERSION) are redone
+# 3. Outputs are written to a temporary file and renamed, so a
+#    partial file is never mistaken for a finished one
+# 4. A file which cannot be subset does not stop the others; the
+#    failures are listed at the end, and the script exits non-zero
+
+# Version of the outputs recorded in the manifest. Version 2 keeps
+# the compression and chunking of the source, which version 1
+# dropped.
+SUBSET_VERSION = 2
+
+def forcing_fpath(datadir, var, year, month):
+    return os.path.join(
+        datadir, var, var + '_' + str(year) + '%02d' % month + '.nc'
+    )
+
+def subset_fpath(outdir, var, year, month):
+    return os.path.join(
+        outdir, var, var + '_' + str(year) + '%02d' % month + '_IGP.nc'
+    )
+
+def is_up_to_date(ifile, ofile, since):
+    """Whether `ofile` exists and is newer than both `ifile` and
+    the time at which the current region was set.
+    """
+    if not os.path.exists(ofile):
+        return False
+    mtime = os.path.getmtime(ofile)
+    return mtime >= os.path.getmtime(ifile) and mtime >= since
+
+def _subset_job(job):
+    subset_netcdf(**job)
+    return os.path.getsize(job['src_fpath'])
+
+@click.command()
+@click.option('--datadir', default=DATADIR, type=str)
+@click.option('--outdir', default=OUTDIR, type=str)
+@click.option('--year0', default=YEAR0, type=int)
+@click.option('--year1', default=YEAR1, type=int)
+@click.option(
+    '--bbox', nargs=4, type=float, default=(XMIN, XMAX, YMIN, YMAX),
+    help='Region as XMIN XMAX YMIN YMAX.'
+)
+@click.option(
+    '-v', '--variable', 'variables', multiple=True, default=VARS,
+    help='Forcing variable(s) to subset.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of files subset concurrently.'
+)
+@click.option(
+    '--force', is_flag=True, default=False,
+    help='Subset every file, even if its output is up to date.'
+)
+def main(datadir, outdir, year0, year1, bbox, variables, n_workers, force):
+    xmin, xmax, ymin, ymax = bbox
+    region = [xmin, xmax, ymin, ymax]
+    months = [
+        (year, month)
+        for year in range(year0, year1 + 1) for month in range(1, 13)
+    ]
+    jobs = []
+    n_skipped = 0
+    for var in variables:
+        os.makedirs(os.path.join(outdir, var), exist_ok=True)
+        manifest_fpath = os.path.join(outdir, var, 'subset.json')
+        manifest = read_manifest(manifest_fpath)
+        if manifest is None:
+            # Outputs of the `ncks` script cut the default region,
+            # compressed as their sources
+            since = 0. if region == [XMIN, XMAX, YMIN, YMAX] else time.time()
+            manifest = {
+                'region': region, 'since': since, 'version': SUBSET_VERSION
+            }
+            write_manifest(manifest_fpath, manifest)
+        elif manifest['region'] != region \
+             or manifest.get('version') != SUBSET_VERSION:
+            # Outputs cut before the region was (re)set, or by an
+            # earlier version, are stale
+            manifest = {
+                'region': region, 'since': time.time(),
+                'version': SUBSET_VERSION
+            }
+            write_manifest(manifest_fpath, manifest)
+        window = netcdf_window(
+            forcing_fpath(datadir, var, *months[0]), xmin, xmax, ymin, ymax
+        )
+        for year, month in months:
+            ifile = forcing_fpath(datadir, var, year, month)
+            ofile = subset_fpath(outdir, var, year, month)
+            if not force and is_up_to_date(ifile, ofile, manifest['since']):
+                n_skipped += 1
+                continue
+            jobs.append(dict(
+                src_fpath=ifile, dst_fpath=ofile,
+                xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                window=window
+            ))
+
+    print(
+        str(len(jobs)) + ' files to subset, '
+        + str(n_skipped) + ' already up to date'
+    )
+    t0 = time.time()
+    n_bytes = 0
+    failed = []
+    with ProcessPoolExecutor(max(n_workers, 1)) as pool:
+        futures = {pool.submit(_subset_job, job): job for job in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            # A failed file is reported, and the others are still
+            # written; an interrupted or failed run resumes from them
+            try:
+                n_bytes += future.result()
+            except Exception as err:
+                failed.append((futures[future]['src_fpath'], err))
+                print(
+                    'Failed to subset ' + futures[future]['src_fpath']
+                    + ': ' + repr(err), file=sys.stderr
+                )
+            if i % 100 == 0 or i == len(futures):
+                elapsed = max(time.time() - t0, 1e-9)
+                print(
+                    '%d/%d files, %.1f files/s, %.1f MB/s read'
+                    % (i, len(futures), i / elapsed,
+                       n_bytes / elapsed / 1e6)
+                )
+    if failed:
+        print(
+            str(len(failed)) + ' of ' + str(len(jobs))
+            + ' files could not be subset:', file=sys.stderr
+        )
+        for fpath, err in sorted(failed, key=lambda x: x[0]):
+            print('  ' + fpath + ': ' + repr(err), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
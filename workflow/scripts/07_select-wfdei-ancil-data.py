@@ -2,16 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
-import shutil
-# import click
+import sys
+import datetime
+import click
 import numpy as np
 import netCDF4
 import xarray
 import rioxarray
-import pandas as pd
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python')
+)
+from icrisat import export_frac_year, export_frac_template
+from ncsubset import subset_many
+from climatology import cyclic_weights, interpolate_block, to_days
+from filecache import ArtifactCache
+from landpoints import LAND_DIM, LandIndex, read_grid, to_land_points
 
 DATADIR='../data-raw/wfdei_ancils'
 OUTDIR='../data/wfdei/ancils'
+LATLON_FPATH='/mnt/scratch/scratch/data/WFDEI/WFDEI_3h/LWdown_WFDEI/LWdown_WFDEI_197901.nc'
 try:
     os.makedirs(OUTDIR)
 except OSError:
@@ -22,94 +32,141 @@ XMAX=100.0
 YMIN=20.0
 YMAX=40.0
 
-def main():
-    
-    # Extract lat vals from raw met file
-    latlon = xarray.open_dataset(
-        "/mnt/scratch/scratch/data/WFDEI/WFDEI_3h/LWdown_WFDEI/LWdown_WFDEI_197901.nc",
-        decode_times=False
-    )
-    lat_vals = latlon['lat'].values
-    lon_vals = latlon['lon'].values
-    latlon.close()
+# (file name, output suffix, dimension renaming) for each global
+# ancillary which is cut to the IGP region
+XY = {'x': 'lon', 'y': 'lat'}
+ANCILS = [
+    ('topoidx_WFDEI_0p5_2D_global.nc', '_igp.nc', XY),
+    ('WFDEI-long-lat-2d.nc', '_igp.nc', XY),
+    ('WFD-EI-LandFraction2d.nc', '_south_asia.nc', XY),
+    ('qrparm.veg.frac2d.nc', '_igp.nc', dict(XY, z='dim0')),
+    ('qrparm.veg.func2d.nc', '_igp.nc', dict(XY, z='dim1')),
+    ('qrparm.soil_HWSD_class3_van_genuchten2d.nc', '_igp.nc', XY),
+    # This file already contains lat/lon dimensions/variables
+    ('qrparm.soil_HWSD_class3_van_genuchtenNew_NewSoilAlbedo-rfu-2D-LatLon-grid.nc', '_igp.nc', None),
+    ('qrparm.soil_HWSD_cont_cosby2d.nc', '_igp.nc', XY)
+]
+
+# Soil subsets, and their saturated water content variable
+SOILS = [
+    ('qrparm.soil_HWSD_class3_van_genuchten2d_igp.nc', 'field332'),
+    ('qrparm.soil_HWSD_class3_van_genuchtenNew_NewSoilAlbedo-rfu-2D-LatLon-grid_igp.nc', 'sm_sat'),
+    ('qrparm.soil_HWSD_cont_cosby2d_igp.nc', 'field332')
+]
+
+# Index of the land points of the basin-masked domain, written with
+# --land-points and shared by 09_create-irrig-schedule.py
+LAND_INDEX_FNAME = 'jules_land_index_igp.nc'
+
+def add_lat_lon(ncout, lat_vals, lon_vals, land_index=None):
+    """Add lat/lon dimensions and variables to an output file or,
+    if `land_index` is given, its land points (see
+    python/landpoints.py). Returns the dimensions of a (lat, lon)
+    field."""
+    if land_index is not None:
+        land_index.add_to_netcdf(ncout)
+        return (LAND_DIM,)
+    ncout.createDimension('lat', len(lat_vals))
+    ncout.createDimension('lon', len(lon_vals))
 
-    # ##################################### #
-    # Topographic Index
-    # ##################################### #
-
-    fname = 'topoidx_WFDEI_0p5_2D_global.nc'
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
+    var = ncout.createVariable('lat', np.float32, ('lat',))
     var.units = 'degrees North'
     var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
+
+    var = ncout.createVariable('lon', np.float32, ('lon',))
     var.units = 'degrees East'
     var[:] = lon_vals
-    nc.close()
-
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
+    return ('lat', 'lon')
+
+def to_layout(x, land_index=None):
+    """Gather a (..., lat, lon) array onto the land points, if any."""
+    return x if land_index is None else land_index.gather(x)
+
+@click.command()
+@click.option(
+    '--latlon-file', 'latlon_fpath', default=LATLON_FPATH, type=str,
+    help='WFDEI forcing file from which the lat/lon values are read.'
+)
+@click.option(
+    '--frac-input', 'frac_input', default='multi-year',
+    type=click.Choice(['multi-year', 'per-year']),
+    help='Read the adjusted land cover fractions from the multi-year '
+    'file, or the per-year files, of 04_adjust_jules_frac_w_icrisat.py '
+    '(see its --output-mode).'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of ancillary files subset concurrently.'
+)
+@click.option(
+    '--block-size', 'block_size', default=31, type=int,
+    help='Number of days interpolated and written at once.'
+)
+@click.option(
+    '--cache-dir', 'cache_dir', default='../data/cache/artifacts', type=str,
+    help='Directory of the artifact cache.'
+)
+@click.option(
+    '--cache-max-gb', 'cache_max_gb', default=10., type=float,
+    help='Maximum size of the artifact cache (GB).'
+)
+@click.option(
+    '--land-points', 'land_points', is_flag=True, default=False,
+    help='Write the vegetation, land cover fraction and soil files on '
+    'the land points of the basin-masked domain only.'
+)
+def main(latlon_fpath, frac_input, n_workers, block_size, cache_dir,
+         cache_max_gb, land_points):
     
+    # Extract lat vals from raw met file
+    latlon = xarray.open_dataset(latlon_fpath, decode_times=False)
+    lat_vals = latlon['lat'].values
+    lon_vals = latlon['lon'].values
+    latlon.close()
+
     # ##################################### #
-    # WFDEI-long-lat-2d
+    # Regional subsets of the global ancillaries
     # ##################################### #
-    
-    fname = 'WFDEI-long-lat-2d.nc'
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
 
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
+    # Each file is read once, as the IGP hyperslab only, and written
+    # with x/y (and z) renamed and lat/lon added (see python/ncsubset.py)
+    jobs = []
+    for fname, suffix, rename_dims in ANCILS:
+        jobs.append(dict(
+            src_fpath=os.path.join(DATADIR, fname),
+            dst_fpath=os.path.join(
+                OUTDIR, os.path.splitext(fname)[0] + suffix
+            ),
+            xmin=XMIN, xmax=XMAX, ymin=YMIN, ymax=YMAX,
+            rename_dims=rename_dims,
+            lat_vals=lat_vals, lon_vals=lon_vals
+        ))
+    # Subsets whose source, region and code are unchanged are
+    # restored from the artifact cache (see python/filecache.py)
+    cache = ArtifactCache(cache_dir, int(cache_max_gb * 1024 ** 3))
+    code = [os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'python', 'ncsubset.py'
+    )]
+    pending = []
+    for job in jobs:
+        params = {
+            k: v for k, v in job.items() if k not in ['src_fpath', 'dst_fpath']
+        }
+        params['lat_vals'] = lat_vals.tolist()
+        params['lon_vals'] = lon_vals.tolist()
+        key = cache.key([job['src_fpath']], params, code)
+        if not cache.restore(key, [job['dst_fpath']]):
+            pending.append((key, job))
+    subset_many([job for _, job in pending], n_workers)
+    for key, job in pending:
+        cache.store(key, [job['dst_fpath']])
 
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
-    
     # ##################################### #
     # WFD-EI-LandFraction2D.nc 
     # ##################################### #
 
     fname = 'WFD-EI-LandFraction2d.nc'
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
-
     fname_new = os.path.splitext(fname)[0] + '_south_asia.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
 
     ds = rioxarray.open_rasterio("../data/igp_basins.tif")
     basins = np.flipud(ds.values.squeeze())  # flipud to have increasing lat
@@ -130,130 +187,17 @@ def main():
             # copy variable attributes all at once via dictionary
             dst[name].setncatts(src[name].__dict__)            
         dst['lsmask'][:] = dst['lsmask'][:] * basins
-        
-    # ##################################### #
-    # qrparm.veg.frac2d.nc
-    # ##################################### #
-
-    fname = 'qrparm.veg.frac2d.nc'
-    
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-    
-    # Rename x, y to lon, lat
-    # cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    cmd = 'ncrename -d .x,lon -d .y,lat -d .z,dim0 ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
-
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)    
-
-    # ##################################### #
-    # qrparm.veg.func2d.nc
-    # ##################################### #
-
-    fname = 'qrparm.veg.func2d.nc'
-    
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-    
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat -d .z,dim1 ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
 
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
+    # The land points of the basin-masked domain, in the (increasing
+    # lat) orientation of the files written below
+    land_index = None
+    if land_points:
+        with netCDF4.Dataset(os.path.join(OUTDIR, fname_new_new)) as nc:
+            land_index = LandIndex(
+                nc['lsmask'][:] > 0, nc['lat'][:], nc['lon'][:]
+            )
+        land_index.write(os.path.join(OUTDIR, LAND_INDEX_FNAME))
 
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)    
-    
-    # ##################################### #
-    # qrparm.soil_HWSD_class3_van_genuchten2d.nc
-    # ##################################### #
-    
-    fname = 'qrparm.soil_HWSD_class3_van_genuchten2d.nc'
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-    
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
-
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
-    
-    # ##################################### #
-    # qrparm.soil_HWSD_class3_van_genuchtenNew_NewSoilAlbedo-rfu-2D-LatLon-grid.nc
-    # ##################################### #
-    
-    fname = 'qrparm.soil_HWSD_class3_van_genuchtenNew_NewSoilAlbedo-rfu-2D-LatLon-grid.nc'
-
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-    # This file already contains lat/lon dimensions/variables,
-    # so no need to make any adjustments
-
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
-
-    # ##################################### #
-    # qrparm.soil_HWSD_cont_cosby2d.nc
-    # ##################################### #
-
-    fname = 'qrparm.soil_HWSD_cont_cosby2d.nc'
-
-    # Copy file
-    shutil.copy2(os.path.join(DATADIR, fname), OUTDIR)
-    
-    # Rename x, y to lon, lat
-    cmd = 'ncrename -d .x,lon -d .y,lat ' + os.path.join(OUTDIR, fname)
-    os.system(cmd)
-
-    # Add lon, lat variables
-    nc = netCDF4.Dataset(os.path.join(OUTDIR, fname), 'r+')
-    var = nc.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = lat_vals
-    var = nc.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = lon_vals
-    nc.close()
-
-    fname_new = os.path.splitext(fname)[0] + '_igp.nc'
-    cmd = 'ncks -O -d lon,' + str(XMIN) + ',' + str(XMAX) + ' -d lat,' + str(YMIN) + ',' + str(YMAX) + ' ' + os.path.join(OUTDIR, fname) + ' ' + os.path.join(OUTDIR, fname_new)
-    os.system(cmd)
-    
     # ##################################### #
     # Canopy height, leaf area index
     # ##################################### #
@@ -270,8 +214,6 @@ def main():
     ncout.createDimension('time', None)
     ncout.createDimension('tstep', None)        
     ncout.createDimension('dim1', len(canht['pseudo_level'][:]))
-    ncout.createDimension('lat', len(canht['latitude'][:]))
-    ncout.createDimension('lon', len(canht['longitude'][:]))
     
     var = ncout.createVariable('tstep', 'i4', ('tstep',))
     var.units = canht['time'].units
@@ -283,46 +225,51 @@ def main():
     var.long_name = canht['pseudo_level'].long_name
     var[:] = canht['pseudo_level'][:]
     
-    var = ncout.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = np.flip(canht['latitude'][:])
-                          
-    var = ncout.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = canht['longitude'][:]
+    grid_dims = add_lat_lon(
+        ncout, np.flip(canht['latitude'][:]), canht['longitude'][:],
+        land_index
+    )
     
-    var = ncout.createVariable('canopy_height', 'f8', ('tstep', 'dim1', 'lat', 'lon'))
+    var = ncout.createVariable('canopy_height', 'f8', ('tstep', 'dim1') + grid_dims)
     var.standard_name = canht['canopy_height'].standard_name
     var.units = canht['canopy_height'].units
     canht_dims = canht['canopy_height'].dimensions
     lat_index = [i for i in range(len(canht_dims)) if canht_dims[i] == 'latitude'][0]
-    var[:] = np.flip(canht['canopy_height'][:], axis=lat_index)
+    var[:] = to_layout(
+        np.flip(canht['canopy_height'][:], axis=lat_index), land_index
+    )
 
-    var = ncout.createVariable('leaf_area_index', 'f8', ('tstep', 'dim1', 'lat', 'lon'))
+    var = ncout.createVariable('leaf_area_index', 'f8', ('tstep', 'dim1') + grid_dims)
     var.standard_name = lai['leaf_area_index'].standard_name
     var.units = lai['leaf_area_index'].units
     lai_dims = canht['canopy_height'].dimensions
     lat_index = [i for i in range(len(lai_dims)) if lai_dims[i] == 'latitude'][0]
-    var[:] = np.flip(lai['leaf_area_index'][:], axis=lat_index)
+    var[:] = to_layout(
+        np.flip(lai['leaf_area_index'][:], axis=lat_index), land_index
+    )
     
     ncout.close()
 
-    # Temporal interpolation
-    x = xarray.open_dataset(os.path.join(OUTDIR, fname_new))
-    x_first = x.isel({'tstep':0})
-    x_last = x.isel({'tstep':-1})
-    x_first.tstep.values += np.timedelta64(365,'D')
-    x_last.tstep.values -= np.timedelta64(365,'D')
-    x = xarray.concat([x_last, x, x_first], dim='tstep', data_vars='minimal').resample(tstep='1D').interpolate()
-    x = x.sel(tstep=slice("2015-01-01 00:00:00", "2016-01-01 00:00:00"))
-    tms = [pd.Timestamp(tstp).to_pydatetime() for tstp in x['tstep'].values]
-        
+    # Temporal interpolation: daily values from 2015-01-01 to
+    # 2016-01-01, interpolated cyclically between the 10-day
+    # climatological points (see python/climatology.py). The weights
+    # are computed once and applied to one block of days at a time
+    tms = [
+        datetime.datetime(2015, 1, 1) + datetime.timedelta(days=int(d))
+        for d in range(366)
+    ]
+    clim_days = to_days(
+        canht['time'][:], canht['time'].units, canht['time'].calendar
+    )
+    days = netCDF4.date2num(
+        tms, 'days since 1970-01-01 00:00:00', canht['time'].calendar
+    )
+    i0, i1, w1 = cyclic_weights(clim_days, days)
+
     fname_new = 'jules_5pft_w_crops_veg_func_igp_wfdei_interp.nc'    
     ncout = netCDF4.Dataset(os.path.join(OUTDIR, fname_new), 'w')
     ncout.createDimension('tstep', None)        
     ncout.createDimension('dim1', len(canht['pseudo_level'][:]))
-    ncout.createDimension('lat', len(canht['latitude'][:]))
-    ncout.createDimension('lon', len(canht['longitude'][:]))
     
     var = ncout.createVariable('tstep', 'i4', ('tstep',))
     var.units = canht['time'].units
@@ -334,29 +281,30 @@ def main():
     var.long_name = canht['pseudo_level'].long_name
     var[:] = canht['pseudo_level'][:]
     
-    var = ncout.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = np.flip(canht['latitude'][:])
-                          
-    var = ncout.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = canht['longitude'][:]
+    grid_dims = add_lat_lon(
+        ncout, np.flip(canht['latitude'][:]), canht['longitude'][:],
+        land_index
+    )
     
-    var = ncout.createVariable('canopy_height', 'f8', ('tstep', 'dim1', 'lat', 'lon'))
-    var.standard_name = canht['canopy_height'].standard_name
-    var.units = canht['canopy_height'].units
-    canht_dims = canht['canopy_height'].dimensions
-    lat_index = [i for i in range(len(canht_dims)) if canht_dims[i] == 'latitude'][0]
-    var[:] = np.moveaxis(x['canopy_height'].values[:], [0,3], [1,0])
-    # var[:] = np.flip(canht['canopy_height'][:], axis=lat_index)
+    for nc, var_name in [(canht, 'canopy_height'), (lai, 'leaf_area_index')]:
+        var = ncout.createVariable(var_name, 'f8', ('tstep', 'dim1') + grid_dims)
+        var.standard_name = nc[var_name].standard_name
+        var.units = nc[var_name].units
+        dims = nc[var_name].dimensions
+        lat_index = [i for i in range(len(dims)) if dims[i] == 'latitude'][0]
+        # on land points only those are interpolated
+        clim = np.ma.filled(
+            to_layout(
+                np.flip(nc[var_name][:], axis=lat_index), land_index
+            ).astype(np.float64),
+            np.nan
+        )
+        for t0 in range(0, len(tms), block_size):
+            t1 = min(t0 + block_size, len(tms))
+            var[t0:t1, ...] = interpolate_block(
+                clim, i0[t0:t1], i1[t0:t1], w1[t0:t1]
+            )
 
-    var = ncout.createVariable('leaf_area_index', 'f8', ('tstep', 'dim1', 'lat', 'lon'))
-    var.standard_name = lai['leaf_area_index'].standard_name
-    var.units = lai['leaf_area_index'].units
-    lai_dims = canht['canopy_height'].dimensions
-    lat_index = [i for i in range(len(lai_dims)) if lai_dims[i] == 'latitude'][0]
-    var[:] = np.moveaxis(x['leaf_area_index'].values[:], [0,3], [1,0])
-    # var[:] = np.flip(lai['leaf_area_index'][:], axis=lat_index)
     
     canht.close()
     lai.close()
@@ -370,70 +318,53 @@ def main():
     # frac_fname = 'jules_frac_5pft_ants_2015_CUSTOM_igp.nc'
     # fname_new = 'jules_5pft_w_crops_veg_frac_igp_wfdei.nc'
     yrs = np.arange(1979, 2015+1)
+    multi_year_frac_fname = (
+        'jules_frac_5pft_ants_' + str(yrs[0]) + '_' + str(yrs[-1])
+        + '_CUSTOM_igp_adjusted.nc'
+    )
     for yr in yrs:
         
         frac_fname = 'jules_frac_5pft_ants_' + str(yr) + '_CUSTOM_igp_adjusted.nc'
         fname_new = 'jules_5pft_w_crops_veg_frac_' + str(yr) + '_igp_wfdei.nc'
-    
-        # Add lon, lat variables
-        frac = netCDF4.Dataset(os.path.join('../data', frac_fname), 'r')
-
-        ncout = netCDF4.Dataset(os.path.join(OUTDIR, fname_new), 'w')
-        ncout.createDimension('dim0', len(frac['pseudo_level'][:]))
-        ncout.createDimension('lat', len(frac['latitude'][:]))
-        ncout.createDimension('lon', len(frac['longitude'][:]))
 
-        var = ncout.createVariable('pseudo_level', 'i4', ('dim0',))
-        var.units = frac['pseudo_level'].units
-        var.long_name = frac['pseudo_level'].long_name
-        var[:] = frac['pseudo_level'][:]
-
-        var = ncout.createVariable('lat', np.float32, ('lat',))
-        var.units = 'degrees North'
-        var[:] = np.flip(frac['latitude'][:])
-
-        var = ncout.createVariable('lon', np.float32, ('lon',))
-        var.units = 'degrees East'
-        var[:] = frac['longitude'][:]
-
-        var = ncout.createVariable('land_cover_lccs', 'f8', ('dim0', 'lat', 'lon'))
-        var.standard_name = frac['land_cover_lccs'].standard_name
-        var.units = frac['land_cover_lccs'].units
-        frac_dims = frac['land_cover_lccs'].dimensions
-        lat_index = [i for i in range(len(frac_dims)) if frac_dims[i] == 'latitude'][0]
-        var[:] = np.flip(frac['land_cover_lccs'][:], axis=lat_index)
-
-        ncout.close()
-        frac.close()
+        # The multi-year file written by 04_adjust_jules_frac_w_icrisat.py
+        # is already in JULES orientation, so each year is read as a
+        # single chunk rather than re-read and flipped
+        if frac_input == 'multi-year':
+            export_frac_year(
+                os.path.join('../data', multi_year_frac_fname),
+                yr,
+                os.path.join(OUTDIR, fname_new),
+                land_index
+            )
+        else:
+            export_frac_template(
+                os.path.join('../data', frac_fname),
+                os.path.join(OUTDIR, fname_new),
+                land_index
+            )
 
     # Having created land cover fraction, we need to go back into soil maps
     # and ensure that th_sat is zero on any land ice points
     # N.B. this will now use the data for 2015 which should be fine
     frac = netCDF4.Dataset(os.path.join(OUTDIR, fname_new), 'r')
-    vals = frac['land_cover_lccs'][-1, ...]
+    vals = read_grid(frac, 'land_cover_lccs', -1)
     ice = vals.data
     ice[vals.mask] = 0
     ice = ice > 0
     frac.close()
 
-    soil1 = netCDF4.Dataset(os.path.join(OUTDIR, 'qrparm.soil_HWSD_class3_van_genuchten2d_igp.nc'), 'r+')
-    th_sat = soil1['field332'][:]
-    th_sat[ice] = 0
-    soil1['field332'][:] = th_sat
-    soil1.close()
-    
-    soil2 = netCDF4.Dataset(os.path.join(OUTDIR, 'qrparm.soil_HWSD_class3_van_genuchtenNew_NewSoilAlbedo-rfu-2D-LatLon-grid_igp.nc'), 'r+')
-    th_sat = soil2['sm_sat'][:]
-    th_sat[ice] = 0
-    soil2['sm_sat'][:] = th_sat
-    soil2.close()
-    
-    soil3 = netCDF4.Dataset(os.path.join(OUTDIR, 'qrparm.soil_HWSD_cont_cosby2d_igp.nc'), 'r+')
-    th_sat = soil3['field332'][:]
-    th_sat[ice] = 0
-    soil3['field332'][:] = th_sat
-    soil3.close()
-        
+    for soil_fname, th_sat_name in SOILS:
+        soil = netCDF4.Dataset(os.path.join(OUTDIR, soil_fname), 'r+')
+        th_sat = soil[th_sat_name][:]
+        th_sat[ice] = 0
+        soil[th_sat_name][:] = th_sat
+        soil.close()
+        # The subsets (and the artifact cache) are gridded; they
+        # are gathered onto the land points once fixed
+        if land_index is not None:
+            to_land_points(os.path.join(OUTDIR, soil_fname), land_index)
+
 if __name__ == '__main__':
     main()
     
@@ -2,11 +2,50 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import click
 import numpy as np
 import netCDF4
 import rioxarray
 
-def main():
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python')
+)
+from irrigation import (
+    SCENARIOS, load_scenarios, scenario_intervals, write_scenarios,
+    irrigated_frac_index
+)
+from landpoints import LandIndex
+
+@click.command()
+@click.option(
+    '--block-size', 'block_size', default=31, type=int,
+    help='Number of days computed and written at a time.'
+)
+@click.option(
+    '-s', '--scenario', 'scenario_names', multiple=True,
+    default=['standard', 'policy'],
+    help='Irrigation scenario to write (may be repeated).'
+)
+@click.option(
+    '--scenarios-file', 'scenarios_file', default=None, type=str,
+    help='JSON file declaring additional irrigation scenarios.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of scenarios written concurrently.'
+)
+@click.option(
+    '--cache-dir', 'cache_dir', default='../data/cache/irrigation', type=str,
+    help='Directory in which to keep the irrigated area index.'
+)
+@click.option(
+    '--land-points', 'land_points', is_flag=True, default=False,
+    help='Write the schedules on land points only, using the index '
+    'written by 07_select-wfdei-ancil-data.py --land-points.'
+)
+def main(block_size, scenario_names, scenarios_file, n_workers, cache_dir,
+         land_points):
 
     # Study region
     land_fn = '../data/wfdei/ancils/WFD-EI-LandFraction2d_igp.nc'
@@ -22,34 +61,31 @@ def main():
     # temporal resolution (i.e. daily)
     
     lai_fn = '../data/wfdei/ancils/jules_5pft_w_crops_veg_func_igp_wfdei_interp.nc'
-    lai = netCDF4.Dataset(lai_fn, 'r')
-    nt = 366
-    ntype = 15
-    ny = 40
-    nx = 80
 
     # ================================= #
     # Create irrigation mask
     # ================================= #
     
-    irr_index = [6, 7, 8, 9]    # NB zero-indexing
+    # The irrigated fraction of each year is cached, so only
+    # files which have changed since the last run are re-read
     years = np.arange(1979, 2015+1)
-    frac_sum = np.zeros((ny, nx))
-    for year in years:
-        frac_fn = os.path.join(
+    frac_fns = [
+        os.path.join(
             '../data/wfdei/ancils',
             'jules_5pft_w_crops_veg_frac_' + str(year) + '_igp_wfdei.nc'
-        )        
-        nc = netCDF4.Dataset(frac_fn, 'r')
-        frac = nc['land_cover_lccs'][:][irr_index, ...]#.data
-        frac_data = frac.data
-        frac_data[frac.mask] = 0.0
-        frac_sum = frac_sum + np.sum(frac_data, axis=0)
-        nc.close()
-
-    # Irrigated mask
-    irr_mask = (frac_sum > 0) * 1.
-    irr_mask *= land 
+        )
+        for year in years
+    ]
+    irr_index = irrigated_frac_index(frac_fns, years, cache_dir)
+
+    # Irrigated mask. The schedules used to be multiplied by the
+    # float `irr_mask * land`; lsmask x basins is a binary mask (see
+    # 05_create-igp-basins.R), for which this is the same as selecting
+    # the cells where it is one
+    land = np.ma.filled(land, 0)
+    if not np.isin(land, [0, 1]).all():
+        raise ValueError(land_fn + ': lsmask is not a binary mask')
+    irr_mask = irr_index['ever_irrigated'] & (land > 0)
 
     # ================================= #
     # Load monsoon onset data
@@ -64,119 +100,48 @@ def main():
     onset_fn = '../data/igp_wet_season_onset.tif'
     onset = rioxarray.open_rasterio(onset_fn)
     onset = onset.data.squeeze()
-    onset = np.flipud(onset) * irr_mask
+    onset = np.flipud(onset)
 
     # ================================= #
     # Create irrigation schedule
     # ================================= #
-    
-    # These are taken from Biemans et al. 2016:
-
-    # "In the analysis of seasonal irrigation  demand,  we
-    # therefore distinguish three seasons: kharif, from June
-    # until October; rabi, from November until March; and a
-    # dry “summer” season from April to May.  This dry
-    # pre-monsoon  summer  season  is  sometimes also
-    # called Zaid season."
-    
-    # Irrigation single [Jun-Sep (end), i.e. assume Kharif only]
-    # 153-304
-    # Irrigation double [Nov-Mar (end)]
-    # 305-90
-    # Irrigation triple [Apr-May (end)]
-    # 91-151
-    # NB: currently not considering Zaid season
-    jd = (np.arange(0, nt) + 1)
-    jd = jd[:,None,None] * np.ones((ny, nx))
-    irrigation_single_idx = (jd >= onset) & (jd <= 304)
-    irrigation_double_idx = (irrigation_single_idx | (jd >= 305) | (jd <= 90))
-    # irrigation_triple_idx = (irrigation_double_idx | ((jd >= 91) & (jd <= 151)))
-    irrigation_continuous_idx = (jd >= 1)
-
-    irrig_schedule = np.zeros((nt, ntype, ny, nx))
-    irrig_schedule[:,6,:,:][irrigation_single_idx] = 1
-    irrig_schedule[:,7,:,:][irrigation_double_idx] = 1
-    # irrig_schedule[:,8,:,:][irrigation_triple_idx] = 1
-    irrig_schedule[:,9,:,:][irrigation_continuous_idx] = 1
-
-    # TEST - ensure Kharif season has a different number
-    irrig_schedule2 = np.copy(irrig_schedule)
-    irrig_schedule2[irrig_schedule == 1] = 2
-    irrig_schedule2[:,6,:,:][irrigation_single_idx] = 1
-    irrig_schedule2[:,7,:,:][irrigation_single_idx] = 1
-    # irrig_schedule2[:,8,:,:][~irrigation_single_idx] = 1
-    irrig_schedule2[:,9,:,:][irrigation_single_idx] = 1
-
-    # Multiply by mask
-    irrig_schedule = irrig_schedule * irr_mask[None,None,:,:]
-    irrig_schedule2 = irrig_schedule2 * irr_mask[None,None,:,:]
 
-    # ================================= #
-    # Write to file
-    # ================================= #
+    # See python/irrigation.py for the season and scenario
+    # definitions. All scenarios are encoded in one pass as a small
+    # set of irrigation windows per cell and type, sharing the onset
+    # map and irrigation mask. Each scenario's windows are written
+    # to file as they are, and the dense daily schedule read by
+    # JULES is expanded from them in blocks of days, each block
+    # being written straight to file, so that the full (day, type,
+    # lat, lon) cube is never held in memory.
+
+    scenarios = dict(SCENARIOS)
+    if scenarios_file is not None:
+        scenarios.update(load_scenarios(scenarios_file))
+    scenarios = {name: scenarios[name] for name in scenario_names}
 
     # Use a land cover file as a template
     frac_fn = '../data/wfdei/ancils/jules_5pft_w_crops_veg_frac_2015_igp_wfdei.nc'
     frac = netCDF4.Dataset(frac_fn, 'r')
-    
-    ncout = netCDF4.Dataset(
-        '../data/wfdei/ancils/jules_5pft_w_crops_irrig_schedule.nc',
-        'w'
-    )
-    ncout.createDimension('tstep', None)        
-    ncout.createDimension('dim0', len(frac['pseudo_level'][:]))
-    ncout.createDimension('lat', len(lai['lat'][:]))
-    ncout.createDimension('lon', len(lai['lon'][:]))
-    var = ncout.createVariable('tstep', 'i4', ('tstep',))
-    var.units = lai['tstep'].units
-    var.calendar = lai['tstep'].calendar
-    var[:] = lai['tstep'][:]
-    var = ncout.createVariable('pseudo_level', 'i4', ('dim0',))
-    var.units = frac['pseudo_level'].units
-    var.long_name = frac['pseudo_level'].long_name
-    var[:] = frac['pseudo_level'][:]
-    var = ncout.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = frac['lat'][:]
-    var = ncout.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = frac['lon'][:]
-    var = ncout.createVariable('irr_schedule', 'i4', ('tstep', 'dim0', 'lat', 'lon'))
-    var.standard_name = 'irr_schedule'
-    var.units = '1'
-    var[:] = irrig_schedule
-    ncout.close()
-
-    ncout = netCDF4.Dataset(
-        '../data/wfdei/ancils/jules_5pft_w_crops_irrig_schedule_policy.nc',
-        'w'
+    ntype = len(frac['pseudo_level'][:])
+
+    # On land points the windows are encoded, expanded and written
+    # for those points only
+    land_index = None
+    if land_points:
+        land_index = LandIndex.read(
+            '../data/wfdei/ancils/jules_land_index_igp.nc'
+        )
+        onset = land_index.gather(onset)
+        irr_mask = land_index.gather(irr_mask)
+
+    intervals = scenario_intervals(onset, irr_mask, ntype, scenarios)
+    write_scenarios(
+        '../data/wfdei/ancils', intervals, lai_fn, frac_fn,
+        block_size, n_workers, land_index
     )
-    ncout.createDimension('tstep', None)
-    ncout.createDimension('dim0', len(frac['pseudo_level'][:]))
-    ncout.createDimension('lat', len(lai['lat'][:]))
-    ncout.createDimension('lon', len(lai['lon'][:]))
-    var = ncout.createVariable('tstep', 'i4', ('tstep',))
-    var.units = lai['tstep'].units
-    var.calendar = lai['tstep'].calendar
-    var[:] = lai['tstep'][:]
-    var = ncout.createVariable('pseudo_level', 'i4', ('dim0',))
-    var.units = frac['pseudo_level'].units
-    var.long_name = frac['pseudo_level'].long_name
-    var[:] = frac['pseudo_level'][:]
-    var = ncout.createVariable('lat', np.float32, ('lat',))
-    var.units = 'degrees North'
-    var[:] = frac['lat'][:]
-    var = ncout.createVariable('lon', np.float32, ('lon',))
-    var.units = 'degrees East'
-    var[:] = frac['lon'][:]
-    var = ncout.createVariable('irr_schedule', 'i4', ('tstep', 'dim0', 'lat', 'lon'))
-    var.standard_name = 'irr_schedule'
-    var.units = '1'
-    var[:] = irrig_schedule2
-    ncout.close()
 
     # Close other datasets
-    lai.close()
     frac.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import click
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python')
+)
+from forcing import (
+    build_forcing_store, load_forcing_index, TIME_CHUNK, SPACE_CHUNK
+)
+
+INDIR = os.path.join(
+    os.environ['HOME'],
+    'projects/ganges-water-machine/data/wfdei/WFDEI_3h_IGP/WFDEI_3h_IGP'
+)
+OUTDIR = os.path.join(
+    os.environ['HOME'],
+    'projects/ganges-water-machine/data/wfdei/WFDEI_3h_IGP_store'
+)
+
+YEAR0 = 1979
+YEAR1 = 2016
+
+VARS = [
+    'LWdown_WFDEI', 'Rainf_WFDEI_CRU', 'Rainf_WFDEI_GPCC', 'SWdown_WFDEI',
+    'PSurf_WFDEI', 'Wind_WFDEI', 'Snowf_WFDEI_CRU', 'Snowf_WFDEI_GPCC',
+    'Qair_WFDEI', 'Tair_WFDEI'
+]
+
+# Consolidate the monthly IGP forcing files written by
+# 06_select-wfdei-data.py into one chunked store per variable,
+# `<VAR>_<YEAR0>_<YEAR1>_IGP.nc`, with an index alongside
+# (see python/forcing.py). Stores whose sources are unchanged
+# are not rebuilt.
+
+def consolidate(indir, outdir, var, year0, year1, **kwargs):
+    fpaths = [
+        os.path.join(
+            indir, var, var + '_' + str(year) + '%02d' % month + '_IGP.nc'
+        )
+        for year in range(year0, year1 + 1) for month in range(1, 13)
+    ]
+    store_fpath = os.path.join(
+        outdir, var + '_' + str(year0) + '_' + str(year1) + '_IGP.nc'
+    )
+    if load_forcing_index(fpaths, store_fpath, **kwargs) is not None:
+        print(var + ': up to date')
+        return store_fpath
+    build_forcing_store(fpaths, store_fpath, **kwargs)
+    print(var + ': written to ' + store_fpath)
+    return store_fpath
+
+@click.command()
+@click.option('--indir', default=INDIR, type=str)
+@click.option('--outdir', default=OUTDIR, type=str)
+@click.option('--year0', default=YEAR0, type=int)
+@click.option('--year1', default=YEAR1, type=int)
+@click.option(
+    '-v', '--variable', 'variables', multiple=True, default=VARS,
+    help='Forcing variable(s) to consolidate.'
+)
+@click.option(
+    '--time-chunk', 'time_chunk', default=TIME_CHUNK, type=int,
+    help='Number of time points per chunk.'
+)
+@click.option(
+    '--space-chunk', 'space_chunk', default=SPACE_CHUNK, type=int,
+    help='Number of cells along lat and lon per chunk.'
+)
+@click.option(
+    '--complevel', default=0, type=click.IntRange(0, 9),
+    help='zlib compression level (0 for none).'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of variables consolidated concurrently.'
+)
+def main(indir, outdir, year0, year1, variables, time_chunk,
+         space_chunk, complevel, n_workers):
+    os.makedirs(outdir, exist_ok=True)
+    kwargs = dict(
+        time_chunk=time_chunk, space_chunk=space_chunk, complevel=complevel
+    )
+    if n_workers <= 1:
+        for var in variables:
+            consolidate(indir, outdir, var, year0, year1, **kwargs)
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(consolidate, indir, outdir, var, year0, year1, **kwargs)
+            for var in variables
+        ]
+        for future in futures:
+            future.result()
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@ Help()
     echo "--region             Name for model domain, e.g. 'globe'."
     echo "--file               Name of geocoded raster file to use to specify region."
     echo "--use-file-land-frac Use file indicated by `--file` to define land frac"
+    echo "--maps-only          Only write the GeoTIFF maps (and geotiff/filenames.txt)."
     echo "-d | --destdir    Output directory."
     echo
 }
@@ -37,6 +38,7 @@ ONE_D=0
 NINEPFT=0
 FIVEPFT=0
 FILE_LAND_FRAC=0
+MAPS_ONLY=0
 OUTDIR=.
 POSITIONAL=()
 while [[ $# -gt 0 ]]
@@ -73,6 +75,10 @@ do
 	    FILE_LAND_FRAC=1
 	    shift
 	    ;;
+	--maps-only)
+	    MAPS_ONLY=1
+	    shift
+	    ;;
 	-d|--destdir)
 	    OUTDIR="$2"
 	    shift
@@ -192,6 +198,11 @@ export GRASS_BATCH_JOB=$SRCDIR/bash/grass_write_jules_ancil_maps.sh
 grass76 $MAPSET
 unset GRASS_BATCH_JOB
 
+if [ $MAPS_ONLY == 1 ]
+then
+    exit
+fi
+
 set -a
 . $OUTDIR/geotiff/filenames.txt
 set +a
@@ -8,9 +8,11 @@ source $CONDA_BASE/etc/profile.d/conda.sh
 conda activate ants
 
 # DATADIR=../data
+# Year of the land cover fractions
+ANTS_FRAC_YEAR=${ANTS_FRAC_YEAR:-2015}
 CONTRIB_DIR=$HOME/packages/ants/contrib/trunk/
 LAI_WEIGHTS=$DATADIR/lai_weights_gl9.json
-VEG_FRAC_MASTER=$(pwd)/netcdf/jules_frac_natural_5pft_ants_2015_CUSTOM_igp.nc
+VEG_FRAC_MASTER=$(pwd)/netcdf/jules_frac_natural_5pft_ants_${ANTS_FRAC_YEAR}_CUSTOM_igp.nc
 CANOPY_HEIGHT_FACTORS=$DATADIR/canopy_height_factors_gl9.json
 TREES_DATASET=$DATADIR/Simard_Pinto_3DGlobalVeg_JGR.nc
 
@@ -61,9 +63,15 @@ declare -a LAI_TARGET_NAMES=(combined
 			     irrigated_cropland_3_no_c4_crops
 			     irrigated_cropland_c_no_c4_crops
 			     fallow_cropland_no_c4_crops)
+# Optionally, only the LAI targets named on the command line are run
+TARGETS=("$@")
 for i in "${!VEG_TYPES[@]}"
 do
-    VEG_FRAC_MASTER=$DATADIR/netcdf/jules_frac_${VEG_TYPES[$i]}_5pft_ants_2015_CUSTOM_igp.nc
+    if [[ ${#TARGETS[@]} -gt 0 && ! " ${TARGETS[*]} " =~ " ${LAI_TARGET_NAMES[$i]} " ]]
+    then
+	continue
+    fi
+    VEG_FRAC_MASTER=$DATADIR/netcdf/jules_frac_${VEG_TYPES[$i]}_5pft_ants_${ANTS_FRAC_YEAR}_CUSTOM_igp.nc
     LAI_MASTER=$DATADIR/aux/lai/lai_${LAI_TYPES[$i]}_igp.nc
     LAI_TARGET=$DATADIR/netcdf/lai_${LAI_TARGET_NAMES[$i]}_igp_0.500000Deg
     CANOPY_HEIGHT_TARGET=$DATADIR/netcdf/canopy_height_${LAI_TARGET_NAMES[$i]}_igp_0.500000Deg
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+from collections import OrderedDict
+import numpy as np
+import netCDF4
+
+# Periodic (cyclic) linear interpolation of climatologies, such as
+# the 36-step (10-day) LAI and canopy height climatologies. A target
+# time falls between two climatological time points, wrapping around
+# the end of the year; its value is their linear interpolation. The
+# indices and weights depend only on the time axes, so they are
+# computed once and then applied to any number of blocks or
+# variables, without building wrap-around copies of the data.
+# ClimatologyAccessor does the same on demand, for any time, by day
+# of the year, so that leap years do not shift the cycle.
+
+# Length of the climatological year (days)
+PERIOD = 365.
+
+def cyclic_weights(clim_days, days, period=PERIOD):
+    """Return the indices and weights which interpolate a
+    climatology to a set of target times.
+
+    `clim_days` are the (increasing) times of the climatological
+    points and `days` the target times, both in days since a common
+    origin. Returns `(i0, i1, w1)` such that the value at each
+    target time is `(1 - w1) * clim[i0] + w1 * clim[i1]`.
+    """
+    clim_days = np.asarray(clim_days, dtype=np.float64)
+    days = np.asarray(days, dtype=np.float64)
+    rel = clim_days - clim_days[0]
+    if np.any(np.diff(rel) <= 0) or rel[-1] >= period:
+        raise ValueError(
+            'Climatological times must increase within one period'
+        )
+    phase = np.mod(days - clim_days[0], period)
+    i0 = np.searchsorted(rel, phase, side='right') - 1
+    i1 = (i0 + 1) % len(rel)
+    gap = np.where(i1 == 0, period - rel[i0], rel[i1] - rel[i0])
+    w1 = (phase - rel[i0]) / gap
+    return i0, i1, w1
+
+def interpolate_block(clim, i0, i1, w1, out=None):
+    """Apply `cyclic_weights` output to `clim` (time first),
+    returning an array of shape (len(i0),) + clim.shape[1:].
+    """
+    w1 = np.asarray(w1).reshape((-1,) + (1,) * (clim.ndim - 1))
+    if out is None:
+        out = np.empty((len(i0),) + clim.shape[1:], dtype=np.float64)
+    np.take(clim, i0, axis=0, out=out)
+    out *= 1. - w1
+    out += clim[i1] * w1
+    return out
+
+def noleap_day_of_year(tms):
+    """Return the day of the year (from 0, with the fraction of the
+    day) of datetimes in a 365-day year; 29 February maps onto 28
+    February, and later days of a leap year onto the same dates of
+    other years."""
+    tms = np.asarray(tms, dtype='datetime64[us]')
+    year_start = tms.astype('datetime64[Y]')
+    day = (tms - year_start) / np.timedelta64(1, 'D')
+    year = year_start.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    # 29 February is day 59 of a leap year
+    return np.where(leap & (day >= 59), day - 1, day)
+
+def to_days(tms, units, calendar):
+    """Convert times in (units, calendar) to days since 1970-01-01."""
+    return netCDF4.date2num(
+        netCDF4.num2date(tms, units, calendar),
+        'days since 1970-01-01 00:00:00', calendar
+    )
+
+class ClimatologyAccessor(object):
+    """On-demand access to a climatology, such as the 36-step LAI
+    and canopy height files written by write_jules_lai.py.
+
+    Values at any time (or range of times, at any resolution) are
+    interpolated cyclically, by day of the year, from the
+    climatological time points, which are read as needed and kept in
+    a small LRU cache, so that no dense daily cube is materialized or
+    stored. 29 February takes the values of 28 February (see
+    `noleap_day_of_year`).
+    """
+    def __init__(self, fpath, var_name, time_name='time', cache_size=8):
+        self.nc = netCDF4.Dataset(fpath, 'r')
+        self.var = self.nc[var_name]
+        time = self.nc[time_name]
+        clim_tms = netCDF4.num2date(
+            time[:], time.units, getattr(time, 'calendar', 'standard'),
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True
+        )
+        self.clim_days = noleap_day_of_year(list(clim_tms))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        self.nc.close()
+
+    def _slice(self, i):
+        """Read (through the cache) one climatological time point."""
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        if len(self._cache) >= self.cache_size:
+            self._cache.popitem(last=False)
+        self._cache[i] = np.ma.filled(
+            self.var[i, ...].astype(np.float64), np.nan
+        )
+        return self._cache[i]
+
+    def at(self, tm):
+        """Return the values at the datetime `tm`."""
+        i0, i1, w1 = cyclic_weights(
+            self.clim_days, noleap_day_of_year([tm])
+        )
+        return (
+            (1. - w1[0]) * self._slice(int(i0[0]))
+            + w1[0] * self._slice(int(i1[0]))
+        )
+
+    def between(self, start, end, step=datetime.timedelta(days=1)):
+        """Return the times from `start` to `end` (inclusive) at
+        intervals of `step`, and the values at those times.
+        """
+        start = np.datetime64(start, 'us')
+        step = np.timedelta64(step, 'us')
+        n = int((np.datetime64(end, 'us') - start) // step) + 1
+        if n <= 0:
+            return [], np.empty((0,) + self.var.shape[1:], dtype=np.float64)
+        tms = start + step * np.arange(n)
+        i0, i1, w1 = cyclic_weights(self.clim_days, noleap_day_of_year(tms))
+        # Each climatological point is read once, then all times are
+        # interpolated at once
+        idx, inv = np.unique(np.concatenate([i0, i1]), return_inverse=True)
+        clim = np.stack([self._slice(int(i)) for i in idx])
+        out = interpolate_block(clim, inv[:n], inv[n:], w1)
+        return tms.tolist(), out
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+def file_fingerprint(paths):
+    """Hash the paths, modification times and sizes of a set of files."""
+    h = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        h.update(
+            (os.path.abspath(path) + '|' + str(st.st_mtime_ns) + '|'
+             + str(st.st_size) + '\n').encode()
+        )
+    return h.hexdigest()
+
+def read_manifest(fpath):
+    """Read a JSON manifest, returning None if it does not exist."""
+    try:
+        with open(fpath, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(fpath, manifest):
+    """Write a JSON manifest atomically."""
+    tmp_fpath = fpath + '.tmp'
+    with open(tmp_fpath, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_fpath, fpath)
+
+def copy_file(src, dst):
+    """Copy `src` to `dst`, replacing `dst` atomically. The copy is
+    independent of `src`, so that either can be written in place.
+    """
+    tmp_fpath = dst + '.tmp'
+    if os.path.lexists(tmp_fpath):
+        os.remove(tmp_fpath)
+    shutil.copy(src, tmp_fpath)
+    os.replace(tmp_fpath, dst)
+
+def content_hash(paths, block_size=1 << 20):
+    """Hash the contents of a set of files."""
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        h.update(b'\n')
+    return h.hexdigest()
+
+# Content hashes of single files, keyed on their fingerprint, so that
+# each input is read at most once per process however many cache
+# keys it is part of
+_CONTENT_HASHES = {}
+
+def file_content_hash(path):
+    """Hash the contents of one file, memoized on its path,
+    modification time and size."""
+    fingerprint = file_fingerprint([path])
+    if fingerprint not in _CONTENT_HASHES:
+        _CONTENT_HASHES[fingerprint] = content_hash([path])
+    return _CONTENT_HASHES[fingerprint]
+
+class ArtifactCache(object):
+    """Content-addressed cache of stage outputs.
+
+    An entry is keyed on the contents of a stage's input files, its
+    parameters and the source of the code which produces it, and
+    holds copies of the output files. Entries are evicted, least
+    recently used first, to keep the cache below `max_bytes`.
+    """
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, inputs, params=None, code=None):
+        """Return the key of a stage given its input files, its
+        (JSON-serializable) parameters and its code files. Inputs,
+        which may be large and shared by many stages, are hashed
+        once per process (see `file_content_hash`); the code files
+        are small, and are hashed on every call.
+        """
+        h = hashlib.sha1()
+        for path in inputs:
+            h.update((file_content_hash(path) + '\n').encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        h.update(content_hash(code or []).encode())
+        return h.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _manifest_fpath(self, key):
+        return os.path.join(self._entry_dir(key), 'manifest.json')
+
+    def restore(self, key, outputs):
+        """Copy the outputs of a cached entry to `outputs`,
+        returning False if there is no such entry. The copies take
+        the current time as their modification time, so that they
+        are newer than the inputs they were computed from.
+        """
+        manifest = read_manifest(self._manifest_fpath(key))
+        if manifest is None or len(manifest['files']) != len(outputs):
+            return False
+        try:
+            for fname, output in zip(manifest['files'], outputs):
+                tmp_fpath = output + '.tmp'
+                shutil.copy(os.path.join(self._entry_dir(key), fname), tmp_fpath)
+                os.replace(tmp_fpath, output)
+        except OSError:
+            # Evicted by another process while being restored
+            return False
+        manifest['last_used'] = time.time()
+        write_manifest(self._manifest_fpath(key), manifest)
+        return True
+
+    def store(self, key, outputs):
+        """Copy `outputs` into the cache under `key`."""
+        if os.path.exists(self._manifest_fpath(key)):
+            return
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        files = []
+        size = 0
+        for i, output in enumerate(outputs):
+            fname = str(i) + '_' + os.path.basename(output)
+            shutil.copy2(output, os.path.join(tmp_dir, fname))
+            files.append(fname)
+            size += os.path.getsize(output)
+        write_manifest(
+            os.path.join(tmp_dir, 'manifest.json'),
+            {'files': files, 'size': size, 'last_used': time.time()}
+        )
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # Stored concurrently by another process
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache is no
+        larger than `max_bytes`.
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            manifest = read_manifest(self._manifest_fpath(key))
+            if manifest is not None:
+                entries.append((manifest['last_used'], manifest['size'], key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+
+    def cached(self, key, outputs, compute):
+        """Restore `outputs` from the cache, or else call `compute()`
+        to produce them and add them to the cache.
+        """
+        if self.restore(key, outputs):
+            return True
+        compute()
+        self.store(key, outputs)
+        return False
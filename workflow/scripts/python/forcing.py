@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import bisect
+import hashlib
+import numpy as np
+import netCDF4
+
+from filecache import file_fingerprint, read_manifest, write_manifest
+
+# Consolidated forcing stores. The monthly files of one forcing
+# variable are streamed, in time order, into a single netCDF4
+# file with a continuous time axis. Chunks span `time_chunk` time
+# points and a (`space_chunk`, `space_chunk`) tile, so that a
+# point time series is read from a few chunks and a map from a few
+# tiles. Source files are buffered so that each time chunk is
+# written whole, once. A JSON index beside the store maps the first
+# timestamp of each time chunk to its offset, and records the
+# fingerprint of the sources and storage options so that an
+# up-to-date store is not rebuilt.
+
+TIME_UNITS = 'hours since 1979-01-01 00:00:00'
+CALENDAR = 'gregorian'
+
+# 3-hourly time steps in a (non-leap) year
+TIME_CHUNK = 2920
+SPACE_CHUNK = 16
+
+def store_index_fpath(store_fpath):
+    return os.path.splitext(store_fpath)[0] + '_index.json'
+
+def store_fingerprint(fpaths, time_chunk=TIME_CHUNK,
+                      space_chunk=SPACE_CHUNK, complevel=0):
+    """Hash the sources of a store and the options it is written
+    with."""
+    storage = dict(
+        time_chunk=time_chunk, space_chunk=space_chunk, complevel=complevel
+    )
+    h = hashlib.sha1(file_fingerprint(fpaths).encode())
+    h.update(json.dumps(storage, sort_keys=True).encode())
+    return h.hexdigest()
+
+def _data_var(nc):
+    """Return the names of the (time, lat, lon) data variable and
+    of its time dimension.
+    """
+    for nm, var in nc.variables.items():
+        if var.ndim == 3 and var.dimensions[1:] == ('lat', 'lon'):
+            return nm, var.dimensions[0]
+    raise ValueError('No (time, lat, lon) variable')
+
+def _time_var(nc, time_dim):
+    for nm in [time_dim, 'time', 'tstep']:
+        if nm in nc.variables and nc[nm].dimensions == (time_dim,):
+            return nc[nm]
+    raise ValueError('No time variable along ' + time_dim)
+
+def _read_times(nc, time_dim):
+    """Return the times of a file in TIME_UNITS."""
+    var = _time_var(nc, time_dim)
+    tms = netCDF4.num2date(
+        var[:], var.units, getattr(var, 'calendar', 'standard'),
+        only_use_cftime_datetimes=False,
+        only_use_python_datetimes=True
+    )
+    return netCDF4.date2num(tms, TIME_UNITS, CALENDAR)
+
+def build_forcing_store(fpaths, store_fpath, time_chunk=TIME_CHUNK,
+                        space_chunk=SPACE_CHUNK, complevel=0):
+    """Stream monthly forcing files into one chunked store.
+
+    `fpaths` must be given in time order. If `complevel` > 0 the
+    data are compressed with zlib at that level. Returns the index,
+    which is also written beside the store.
+    """
+    with netCDF4.Dataset(fpaths[0], 'r') as nc:
+        var_name, time_dim = _data_var(nc)
+        src = nc[var_name]
+        dtype = src.dtype
+        attrs = src.__dict__.copy()
+        fill_value = attrs.pop('_FillValue', None)
+        lat_vals = nc['lat'][:]
+        lon_vals = nc['lon'][:]
+        lat_attrs = nc['lat'].__dict__.copy()
+        lon_attrs = nc['lon'].__dict__.copy()
+        global_attrs = nc.__dict__.copy()
+
+    # Headers only: the lengths of the files give that of the store
+    nt = 0
+    for fpath in fpaths:
+        with netCDF4.Dataset(fpath, 'r') as nc:
+            nt += len(nc.dimensions[time_dim])
+    nlat, nlon = len(lat_vals), len(lon_vals)
+    chunksizes = (
+        min(time_chunk, nt), min(space_chunk, nlat), min(space_chunk, nlon)
+    )
+
+    tmp_fpath = store_fpath + '.tmp'
+    nco = netCDF4.Dataset(tmp_fpath, 'w', format='NETCDF4')
+    nco.setncatts(global_attrs)
+    nco.createDimension('time', nt)
+    nco.createDimension('lat', nlat)
+    nco.createDimension('lon', nlon)
+    var = nco.createVariable('lat', lat_vals.dtype, ('lat',))
+    var.setncatts(lat_attrs)
+    var[:] = lat_vals
+    var = nco.createVariable('lon', lon_vals.dtype, ('lon',))
+    var.setncatts(lon_attrs)
+    var[:] = lon_vals
+    time_var = nco.createVariable('time', 'f8', ('time',))
+    time_var.units = TIME_UNITS
+    time_var.calendar = CALENDAR
+    var = nco.createVariable(
+        var_name, dtype, ('time', 'lat', 'lon'),
+        chunksizes=chunksizes, zlib=complevel > 0,
+        complevel=max(complevel, 1), fill_value=fill_value
+    )
+    var.setncatts(attrs)
+    var.set_auto_maskandscale(False)
+
+    # One time chunk is filled from the sources before it is written,
+    # so that no chunk is written (and compressed) more than once
+    buf = np.empty((chunksizes[0], nlat, nlon), dtype=dtype)
+    buf_times = np.empty(chunksizes[0])
+    chunk_first_times, chunk_offsets = [], []
+    offset, n_buf = 0, 0
+    for fpath in fpaths:
+        with netCDF4.Dataset(fpath, 'r') as nc:
+            nc.set_auto_maskandscale(False)
+            tms = _read_times(nc, time_dim)
+            x = nc[var_name][:]
+        k = 0
+        while k < len(tms):
+            m = min(len(tms) - k, chunksizes[0] - n_buf)
+            buf[n_buf:n_buf + m] = x[k:k + m]
+            buf_times[n_buf:n_buf + m] = tms[k:k + m]
+            n_buf += m
+            k += m
+            if n_buf == chunksizes[0] or offset + n_buf == nt:
+                time_var[offset:offset + n_buf] = buf_times[:n_buf]
+                var[offset:offset + n_buf, ...] = buf[:n_buf]
+                chunk_first_times.append(float(buf_times[0]))
+                chunk_offsets.append(offset)
+                offset += n_buf
+                n_buf = 0
+    nco.close()
+    os.replace(tmp_fpath, store_fpath)
+
+    index = {
+        'fingerprint': store_fingerprint(
+            fpaths, time_chunk, space_chunk, complevel
+        ),
+        'variable': var_name,
+        'units': TIME_UNITS,
+        'calendar': CALENDAR,
+        'chunksizes': list(chunksizes),
+        'complevel': complevel,
+        'length': nt,
+        'sources': [os.path.basename(fpath) for fpath in fpaths],
+        'chunk_first_times': chunk_first_times,
+        'chunk_offsets': chunk_offsets
+    }
+    write_manifest(store_index_fpath(store_fpath), index)
+    return index
+
+def load_forcing_index(fpaths, store_fpath, time_chunk=TIME_CHUNK,
+                       space_chunk=SPACE_CHUNK, complevel=0):
+    """Return the index of a store which is up to date with its
+    sources and storage options, or None."""
+    if not os.path.exists(store_fpath):
+        return None
+    index = read_manifest(store_index_fpath(store_fpath))
+    fingerprint = store_fingerprint(fpaths, time_chunk, space_chunk, complevel)
+    if index is None or index.get('fingerprint') != fingerprint:
+        return None
+    return index
+
+def _chunk_span(index, tm):
+    """Return the time offset and length of the time chunk which
+    contains the datetime `tm`, and `tm` in the store's time units.
+    """
+    t = netCDF4.date2num(tm, index['units'], index['calendar'])
+    i = bisect.bisect_right(index['chunk_first_times'], t) - 1
+    if i < 0:
+        raise ValueError(str(tm) + ' precedes the forcing store')
+    offsets = index['chunk_offsets'] + [index['length']]
+    return offsets[i], offsets[i + 1] - offsets[i], t
+
+def read_point_series(store_fpath, index, lat, lon, start=None, end=None):
+    """Read the time series of the cell nearest to (lat, lon),
+    optionally between two datetimes (inclusive).
+
+    The index locates the time chunks containing `start` and `end`,
+    so only their time values are searched; the series itself is
+    read from the chunks it spans.
+    """
+    with netCDF4.Dataset(store_fpath, 'r') as nc:
+        i = int(np.argmin(np.abs(nc['lat'][:] - lat)))
+        j = int(np.argmin(np.abs(nc['lon'][:] - lon)))
+        t0, t1 = 0, len(nc.dimensions['time'])
+        if start is not None:
+            offset, n, t = _chunk_span(index, start)
+            tms = nc['time'][offset:offset + n]
+            t0 = offset + int(np.searchsorted(tms, t, side='left'))
+        if end is not None:
+            offset, n, t = _chunk_span(index, end)
+            tms = nc['time'][offset:offset + n]
+            t1 = offset + int(np.searchsorted(tms, t, side='right'))
+        return nc['time'][t0:t1], nc[index['variable']][t0:t1, i, j]
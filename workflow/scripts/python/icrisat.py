@@ -0,0 +1,667 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import datetime
+import numpy as np
+import netCDF4
+import rasterio
+from rasterio.windows import Window
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from filecache import file_fingerprint, read_manifest, write_manifest
+from landpoints import LAND_DIM
+
+# ##################################### #
+# Define some constants
+# ##################################### #
+
+# '**' = irrigated
+LAND_COVERS = [
+    'tree_broadleaf',           # 0  | 1
+    'tree_needleleaf',          # 1  | 2
+    'c3_grass',                 # 2  | 3
+    'c4_grass',                 # 3  | 4
+    'shrub',                    # 4  | 5
+    'rainfed',                  # 5  | 6
+    'irrigated_single_season',  # 6  | 7 **  [kharif]
+    'irrigated_double_season',  # 7  | 8 **  [kharif, rabi]
+    'irrigated_triple_season',  # 8  | 9 **  [kharif, rabi, zaid]
+    'irrigated_continuous',     # 9  | 10 ** [continuous]
+    'fallow',                   # 10 | 11
+    'urban',                    # 11 | 12
+    'water',                    # 12 | 13
+    'bare_soil',                # 13 | 14
+    'snow_ice'                  # 14 | 15
+]
+INDEX = {nm: idx for idx, nm in enumerate(LAND_COVERS)}
+
+# Agricultural land covers
+AGRI_LAND_COVERS = [
+    'rainfed',
+    'irrigated_single_season',
+    'irrigated_double_season',
+    'irrigated_triple_season',
+    'irrigated_continuous',
+    'fallow'
+]
+
+# Land covers which can change to accommodate
+# changes in agricultural area
+CAN_VARY = [
+    'tree_broadleaf',
+    'tree_needleleaf',
+    'c3_grass',
+    'c4_grass',
+    'bare_soil'
+]
+
+# Land covers which cannot be changed
+CANNOT_VARY = [
+    'urban',
+    'water',
+    'snow_ice'
+]
+
+# ICRISAT classes, in the order in which they are stacked,
+# and the JULES land covers they replace
+ICRISAT_NAMES = [
+    'rainfed',
+    'irrigated_single',
+    'irrigated_double',
+    'irrigated_triple',
+    'irrigated_continuous'
+]
+ICRISAT_LAND_COVERS = [
+    'rainfed',
+    'irrigated_single_season',
+    'irrigated_double_season',
+    'irrigated_triple_season',
+    'irrigated_continuous'
+]
+
+# ##################################### #
+# Memory-mapped ICRISAT store
+# ##################################### #
+
+def icrisat_frac_fpath(datadir, yr, nm):
+    fn = "icrisat_" + nm + "_frac_" + str(yr) + "_india_0.500000Deg.tif"
+    return os.path.join(datadir, "irrigated_area_maps", fn)
+
+def icrisat_india_frac_fpath(datadir):
+    return os.path.join(datadir, "irrigated_area_maps", "icrisat_india_frac.tif")
+
+def _read_raster(fpath, out, block_rows=None):
+    """Read a raster into the (lat, lon) array `out`, with masked
+    values as zero, `block_rows` rows at a time if given."""
+    with rasterio.open(fpath) as ds:
+        nlat = ds.height
+        block_rows = block_rows or nlat
+        for row0 in range(0, nlat, block_rows):
+            row1 = min(row0 + block_rows, nlat)
+            x = ds.read(
+                1, masked=True,
+                window=Window(0, row0, ds.width, row1 - row0)
+            )
+            out[row0:row1, :] = np.ma.filled(x, 0.)
+    return out
+
+def icrisat_store_fpaths(cache_dir):
+    """Paths to the fraction and India fraction arrays of the store."""
+    return (
+        os.path.join(cache_dir, 'icrisat_frac.npy'),
+        os.path.join(cache_dir, 'icrisat_india_frac.npy')
+    )
+
+def build_icrisat_store(datadir, yrs, cache_dir, block_rows=None):
+    """Decode the ICRISAT fraction rasters into .npy arrays.
+
+    The fractions are written as one (year, class, lat, lon) array,
+    with classes ordered as `ICRISAT_NAMES`, alongside the India
+    fraction map. Masked values are stored as zero. A manifest
+    records the years, classes and a fingerprint of the source
+    files, and is written last so that an interrupted build is
+    never mistaken for a valid store. Both arrays are written
+    through memory maps, `block_rows` rows of a raster at a time
+    if given.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    frac_fpath, india_fpath = icrisat_store_fpaths(cache_dir)
+    manifest_fpath = os.path.join(cache_dir, 'icrisat_store.json')
+    if os.path.exists(manifest_fpath):
+        os.remove(manifest_fpath)
+
+    india_frac_fn = icrisat_india_frac_fpath(datadir)
+    with rasterio.open(india_frac_fn) as ds:
+        shape = (ds.height, ds.width)
+    india_frac = np.lib.format.open_memmap(
+        india_fpath, mode='w+', dtype=np.float64, shape=shape
+    )
+    _read_raster(india_frac_fn, india_frac, block_rows)
+    india_frac.flush()
+    del india_frac
+
+    target_frac = np.lib.format.open_memmap(
+        frac_fpath, mode='w+', dtype=np.float64,
+        shape=(len(yrs), len(ICRISAT_NAMES)) + shape
+    )
+    for i, yr in enumerate(yrs):
+        for j, nm in enumerate(ICRISAT_NAMES):
+            _read_raster(
+                icrisat_frac_fpath(datadir, yr, nm),
+                target_frac[i, j, ...], block_rows
+            )
+    target_frac.flush()
+    del target_frac
+
+    write_manifest(manifest_fpath, {
+        'fingerprint': icrisat_store_fingerprint(datadir, yrs),
+        'years': [int(yr) for yr in yrs],
+        'classes': ICRISAT_NAMES
+    })
+
+def icrisat_store_fingerprint(datadir, yrs):
+    fpaths = [icrisat_india_frac_fpath(datadir)]
+    for yr in yrs:
+        for nm in ICRISAT_NAMES:
+            fpaths.append(icrisat_frac_fpath(datadir, yr, nm))
+    return file_fingerprint(fpaths)
+
+def load_icrisat_store(datadir, yrs, cache_dir, block_rows=None):
+    """Open the ICRISAT store, rebuilding it if the source
+    rasters have changed since it was written.
+
+    Returns the (year, class, lat, lon) target fractions and the
+    (lat, lon) India fraction as read-only memory maps, together
+    with the path to the fraction array (which worker processes
+    can map themselves, see `adjust_frac_parallel`).
+    """
+    manifest_fpath = os.path.join(cache_dir, 'icrisat_store.json')
+    manifest = read_manifest(manifest_fpath)
+    fingerprint = icrisat_store_fingerprint(datadir, yrs)
+    if manifest is None or manifest['fingerprint'] != fingerprint:
+        build_icrisat_store(datadir, yrs, cache_dir, block_rows)
+    frac_fpath, india_fpath = icrisat_store_fpaths(cache_dir)
+    target_frac = np.load(frac_fpath, mmap_mode='r')
+    india_frac = np.load(india_fpath, mmap_mode='r')
+    return target_frac, india_frac, frac_fpath
+
+# ##################################### #
+# Year-independent terms
+# ##################################### #
+
+def get_static_terms(current_frac, india_frac, dtype=np.float64):
+    """Compute the terms of the reallocation which do not
+    depend on the ICRISAT target fractions.
+
+    `current_frac` is the (ntype, lat, lon) land cover fraction
+    read from the JULES template and `india_frac` the (lat, lon)
+    fraction of each cell covered by ICRISAT data. Masked values
+    are treated as zero, and the template mask is reduced to a
+    single (lat, lon) land mask. The terms are computed in
+    float64 and then cast to `dtype`.
+    """
+    land = ~np.all(np.ma.getmaskarray(current_frac), axis=0)
+    current_frac = np.ma.filled(current_frac, 0.).astype(np.float64)
+    india_frac = np.ma.filled(india_frac, 0.).astype(np.float64)
+
+    # Extract the portion of the data covered by ICRISAT data
+    current_frac_india = current_frac * india_frac
+    current_frac_not_india = current_frac * (1. - india_frac)
+
+    # TODO: implement changing irrigated area in Pakistan, Bangladesh, Nepal
+
+    # Get relative quantities, and work with these
+    current_frac_india_sum = np.sum(current_frac_india, axis=0)
+    current_frac_india_rel = np.divide(
+        current_frac_india,
+        current_frac_india_sum,
+        out=np.zeros_like(current_frac_india),
+        where=current_frac_india_sum > 0
+    )
+    india_rel_sum = np.sum(current_frac_india_rel, axis=0)
+
+    # These fractions must stay the same
+    cannot_vary_idx = [INDEX[nm] for nm in CANNOT_VARY]
+    cannot_vary_sum = np.sum(
+        current_frac_india_rel[cannot_vary_idx, ...], axis=0
+    )
+
+    # The maximum fraction available for agriculture is the
+    # total (i.e. 1.) minus the sum of land covers which are
+    # not allowed to change
+    max_agri_frac = np.clip(india_rel_sum - cannot_vary_sum, 0., 1.)
+
+    # Add fallow to natural grass
+    c3_grass_idx = INDEX['c3_grass']
+    c4_grass_idx = INDEX['c4_grass']
+    fallow_idx = INDEX['fallow']
+    grass_sum = (
+        current_frac_india_rel[c3_grass_idx, ...]
+        + current_frac_india_rel[c4_grass_idx, ...]
+    )
+    c3_grass_frac = np.divide(
+        current_frac_india_rel[c3_grass_idx, ...],
+        grass_sum,
+        out=np.ones_like(grass_sum),
+        where=grass_sum > 0
+    )
+    current_frac_india_rel[c3_grass_idx, ...] += (
+        current_frac_india_rel[fallow_idx, ...] * c3_grass_frac
+    )
+    current_frac_india_rel[c4_grass_idx, ...] += (
+        current_frac_india_rel[fallow_idx, ...] * (1. - c3_grass_frac)
+    )
+    current_frac_india_rel[fallow_idx, ...] = 0.
+
+    # Find the current fractions of land covers which can vary
+    can_vary_idx = [INDEX[nm] for nm in CAN_VARY]
+    other_frac = current_frac_india_rel[can_vary_idx, ...]
+    other_frac_sum = np.sum(other_frac, axis=0)
+    other_frac_rel = np.divide(
+        other_frac,
+        other_frac_sum,
+        out=np.zeros_like(other_frac),
+        where=other_frac_sum > 0
+    )
+
+    # Current agricultural fraction (fallow has already
+    # been moved to natural grass)
+    agri_idx = [INDEX[nm] for nm in AGRI_LAND_COVERS]
+    agri_frac_sum = np.sum(current_frac_india_rel[agri_idx, ...], axis=0)
+
+    static = {
+        'india_frac': india_frac,
+        'current_frac_not_india': current_frac_not_india,
+        'current_frac_india_rel': current_frac_india_rel,
+        'india_rel_sum': india_rel_sum,
+        'cannot_vary_sum': cannot_vary_sum,
+        'max_agri_frac': max_agri_frac,
+        'c3_grass_frac': c3_grass_frac,
+        'other_frac_rel': other_frac_rel,
+        'agri_frac_sum': agri_frac_sum
+    }
+    static = {nm: val.astype(dtype) for nm, val in static.items()}
+    static['land'] = land
+    return static
+
+# ##################################### #
+# Reallocation
+# ##################################### #
+
+def adjust_frac(target_frac, static, out=None):
+    """Adjust land cover fractions to match ICRISAT targets.
+
+    `target_frac` is a (year, class, lat, lon) array of ICRISAT
+    fractions, with classes ordered as `ICRISAT_NAMES`. All years
+    are processed in one vectorized pass; the result is a
+    (year, ntype, lat, lon) array of updated fractions, written
+    to `out` if given. Cells outside the land mask are set to zero.
+
+    The computation is carried out in the dtype of the static terms
+    (see `get_static_terms`) on plain arrays, using `out` and three
+    (year, lat, lon) buffers as workspace. In float32 the result
+    differs from the float64 result by at most ~1e-6 (absolute);
+    fractions are O(1) and each cell passes through some ten
+    operations, each contributing at most one float32 rounding
+    error (~6e-8).
+    """
+    rel = static['current_frac_india_rel']
+    dtype = rel.dtype
+    nyear = target_frac.shape[0]
+    ntype = rel.shape[0]
+    land = static['land']
+    if out is None:
+        out = np.empty((nyear, ntype) + rel.shape[1:], dtype=dtype)
+    out[...] = 0.
+
+    # Convert the target fractions to fractions of the total cropland
+    # area, then multiply by the revised target sum. The two steps are
+    # combined into a single scale factor, `buf`
+    target_sum = np.sum(target_frac, axis=1, dtype=dtype)
+    buf = np.minimum(target_sum, static['max_agri_frac'])
+    np.maximum(buf, 0., out=buf)
+    np.divide(buf, target_sum, out=buf, where=target_sum > 0)
+    buf[~(target_sum > 0)] = 0.
+    for j, nm in enumerate(ICRISAT_LAND_COVERS):
+        np.multiply(target_frac[:, j, ...], buf, out=out[:, INDEX[nm], ...])
+
+    # Calculate whether the target agricultural fraction
+    # is greater or less than the current agricultural fraction
+    lt_index = target_sum <= static['agri_frac_sum']
+
+    # Calculate the area remaining after having
+    # allocated unvarying and agricultural land covers
+    remaining_area = buf
+    np.subtract(static['india_rel_sum'], static['cannot_vary_sum'], out=remaining_area)
+    np.subtract(remaining_area, target_sum, out=remaining_area)
+    np.clip(remaining_area, 0., 1., out=remaining_area)
+
+    # In the case where target sum is less than the
+    # current agricultural fraction, we will use
+    # natural c3/c4 grass as fill, to avoid increasing
+    # the forest area without justification. Otherwise,
+    # scale all natural land covers
+    diff = target_sum
+    diff[...] = remaining_area
+    for k, nm in enumerate(CAN_VARY):
+        frac = out[:, INDEX[nm], ...]
+        np.multiply(static['other_frac_rel'][k, ...], remaining_area, out=frac)
+        np.copyto(frac, rel[INDEX[nm], ...], where=lt_index)
+        diff -= frac
+    diff[~lt_index] = 0.
+    grass_fill = remaining_area
+    np.multiply(diff, static['c3_grass_frac'], out=grass_fill)
+    out[:, INDEX['c3_grass'], ...] += grass_fill
+    diff -= grass_fill
+    out[:, INDEX['c4_grass'], ...] += diff
+
+    # Shrub and fallow are not allocated within the ICRISAT area
+    for nm in CANNOT_VARY:
+        out[:, INDEX[nm], ...] = rel[INDEX[nm], ...]
+
+    # Multiply by india_frac to convert relative values to actual
+    # values, and add to current_frac_not_india to combine datasets
+    out *= static['india_frac']
+    out += static['current_frac_not_india']
+
+    # FIXME (we can definitely improve this method)
+    # Add triple and continuous irrigated area to double
+    double_idx = INDEX['irrigated_double_season']
+    triple_idx = INDEX['irrigated_triple_season']
+    cont_idx = INDEX['irrigated_continuous']
+    out[:, double_idx, ...] += out[:, triple_idx, ...]
+    out[:, double_idx, ...] += out[:, cont_idx, ...]
+    out[:, triple_idx, ...] = 0.
+    out[:, cont_idx, ...] = 0.
+
+    # Cover any precision errors by dividing by sum
+    updated_frac_sum = np.sum(out, axis=1, out=diff)
+    if np.any(~np.isclose(updated_frac_sum[:, land], 1.0)):
+        raise ValueError(
+            'Adjusted land cover fractions do not sum to one'
+        )
+    updated_frac_sum = updated_frac_sum[:, None, ...]
+    np.divide(out, updated_frac_sum, out=out, where=updated_frac_sum > 0)
+    out[..., ~land] = 0.
+    return out
+
+# ##################################### #
+# Process-pool mode
+# ##################################### #
+
+_WORKER_STATIC = None
+
+def _init_worker(static):
+    global _WORKER_STATIC
+    _WORKER_STATIC = static
+
+def _load_block(target_frac, start, stop):
+    if isinstance(target_frac, str):
+        target_frac = np.load(target_frac, mmap_mode='r')
+    return target_frac[start:stop]
+
+def _adjust_frac_worker(block):
+    return adjust_frac(_load_block(*block), _WORKER_STATIC)
+
+def adjust_frac_parallel(target_frac, static, n_workers=1):
+    """Split years across a process pool and run `adjust_frac`
+    on each block. The static terms are sent to each worker
+    once, rather than with every block. `target_frac` may also
+    be the path to an .npy store, in which case each worker
+    maps its own years from disk instead of receiving a copy."""
+    if isinstance(target_frac, str):
+        nyear = np.load(target_frac, mmap_mode='r').shape[0]
+    else:
+        nyear = target_frac.shape[0]
+    rel = static['current_frac_india_rel']
+    out = np.empty((nyear,) + rel.shape, dtype=rel.dtype)
+    n_workers = max(1, min(n_workers, nyear))
+    if n_workers == 1:
+        return adjust_frac(_load_block(target_frac, 0, nyear), static, out=out)
+    blocks = [
+        (target_frac, idx[0], idx[-1] + 1)
+        for idx in np.array_split(np.arange(nyear), n_workers)
+    ]
+    with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(static,)
+    ) as pool:
+        for block, updated_frac in zip(
+                blocks, pool.map(_adjust_frac_worker, blocks)
+        ):
+            out[block[1]:block[2], ...] = updated_frac
+    return out
+
+# ##################################### #
+# Tiled mode
+# ##################################### #
+
+def _map(arr):
+    if isinstance(arr, str):
+        return np.load(arr, mmap_mode='r')
+    return arr
+
+def adjust_frac_tile(template_fn, target_frac, india_frac, row0, row1,
+                     dtype=np.float64):
+    """Adjust the fractions of rows `row0:row1` of the template.
+
+    Only those rows of the template, and of the (year, class, lat,
+    lon) `target_frac` and (lat, lon) `india_frac` arrays (or paths
+    to .npy stores, which are memory-mapped) are read. Returns the
+    (year, ntype, row, lon) updated fractions and the (row, lon)
+    land mask.
+    """
+    with netCDF4.Dataset(template_fn, 'r') as ds:
+        current_frac = ds['land_cover_lccs'][:, row0:row1, :]
+    static = get_static_terms(
+        current_frac, _map(india_frac)[row0:row1, :], dtype=dtype
+    )
+    target_frac = np.asarray(_map(target_frac)[:, :, row0:row1, :])
+    return adjust_frac(target_frac, static), static['land']
+
+def iter_adjusted_tiles(template_fn, target_frac, india_frac, block_rows,
+                        dtype=np.float64, n_workers=1):
+    """Yield `(row0, row1, frac, land)` for successive blocks of
+    `block_rows` template rows (see `adjust_frac_tile`), so that
+    memory use depends on the block size rather than the size of
+    the domain.
+
+    With `n_workers` > 1 blocks are adjusted in a process pool;
+    `target_frac` and `india_frac` should then be paths to .npy
+    stores. At most two blocks per worker are in flight at once.
+    """
+    with netCDF4.Dataset(template_fn, 'r') as ds:
+        nlat = ds['land_cover_lccs'].shape[1]
+    tiles = [
+        (row0, min(row0 + block_rows, nlat))
+        for row0 in range(0, nlat, block_rows)
+    ]
+    if n_workers <= 1:
+        for row0, row1 in tiles:
+            yield (row0, row1) + adjust_frac_tile(
+                template_fn, target_frac, india_frac, row0, row1, dtype
+            )
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        pending = deque()
+        for row0, row1 in tiles:
+            pending.append((row0, row1, pool.submit(
+                adjust_frac_tile, template_fn, target_frac, india_frac,
+                row0, row1, dtype
+            )))
+            if len(pending) >= 2 * n_workers:
+                row0, row1, future = pending.popleft()
+                yield (row0, row1) + future.result()
+        while pending:
+            row0, row1, future = pending.popleft()
+            yield (row0, row1) + future.result()
+
+# ##################################### #
+# Multi-year output
+# ##################################### #
+
+def _frac_time_units():
+    return 'hours since 1970-01-01 00:00:00', 'gregorian'
+
+def create_multi_year_frac_netcdf(fpath, template_fn, chunk_rows=None):
+    """Create a file to hold adjusted land cover fractions for
+    several years, in the orientation read by JULES.
+
+    `land_cover_lccs` has an unlimited time dimension and one chunk
+    per year (or, with `chunk_rows`, per year and block of rows, for
+    files written tile by tile), so that years can be streamed in as
+    they are computed and read back individually. Latitude is flipped
+    to increasing order if the template stores it decreasing.
+    """
+    tmpl = netCDF4.Dataset(template_fn, 'r')
+    lat_vals = tmpl['latitude'][:]
+    flip = bool(lat_vals[0] > lat_vals[-1])
+    if flip:
+        lat_vals = np.flip(lat_vals)
+    ntype = len(tmpl.dimensions['dim0'])
+    nlat = len(lat_vals)
+    nlon = len(tmpl['longitude'][:])
+
+    nco = netCDF4.Dataset(fpath, 'w', format='NETCDF4')
+    nco.flip_latitude = int(flip)
+    nco.createDimension('time', None)
+    nco.createDimension('dim0', ntype)
+    nco.createDimension('lat', nlat)
+    nco.createDimension('lon', nlon)
+
+    var = nco.createVariable('time', 'i4', ('time',))
+    var.axis = 'T'
+    var.units, var.calendar = _frac_time_units()
+
+    var = nco.createVariable('pseudo_level', 'i4', ('dim0',))
+    var.units = tmpl['pseudo_level'].units
+    var.long_name = tmpl['pseudo_level'].long_name
+    var[:] = tmpl['pseudo_level'][:]
+
+    var = nco.createVariable('lat', np.float32, ('lat',))
+    var.units = 'degrees North'
+    var[:] = lat_vals
+
+    var = nco.createVariable('lon', np.float32, ('lon',))
+    var.units = 'degrees East'
+    var[:] = tmpl['longitude'][:]
+
+    var = nco.createVariable(
+        'land_cover_lccs', 'f8', ('time', 'dim0', 'lat', 'lon'),
+        chunksizes=(1, ntype, min(chunk_rows or nlat, nlat), nlon),
+        fill_value=netCDF4.default_fillvals['f8']
+    )
+    var.standard_name = tmpl['land_cover_lccs'].standard_name
+    var.units = tmpl['land_cover_lccs'].units
+    tmpl.close()
+    return nco
+
+def write_frac_year(nco, index, yr, frac):
+    """Write one year of (dim0, lat, lon) fractions, given in
+    template orientation, to a multi-year file."""
+    if nco.flip_latitude:
+        frac = np.flip(frac, axis=-2)
+    nco['time'][index] = netCDF4.date2num(
+        datetime.datetime(int(yr), 1, 1, 0, 0),
+        nco['time'].units,
+        nco['time'].calendar
+    )
+    nco['land_cover_lccs'][index, ...] = frac
+
+def write_frac_times(nco, yrs):
+    """Write the time axis of a multi-year file."""
+    nco['time'][:] = netCDF4.date2num(
+        [datetime.datetime(int(yr), 1, 1, 0, 0) for yr in yrs],
+        nco['time'].units,
+        nco['time'].calendar
+    )
+
+def write_frac_rows(nco, row0, row1, frac):
+    """Write (year, dim0, lat, lon) fractions of template rows
+    `row0:row1`, for every year, to a multi-year file whose time
+    axis has been written (see `write_frac_times`)."""
+    if nco.flip_latitude:
+        nlat = len(nco.dimensions['lat'])
+        frac = np.flip(frac, axis=-2)
+        row0, row1 = nlat - row1, nlat - row0
+    nco['land_cover_lccs'][0:frac.shape[0], :, row0:row1, :] = frac
+
+def _year_index(nco, yr):
+    yrs = [
+        tm.year for tm in netCDF4.num2date(
+            nco['time'][:], nco['time'].units, nco['time'].calendar
+        )
+    ]
+    return yrs.index(int(yr))
+
+def read_frac_year(fpath, yr):
+    """Read the (dim0, lat, lon) fractions for one year from a
+    multi-year file. The result is a copy in memory (the file is
+    closed on return), in JULES orientation."""
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        return nc['land_cover_lccs'][_year_index(nc, yr), ...]
+
+def _write_jules_frac(out_fpath, pseudo_level, lat_vals, lon_vals,
+                      frac_var, frac, land_index=None):
+    """Write a single-year JULES land cover fraction file, copying the
+    attributes of the `pseudo_level` and `land_cover_lccs` variables
+    of the source file."""
+    with netCDF4.Dataset(out_fpath, 'w') as ncout:
+        ncout.createDimension('dim0', len(pseudo_level))
+
+        var = ncout.createVariable('pseudo_level', 'i4', ('dim0',))
+        var.units = pseudo_level.units
+        var.long_name = pseudo_level.long_name
+        var[:] = pseudo_level[:]
+
+        if land_index is None:
+            ncout.createDimension('lat', len(lat_vals))
+            ncout.createDimension('lon', len(lon_vals))
+            dims = ('lat', 'lon')
+
+            var = ncout.createVariable('lat', np.float32, ('lat',))
+            var.units = 'degrees North'
+            var[:] = lat_vals
+
+            var = ncout.createVariable('lon', np.float32, ('lon',))
+            var.units = 'degrees East'
+            var[:] = lon_vals
+        else:
+            land_index.add_to_netcdf(ncout)
+            dims = (LAND_DIM,)
+
+        var = ncout.createVariable('land_cover_lccs', 'f8', ('dim0',) + dims)
+        var.standard_name = frac_var.standard_name
+        var.units = frac_var.units
+        var[:] = frac if land_index is None else land_index.gather(frac)
+
+def export_frac_year(fpath, yr, out_fpath, land_index=None):
+    """Write one year of a multi-year file as a single-year
+    JULES land cover fraction file, on the land points of
+    `land_index` if it is given (see landpoints.py)."""
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        _write_jules_frac(
+            out_fpath, nc['pseudo_level'], nc['lat'][:], nc['lon'][:],
+            nc['land_cover_lccs'],
+            nc['land_cover_lccs'][_year_index(nc, yr), ...], land_index
+        )
+
+def export_frac_template(fpath, out_fpath, land_index=None):
+    """As `export_frac_year`, for a single-year file in template
+    orientation (written by 04_adjust_jules_frac_w_icrisat.py with
+    `--output-mode per-year`). Latitude is flipped to increasing
+    order, as in `create_multi_year_frac_netcdf`."""
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        lat_vals = nc['latitude'][:]
+        frac = nc['land_cover_lccs'][:]
+        if lat_vals[0] > lat_vals[-1]:
+            lat_axis = nc['land_cover_lccs'].dimensions.index('latitude')
+            lat_vals = np.flip(lat_vals)
+            frac = np.flip(frac, axis=lat_axis)
+        _write_jules_frac(
+            out_fpath, nc['pseudo_level'], lat_vals, nc['longitude'][:],
+            nc['land_cover_lccs'], frac, land_index
+        )
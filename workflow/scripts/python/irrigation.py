@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import numpy as np
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor
+
+from filecache import file_fingerprint
+from landpoints import LAND_DIM, LandIndex, is_land_points, read_grid
+
+# Indices (zero-indexing) of the irrigated land cover types
+IRR_SINGLE_INDEX = 6
+IRR_DOUBLE_INDEX = 7
+IRR_TRIPLE_INDEX = 8
+IRR_CONTINUOUS_INDEX = 9
+IRR_INDEX = [
+    IRR_SINGLE_INDEX,
+    IRR_DOUBLE_INDEX,
+    IRR_TRIPLE_INDEX,
+    IRR_CONTINUOUS_INDEX
+]
+
+# Season boundaries (day of year), taken from Biemans et al. 2016:
+
+# "In the analysis of seasonal irrigation  demand,  we
+# therefore distinguish three seasons: kharif, from June
+# until October; rabi, from November until March; and a
+# dry “summer” season from April to May.  This dry
+# pre-monsoon  summer  season  is  sometimes also
+# called Zaid season."
+
+# Irrigation single [Jun-Sep (end), i.e. assume Kharif only]
+# onset-304
+# Irrigation double [Nov-Mar (end)]
+# 305-90
+# Irrigation triple [Apr-May (end)]
+# 91-151
+# NB: currently not considering Zaid season
+KHARIF_END = 304
+RABI_START = 305
+RABI_END = 90
+ZAID_START = 91
+ZAID_END = 151
+
+# Last day of the year (the schedule is defined for a leap year)
+LAST_DAY = 366
+
+# Irrigation seasons as (start day, end day). 'onset' is replaced
+# by the monsoon onset day of each cell; seasons which start at
+# the onset are empty if it falls after their end, while other
+# seasons with start > end wrap around the end of the year.
+SEASONS = {
+    'kharif': ('onset', KHARIF_END),
+    'rabi': (RABI_START, RABI_END),
+    'zaid': (ZAID_START, ZAID_END),
+    'continuous': (1, LAST_DAY)
+}
+
+# Irrigation scenarios. For each irrigated land cover type, an
+# ordered list of (season, value) rules; where seasons overlap
+# the earlier rule takes precedence. Types without rules are
+# never irrigated. The output file for scenario <name> is
+# jules_5pft_w_crops_irrig_schedule_<name>.nc, except for the
+# standard scenario which has no suffix.
+SCENARIOS = {
+    'standard': {
+        IRR_SINGLE_INDEX: [('kharif', 1)],
+        IRR_DOUBLE_INDEX: [('kharif', 1), ('rabi', 1)],
+        # IRR_TRIPLE_INDEX: [('kharif', 1), ('rabi', 1), ('zaid', 1)],
+        IRR_CONTINUOUS_INDEX: [('continuous', 1)]
+    },
+    # TEST - ensure Kharif season has a different number
+    'policy': {
+        IRR_SINGLE_INDEX: [('kharif', 1)],
+        IRR_DOUBLE_INDEX: [('kharif', 1), ('rabi', 2)],
+        IRR_CONTINUOUS_INDEX: [('kharif', 1), ('continuous', 2)]
+    },
+    'kharif_only': {
+        IRR_SINGLE_INDEX: [('kharif', 1)],
+        IRR_DOUBLE_INDEX: [('kharif', 1)],
+        IRR_CONTINUOUS_INDEX: [('kharif', 1)]
+    },
+    'zaid': {
+        IRR_SINGLE_INDEX: [('kharif', 1)],
+        IRR_DOUBLE_INDEX: [('kharif', 1), ('rabi', 1)],
+        IRR_TRIPLE_INDEX: [('kharif', 1), ('rabi', 1), ('zaid', 1)],
+        IRR_CONTINUOUS_INDEX: [('continuous', 1)]
+    }
+}
+
+def load_scenarios(fpath):
+    """Read scenarios from a JSON file with the same layout as
+    `SCENARIOS`, e.g. {"name": {"6": [["kharif", 1]], ...}}."""
+    with open(fpath, 'r') as f:
+        scenarios = json.load(f)
+    return {
+        name: {
+            int(idx): [(season, int(value)) for season, value in rules]
+            for idx, rules in scenario.items()
+        }
+        for name, scenario in scenarios.items()
+    }
+
+def scenario_fname(name):
+    if name == 'standard':
+        return 'jules_5pft_w_crops_irrig_schedule'
+    return 'jules_5pft_w_crops_irrig_schedule_' + name
+
+# ##################################### #
+# Irrigated area index
+# ##################################### #
+
+def read_irrigated_frac(frac_fpath):
+    """Sum the irrigated land cover fractions in a JULES land
+    cover fraction file, treating missing values as zero."""
+    with netCDF4.Dataset(frac_fpath, 'r') as nc:
+        frac = read_grid(nc, 'land_cover_lccs', IRR_INDEX)
+    return np.sum(np.ma.filled(frac, 0.), axis=0)
+
+def _save_npy(fpath, **arrays):
+    """Save one array (.npy) or several (.npz) atomically."""
+    tmp_fpath = fpath + '.tmp' + os.path.splitext(fpath)[1]
+    if len(arrays) == 1 and fpath.endswith('.npy'):
+        np.save(tmp_fpath, *arrays.values())
+    else:
+        np.savez(tmp_fpath, **arrays)
+    os.replace(tmp_fpath, fpath)
+
+def _remove_stale(cache_dir, prefix, keep):
+    for fname in os.listdir(cache_dir):
+        if fname.startswith(prefix) and fname != keep:
+            os.remove(os.path.join(cache_dir, fname))
+
+def _cached_irrigated_frac(frac_fpath, year, cache_dir):
+    """The irrigated fraction of one year, cached in a file named
+    after the year and the fingerprint of its source file. A changed
+    source file therefore never matches an old entry, which is
+    removed when the new one is written."""
+    fingerprint = file_fingerprint([frac_fpath])
+    prefix = 'irrigated_frac_' + str(year) + '_'
+    fname = prefix + fingerprint + '.npy'
+    fpath = os.path.join(cache_dir, fname)
+    if os.path.exists(fpath):
+        return fingerprint, np.load(fpath)
+    irr_frac = read_irrigated_frac(frac_fpath)
+    _save_npy(fpath, irr_frac=irr_frac)
+    _remove_stale(cache_dir, prefix, fname)
+    return fingerprint, irr_frac
+
+IRRIGATED_FRAC_INDEX_KEYS = [
+    'ever_irrigated',
+    'max_irrigated_frac',
+    'first_irrigated_year',
+    'last_irrigated_year'
+]
+
+def irrigated_frac_index(frac_fpaths, years, cache_dir):
+    """Summarise the irrigated fraction across a time series of
+    land cover fraction files.
+
+    `frac_fpaths` and `years` are parallel lists. The irrigated
+    fraction of each year is cached under `cache_dir`, keyed on the
+    year and a fingerprint of its source file, so that later calls
+    only re-read files which have changed; the reductions are
+    cached too, keyed on all of these, and are returned directly
+    while no file (and not the list of years) has changed. Nothing
+    is written when everything is found in the cache. Returns a dict
+    with the per-cell reductions 'ever_irrigated',
+    'max_irrigated_frac', 'first_irrigated_year' and
+    'last_irrigated_year' (the year fields are zero where a cell is
+    never irrigated).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    years = [int(year) for year in years]
+    fingerprints = [
+        [year, file_fingerprint([frac_fpath])]
+        for frac_fpath, year in zip(frac_fpaths, years)
+    ]
+    index_key = hashlib.sha1(json.dumps(fingerprints).encode()).hexdigest()
+    index_fname = 'irrigated_frac_index_' + index_key + '.npz'
+    index_fpath = os.path.join(cache_dir, index_fname)
+    try:
+        with np.load(index_fpath) as f:
+            return {key: f[key] for key in IRRIGATED_FRAC_INDEX_KEYS}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    irr_frac = np.stack([
+        _cached_irrigated_frac(frac_fpath, year, cache_dir)[1]
+        for frac_fpath, year in zip(frac_fpaths, years)
+    ])
+    years = np.array(years, dtype=np.int16)
+    irrigated = irr_frac > 0
+    ever_irrigated = np.any(irrigated, axis=0)
+    first_year = years[np.argmax(irrigated, axis=0)]
+    last_year = years[::-1][np.argmax(irrigated[::-1, ...], axis=0)]
+    index = {
+        'ever_irrigated': ever_irrigated,
+        'max_irrigated_frac': np.max(irr_frac, axis=0),
+        'first_irrigated_year': np.where(ever_irrigated, first_year, 0),
+        'last_irrigated_year': np.where(ever_irrigated, last_year, 0)
+    }
+    _save_npy(index_fpath, **index)
+    _remove_stale(cache_dir, 'irrigated_frac_index_', index_fname)
+    return index
+
+# ##################################### #
+# Interval encoding
+# ##################################### #
+
+# An irrigation schedule is stored as a set of windows for each
+# type and cell: a start day, an end day and the value which the
+# schedule takes between them (inclusive). Windows with start >
+# end wrap around the end of the year, and windows with value
+# zero are unused. Where windows overlap the earlier one takes
+# precedence.
+
+def _empty_intervals(nwindow, ntype, shape):
+    return {
+        'start': np.zeros((nwindow, ntype) + shape, dtype=np.int16),
+        'end': np.zeros((nwindow, ntype) + shape, dtype=np.int16),
+        'value': np.zeros((nwindow, ntype) + shape, dtype=np.int8)
+    }
+
+def _set_window(intervals, window, idx, start, end, value, where):
+    for key, val in [('start', start), ('end', end), ('value', value)]:
+        np.copyto(intervals[key][window, idx, ...], val, where=where)
+
+def season_windows(onset, irr_mask):
+    """Evaluate `SEASONS` for each cell, returning the start day,
+    end day and a mask of cells where the season applies. Seasons
+    which start at the onset do not apply where it is NaN or masked
+    (no monsoon onset), as `jd >= onset` never held there."""
+    onset = np.ma.filled(np.ma.asarray(onset, dtype=np.float64), np.nan)
+    has_onset = np.isfinite(onset)
+    kharif_start = np.where(
+        has_onset, np.maximum(np.ceil(onset), 1), 0
+    ).astype(np.int16)
+    windows = {}
+    for season, (start, end) in SEASONS.items():
+        valid = irr_mask.copy()
+        if start == 'onset':
+            start = kharif_start
+            valid &= has_onset & (start <= end)
+        windows[season] = (start, end, valid)
+    return windows
+
+def scenario_intervals(onset, irr_mask, ntype, scenarios):
+    """Encode each scenario as irrigation windows.
+
+    `onset` is the (lat, lon) monsoon onset day and `irr_mask` a
+    (lat, lon) boolean mask of irrigated cells, or both are vectors
+    of land points (see landpoints.py). The season windows are
+    evaluated once and shared by all scenarios. Returns a dict of
+    intervals keyed by scenario name.
+    """
+    windows = season_windows(onset, irr_mask)
+    intervals = {}
+    for name, scenario in scenarios.items():
+        nwindow = max([len(rules) for rules in scenario.values()] + [1])
+        iv = _empty_intervals(nwindow, ntype, irr_mask.shape)
+        for idx, rules in scenario.items():
+            for window, (season, value) in enumerate(rules):
+                start, end, valid = windows[season]
+                _set_window(iv, window, idx, start, end, value, valid)
+        intervals[name] = iv
+    return intervals
+
+def expand_intervals(intervals, jd):
+    """Expand intervals to a dense int8 (day, ntype, lat, lon)
+    schedule for the days of year in `jd`; intervals on land points
+    give a (day, ntype, land) schedule."""
+    start = intervals['start']
+    jd = np.asarray(jd, dtype=np.int16).reshape(
+        (-1,) + (1,) * (start.ndim - 1)
+    )
+    end = intervals['end']
+    value = intervals['value']
+    dense = np.zeros((jd.shape[0],) + start.shape[1:], dtype=np.int8)
+    for window in reversed(range(start.shape[0])):
+        after_start = jd >= start[window]
+        before_end = jd <= end[window]
+        on = np.where(
+            start[window] <= end[window],
+            after_start & before_end,
+            after_start | before_end
+        )
+        on &= value[window] > 0
+        np.copyto(dense, value[window], where=on)
+    return dense
+
+def expand_intervals_blocks(intervals, nt, block_size):
+    """Yield the dense schedule for days 1 to `nt` in blocks of
+    `block_size` days, so that only one block is held in memory."""
+    for t0 in range(0, nt, block_size):
+        t1 = min(t0 + block_size, nt)
+        jd = np.arange(t0, t1) + 1
+        yield t0, t1, expand_intervals(intervals, jd)
+
+# ##################################### #
+# Output
+# ##################################### #
+
+def _create_irrig_netcdf(fpath, lai, frac, land_index=None):
+    """Create a file on the grid of the templates or, if `land_index`
+    is given, on its land points, returning the open dataset and the
+    dimensions of a (lat, lon) field."""
+    nco = netCDF4.Dataset(fpath, 'w', format='NETCDF4')
+    nco.createDimension('dim0', len(frac['pseudo_level'][:]))
+    var = nco.createVariable('pseudo_level', 'i4', ('dim0',))
+    var.units = frac['pseudo_level'].units
+    var.long_name = frac['pseudo_level'].long_name
+    var[:] = frac['pseudo_level'][:]
+    if land_index is not None:
+        land_index.add_to_netcdf(nco)
+        return nco, (LAND_DIM,)
+    nco.createDimension('lat', len(lai['lat'][:]))
+    nco.createDimension('lon', len(lai['lon'][:]))
+    var = nco.createVariable('lat', np.float32, ('lat',))
+    var.units = 'degrees North'
+    var[:] = frac['lat'][:]
+    var = nco.createVariable('lon', np.float32, ('lon',))
+    var.units = 'degrees East'
+    var[:] = frac['lon'][:]
+    return nco, ('lat', 'lon')
+
+def create_irrig_schedule_netcdf(fpath, lai, frac, block_size,
+                                 land_index=None):
+    """Create an irrigation schedule file using the LAI and land
+    cover fraction files as templates. `irr_schedule` is chunked
+    by time block and land cover type, and compressed. With
+    `land_index` only land points are written (see landpoints.py).
+    """
+    nco, dims = _create_irrig_netcdf(fpath, lai, frac, land_index)
+    nco.createDimension('tstep', None)
+    var = nco.createVariable('tstep', 'i4', ('tstep',))
+    var.units = lai['tstep'].units
+    var.calendar = lai['tstep'].calendar
+    var[:] = lai['tstep'][:]
+    var = nco.createVariable(
+        'irr_schedule', 'i4', ('tstep', 'dim0') + dims,
+        chunksizes=(block_size, 1) + tuple(
+            len(nco.dimensions[dim]) for dim in dims
+        ),
+        zlib=True
+    )
+    var.standard_name = 'irr_schedule'
+    var.units = '1'
+    return nco
+
+def write_intervals_netcdf(fpath, intervals, lai, frac, land_index=None):
+    """Write interval-encoded irrigation schedules to file. With
+    `land_index` the intervals are on its land points, as is the
+    file."""
+    nco, dims = _create_irrig_netcdf(fpath, lai, frac, land_index)
+    nco.createDimension('window', intervals['start'].shape[0])
+    var = nco.createVariable(
+        'start_day', 'i2', ('window', 'dim0') + dims, zlib=True
+    )
+    var.long_name = 'first day of year of irrigation window'
+    var[:] = intervals['start']
+    var = nco.createVariable(
+        'end_day', 'i2', ('window', 'dim0') + dims, zlib=True
+    )
+    var.long_name = 'last day of year of irrigation window (wraps if before start_day)'
+    var[:] = intervals['end']
+    var = nco.createVariable(
+        'irr_schedule', 'i1', ('window', 'dim0') + dims, zlib=True
+    )
+    var.long_name = 'irrigation schedule value within window (0 = unused)'
+    var.units = '1'
+    var[:] = intervals['value']
+    nco.close()
+
+def read_intervals_netcdf(fpath, grid=False):
+    """Read interval-encoded irrigation schedules from file. If
+    `grid`, intervals stored on land points are scattered onto the
+    (lat, lon) grid, with unused windows elsewhere."""
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        nc.set_auto_mask(False)
+        intervals = {
+            'start': nc['start_day'][:],
+            'end': nc['end_day'][:],
+            'value': nc['irr_schedule'][:]
+        }
+        if not (grid and is_land_points(nc['start_day'])):
+            return intervals
+        land_index = LandIndex.from_netcdf(nc)
+    return {
+        k: np.ma.filled(land_index.scatter(v), 0)
+        for k, v in intervals.items()
+    }
+
+def write_scenario(outdir, name, intervals, lai_fn, frac_fn, block_size,
+                   land_index=None):
+    """Write the interval file and the dense daily schedule for
+    one scenario."""
+    fname = scenario_fname(name)
+    with netCDF4.Dataset(lai_fn, 'r') as lai, \
+         netCDF4.Dataset(frac_fn, 'r') as frac:
+        write_intervals_netcdf(
+            os.path.join(outdir, fname + '_intervals.nc'),
+            intervals, lai, frac, land_index
+        )
+        nt = len(lai['tstep'][:])
+        ncout = create_irrig_schedule_netcdf(
+            os.path.join(outdir, fname + '.nc'), lai, frac, block_size,
+            land_index
+        )
+    for t0, t1, dense in expand_intervals_blocks(intervals, nt, block_size):
+        ncout['irr_schedule'][t0:t1, ...] = dense
+    ncout.close()
+
+def write_scenarios(outdir, intervals, lai_fn, frac_fn, block_size,
+                    n_workers=1, land_index=None):
+    """Write several scenarios, each to its own pair of files.
+    With `n_workers` > 1 scenarios are written concurrently by
+    separate processes, each of which owns its output files. If
+    `land_index` is given the intervals are on its land points
+    (see landpoints.py), and so are the files."""
+    if n_workers <= 1:
+        for name, iv in intervals.items():
+            write_scenario(
+                outdir, name, iv, lai_fn, frac_fn, block_size, land_index
+            )
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [
+            pool.submit(
+                write_scenario, outdir, name, iv, lai_fn, frac_fn,
+                block_size, land_index
+            )
+            for name, iv in intervals.items()
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+import netCDF4
+
+# Land-point (1-D) layout. JULES can read its inputs as a vector of
+# land points rather than as a (lat, lon) grid, which for our
+# basin-masked domains is mostly ocean or masked cells. Files in
+# this layout have a `land` dimension in place of the two grid
+# dimensions, a `land_index` variable holding the flat (row-major)
+# grid index of each point, with the grid shape as attributes, and
+# the latitude and longitude of each point. A LandIndex gathers
+# (..., lat, lon) arrays into this layout on write, and scatters
+# them back on read. Points are in row-major order, so those of a
+# block of rows are contiguous.
+
+LAND_DIM = 'land'
+
+class LandIndex(object):
+    """Index of the land points of a (lat, lon) grid.
+
+    `mask` is a boolean (lat, lon) land mask; `lat_vals` and
+    `lon_vals`, if given, are the coordinates of the grid, from
+    which the coordinates of each land point are written.
+    """
+    def __init__(self, mask, lat_vals=None, lon_vals=None):
+        mask = np.ma.filled(mask, False).astype(bool)
+        self.shape = mask.shape
+        self.index = np.flatnonzero(mask)
+        self.lat_vals = lat_vals
+        self.lon_vals = lon_vals
+
+    @classmethod
+    def from_index(cls, index, shape, lat_vals=None, lon_vals=None):
+        mask = np.zeros(shape, dtype=bool)
+        mask.flat[index] = True
+        return cls(mask, lat_vals, lon_vals)
+
+    @property
+    def nland(self):
+        return len(self.index)
+
+    def gather(self, x):
+        """Gather a (..., lat, lon) array into (..., land)."""
+        return x.reshape(x.shape[:-2] + (-1,))[..., self.index]
+
+    def scatter(self, x, fill_value=0):
+        """Scatter a (..., land) array onto the (..., lat, lon) grid,
+        as a masked array in which non-land cells are masked."""
+        npoint = self.shape[0] * self.shape[1]
+        data = np.full(x.shape[:-1] + (npoint,), fill_value, dtype=x.dtype)
+        data[..., self.index] = np.ma.filled(x, fill_value)
+        mask = np.ones(data.shape, dtype=bool)
+        mask[..., self.index] = np.ma.getmaskarray(x)
+        shape = x.shape[:-1] + self.shape
+        return np.ma.array(data.reshape(shape), mask=mask.reshape(shape))
+
+    def row_slice(self, row0, row1):
+        """The slice of the land points which lie in rows `row0:row1`."""
+        nlon = self.shape[1]
+        i0, i1 = np.searchsorted(self.index, [row0 * nlon, row1 * nlon])
+        return slice(int(i0), int(i1))
+
+    def gather_rows(self, x, row0, row1):
+        """Gather a (..., row, lon) block of rows `row0:row1`; the
+        result is written to `row_slice(row0, row1)` of the land
+        dimension."""
+        index = self.index[self.row_slice(row0, row1)] - row0 * self.shape[1]
+        return x.reshape(x.shape[:-2] + (-1,))[..., index]
+
+    def grid_flipped(self, lat_vals, lon_vals, atol=1e-4):
+        """Whether the (lat, lon) grid with coordinates `lat_vals`,
+        `lon_vals` is the grid of this index with latitude reversed
+        (as read from a north-up raster), so that its rows must be
+        flipped before the points are gathered. Raises ValueError if
+        it is another grid."""
+        lat_vals = np.asarray(lat_vals, dtype=np.float64)
+        lon_vals = np.asarray(lon_vals, dtype=np.float64)
+        if (len(lat_vals), len(lon_vals)) == self.shape \
+           and np.allclose(lon_vals, self.lon_vals, atol=atol):
+            if np.allclose(lat_vals, self.lat_vals, atol=atol):
+                return False
+            if np.allclose(lat_vals[::-1], self.lat_vals, atol=atol):
+                return True
+        raise ValueError('Grid does not match land index')
+
+    def add_to_netcdf(self, nco, lat_name='lat', lon_name='lon'):
+        """Add the land dimension, the index and (if known) the
+        coordinates of each land point to a netCDF object."""
+        nco.createDimension(LAND_DIM, self.nland)
+        var = nco.createVariable('land_index', 'i4', (LAND_DIM,))
+        var.long_name = 'row-major index of land point in (lat, lon) grid'
+        var.nlat, var.nlon = self.shape
+        var[:] = self.index
+        if self.lat_vals is None or self.lon_vals is None:
+            return nco
+        rows, cols = np.unravel_index(self.index, self.shape)
+        var = nco.createVariable(lat_name, np.float32, (LAND_DIM,))
+        var.units = 'degrees_north'
+        var.standard_name = 'latitude'
+        var[:] = np.asarray(self.lat_vals)[rows]
+        var = nco.createVariable(lon_name, np.float32, (LAND_DIM,))
+        var.units = 'degrees_east'
+        var.standard_name = 'longitude'
+        var[:] = np.asarray(self.lon_vals)[cols]
+        return nco
+
+    @classmethod
+    def from_netcdf(cls, nc):
+        """Read the index of a file in land-point layout."""
+        var = nc['land_index']
+        return cls.from_index(var[:], (int(var.nlat), int(var.nlon)))
+
+    def write(self, fpath):
+        """Write the index on its own, to be shared by other writers."""
+        with netCDF4.Dataset(fpath, 'w', format='NETCDF4') as nco:
+            nco.createDimension('lat', self.shape[0])
+            nco.createDimension('lon', self.shape[1])
+            var = nco.createVariable('grid_lat', np.float64, ('lat',))
+            var[:] = self.lat_vals
+            var = nco.createVariable('grid_lon', np.float64, ('lon',))
+            var[:] = self.lon_vals
+            self.add_to_netcdf(nco)
+
+    @classmethod
+    def read(cls, fpath):
+        """Read an index written by `write`."""
+        with netCDF4.Dataset(fpath, 'r') as nc:
+            li = cls.from_netcdf(nc)
+            li.lat_vals = nc['grid_lat'][:]
+            li.lon_vals = nc['grid_lon'][:]
+        return li
+
+def is_land_points(var):
+    return len(var.dimensions) > 0 and var.dimensions[-1] == LAND_DIM
+
+def read_grid(nc, var_name, *index):
+    """Read `var[index + (...,)]` as a (..., lat, lon) masked array,
+    scattering it onto the grid if the variable is stored in
+    land-point layout. `index` selects along the leading dimensions.
+    """
+    var = nc[var_name]
+    x = var[index + (Ellipsis,)]
+    if is_land_points(var):
+        return LandIndex.from_netcdf(nc).scatter(x)
+    return x
+
+def to_land_points(fpath, land_index, lat_dim='lat', lon_dim='lon'):
+    """Rewrite a gridded netCDF file in land-point layout.
+
+    Variables whose last two dimensions are `lat_dim`, `lon_dim` are
+    gathered onto the land points; the grid coordinate variables are
+    replaced by the coordinates of each point; everything else is
+    copied unchanged. Data are copied without masking or scaling.
+    The file is replaced atomically.
+    """
+    tmp_fpath = fpath + '.tmp'
+    with netCDF4.Dataset(fpath, 'r') as src:
+        if (len(src.dimensions[lat_dim]), len(src.dimensions[lon_dim])) \
+           != land_index.shape:
+            raise ValueError(fpath + ': grid does not match land index')
+        dst = netCDF4.Dataset(tmp_fpath, 'w', format=src.data_model)
+        src.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+        for nm, dim in src.dimensions.items():
+            if nm not in (lat_dim, lon_dim):
+                dst.createDimension(
+                    nm, None if dim.isunlimited() else len(dim)
+                )
+        land_index.add_to_netcdf(dst, lat_dim, lon_dim)
+        for nm, var in src.variables.items():
+            if nm in (lat_dim, lon_dim):
+                continue
+            dims = var.dimensions
+            gather = dims[-2:] == (lat_dim, lon_dim)
+            if gather:
+                dims = dims[:-2] + (LAND_DIM,)
+            fill_value = var.__dict__.get('_FillValue')
+            out = dst.createVariable(
+                nm, var.datatype, dims, fill_value=fill_value
+            )
+            out.setncatts({
+                k: v for k, v in var.__dict__.items() if k != '_FillValue'
+            })
+            out.set_auto_maskandscale(False)
+            x = var[:]
+            out[:] = land_index.gather(x) if gather else x
+        dst.close()
+    os.replace(tmp_fpath, fpath)
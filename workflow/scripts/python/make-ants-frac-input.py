@@ -3,11 +3,17 @@
 
 import os
 import click
-import shutil
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import netCDF4
 
-from write_jules_frac import write_jules_frac_ants
+from utils import region_grid
+from write_jules_frac import (
+    get_jules_frac, iter_jules_frac_blocks, create_frac_ants_netcdf,
+    write_frac_ants_netcdf, FracReader
+)
+from filecache import ArtifactCache, copy_file
 
 # Read environment variables from parent
 ONE_D = False
@@ -18,6 +24,10 @@ REGION = str(os.environ['REGION'])
 PRODUCT = str(os.environ['PRODUCT'])
 OUTDIR = str(os.environ['OUTDIR'])
 
+# Default period of the fraction files
+YEAR0 = 2015
+YEAR1 = 2015
+
 LC_NAMES_5PFT = [
     'tree_broadleaf',
     'tree_needleleaf',
@@ -46,93 +56,206 @@ LC_NAMES_9PFT = [
 ]
 LU_NAMES = ['combined', 'natural', 'rainfed', 'irrigated']
 
+# Source files of the ANTS fraction inputs, whose contents key the
+# artifact cache (see filecache.py): this script and every local
+# module it imports, directly or not
+CODE = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), fn)
+    for fn in [
+        'make-ants-frac-input.py', 'write_jules_frac.py', 'utils.py',
+        'landpoints.py', 'filecache.py'
+    ]
+]
+
+def ants_frac_fn(destdir, landuse, pft, year, file_suffix):
+    return os.path.join(
+        destdir,
+        'jules_frac_' + landuse + '_' + pft + '_ants_' + str(year) + '_' + file_suffix
+    )
+
+def no_c4_crops(frac, c3_index, c4_index):
+    """Fractions which assume all crops are c3."""
+    frac = frac.copy()
+    frac[c3_index, ...] += frac[c4_index, ...]
+    frac[c4_index, ...] = 0
+    return frac
+
+# Land uses derived from another land use's fractions, as
+# (landuse, source, transform). Variants without a transform have
+# the same fractions as their source, and are copies of its file.
+VARIANTS = {
+    'rainfed': [
+        ('rainfed_no_c4_crops', 'rainfed', no_c4_crops),
+        # the proportion of fallow land devoted to c3/c4
+        # is the same as for rainfed
+        ('fallow', 'rainfed', None),
+        ('fallow_no_c4_crops', 'rainfed_no_c4_crops', None)
+    ],
+    'irrigated': [
+        ('irrigated_no_c4_crops', 'irrigated', no_c4_crops)
+    ]
+}
+
+def variant_landuses(landuse):
+    """Land uses whose fraction files are derived from `landuse`."""
+    return [landuse] + [lu for lu, _, _ in VARIANTS.get(landuse, [])]
+
+def derive_variants(landuse, frac, c3_index, c4_index):
+    """Return the fractions of `landuse` and of the variants derived
+    from it by a transform, by land use.
+    """
+    fracs = OrderedDict()
+    fracs[landuse] = frac
+    for lu, source, transform in VARIANTS.get(landuse, []):
+        if transform is not None:
+            fracs[lu] = transform(fracs[source], c3_index, c4_index)
+    return fracs
+
+def write_ants_frac(destdir, year, landuse, lc_names, pft, file_suffix,
+                    c3_index, c4_index, reader=None, block_rows=None):
+    """Write the ANTS fraction file of one land use, and the files
+    derived from it.
+
+    The fractions are computed once, and the variants derived from
+    them in memory, then written one file after another. If
+    `block_rows` is given the fractions are instead computed in
+    blocks of rows, each of which is written to every file in turn.
+    """
+    def frac_fn(lu):
+        return ants_frac_fn(destdir, lu, pft, year, file_suffix)
+
+    if block_rows is not None:
+        ncos = None
+        for row0, row1, frac in iter_jules_frac_blocks(
+                year, lc_names, block_rows):
+            fracs = derive_variants(landuse, frac, c3_index, c4_index)
+            if ncos is None:
+                ncos = OrderedDict(
+                    (lu, create_frac_ants_netcdf(frac_fn(lu), len(lc_names)))
+                    for lu in fracs
+                )
+            for lu, nco in ncos.items():
+                nco['land_cover_lccs'][:, row0:row1, :] = fracs[lu]
+        for nco in ncos.values():
+            nco.close()
+    else:
+        fracs = derive_variants(
+            landuse, get_jules_frac(year, lc_names, reader=reader),
+            c3_index, c4_index
+        )
+        for lu, frac in fracs.items():
+            write_frac_ants_netcdf(frac, frac_fn(lu))
+    for lu, source, transform in VARIANTS.get(landuse, []):
+        if transform is None:
+            copy_file(frac_fn(source), frac_fn(lu))
+
+def cached_write_ants_frac(cache, destdir, year, landuse, lc_names, pft,
+                           file_suffix, c3_index, c4_index, reader=None,
+                           block_rows=None):
+    """As `write_ants_frac`, restoring the files from `cache` if
+    their inputs and code are unchanged.
+    """
+    outputs = [
+        ants_frac_fn(destdir, lu, pft, year, file_suffix)
+        for lu in variant_landuses(landuse)
+    ]
+    inputs = [os.environ['JULES_LAND_FRAC_FN']] + [
+        os.environ['LC_' + lc_name.upper() + '_' + str(year) + '_FN']
+        for lc_name in lc_names
+    ]
+    key = cache.key(
+        inputs, {'year': year, 'lc_names': lc_names, 'landuse': landuse}, CODE
+    )
+    cache.cached(
+        key, outputs,
+        lambda: write_ants_frac(
+            destdir, year, landuse, lc_names, pft, file_suffix,
+            c3_index, c4_index, reader, block_rows
+        )
+    )
+
+def make_ants_frac_input(cache, destdir, year, file_suffix, read_threads=4,
+                         block_rows=None):
+    """Write the ANTS fraction files of every land use of one year."""
+    # (pft, lc_names, c3_index, c4_index) of each land use
+    variants = {}
+    for landuse in LU_NAMES:
+        variants[landuse] = []
+        if FIVEPFT:
+            variants[landuse].append((
+                '5pft', [lc + '_' + landuse for lc in LC_NAMES_5PFT], 2, 3
+            ))
+        if NINEPFT:
+            variants[landuse].append((
+                '9pft', [lc + landuse for lc in LC_NAMES_9PFT], 5, 6
+            ))
+    # every class raster of the year is read (at most) once, and
+    # only if some output is not already in the cache
+    reader = FracReader(
+        year,
+        [nm for vs in variants.values() for v in vs for nm in v[1]],
+        n_workers=read_threads
+    )
+    for landuse in LU_NAMES:
+        for pft, lc_names, c3_index, c4_index in variants[landuse]:
+            cached_write_ants_frac(
+                cache, destdir, year, landuse, lc_names, pft,
+                file_suffix, c3_index, c4_index, reader, block_rows
+            )
+
 @click.command()
 @click.option(
     '-d', 'destdir', nargs=1, default='.', type=str,
     help='Destination directory.'
 )
-def main(destdir):
+@click.option(
+    '--cache-dir', 'cache_dir',
+    default=os.path.join(OUTDIR, 'cache', 'artifacts'), type=str,
+    help='Directory of the artifact cache.'
+)
+@click.option(
+    '--cache-max-gb', 'cache_max_gb', default=10., type=float,
+    help='Maximum size of the artifact cache (GB).'
+)
+@click.option('--year0', default=YEAR0, type=int)
+@click.option('--year1', default=YEAR1, type=int)
+@click.option(
+    '--read-threads', 'read_threads', default=4, type=int,
+    help='Number of land cover rasters read concurrently.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of years processed concurrently.'
+)
+@click.option(
+    '--block-rows', 'block_rows', default=None, type=int,
+    help='Process the domain in blocks of this many rows, for grids '
+    'too large to hold in memory.'
+)
+def main(destdir, cache_dir, cache_max_gb, year0, year1, read_threads,
+         n_workers, block_rows):
+    cache = ArtifactCache(cache_dir, int(cache_max_gb * 1024 ** 3))
     file_suffix = PRODUCT + '_' + REGION + '.nc'
-    years = [2015]
-    for year in years:
-        for landuse in LU_NAMES:
-            if FIVEPFT:
-                lc_names = [lc + '_' + landuse for lc in LC_NAMES_5PFT]
-                frac_fn = os.path.join(
-                    destdir,
-                    'jules_frac_' + landuse + '_5pft_ants_' + str(year) + '_' + file_suffix
-                )
-                write_jules_frac_ants(
-                    year,
-                    lc_names,
-                    frac_fn
-                )
-                if landuse in ['rainfed', 'irrigated']:
-                    # create a file which assumes all crops are c3
-                    frac_wo_c4_fn = os.path.join(
-                        destdir,
-                        'jules_frac_' + landuse + '_no_c4_crops_5pft_ants_' + str(year) + '_' + file_suffix
-                        )
-                    shutil.copy2(frac_fn, frac_wo_c4_fn)
-                    nco = netCDF4.Dataset(frac_wo_c4_fn, 'r+')
-                    frac = nco['land_cover_lccs'][:].copy()
-                    frac[2, ...] += frac[3, ...]
-                    frac[3, ...] = 0
-                    nco['land_cover_lccs'][:] = frac
-                    nco.close()
-
-                if landuse in ['rainfed']:
-                    # to create the fallow input we copy the data for
-                    # rainfed as the proportion devoted to c3/c4 will
-                    # be the same
-                    fallow_frac_fn = os.path.join(
-                        destdir,
-                        'jules_frac_fallow_5pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    shutil.copy2(frac_fn, fallow_frac_fn)
-                    fallow_frac_wo_c4_fn = os.path.join(
-                        destdir,
-                        'jules_frac_fallow_no_c4_crops_5pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    shutil.copy2(frac_wo_c4_fn, fallow_frac_wo_c4_fn)                        
-                
-            if NINEPFT:            
-                lc_names = [lc + landuse for lc in LC_NAMES_9PFT]
-                frac_fn = os.path.join(
-                    destdir,
-                    'jules_frac_' + landuse + '_9pft_ants_' + str(year) + '_' + file_suffix
-                )
-                write_jules_frac_ants(
-                    year,
-                    lc_names,
-                    frac_fn
-                )
-                if landuse in ['rainfed', 'irrigated']:
-                    # create a file which assumes all crops are c3
-                    frac_wo_c4_fn = os.path.join(
-                        destdir,
-                        'jules_frac_' + landuse + '_no_c4_crops_9pft_ants_' + str(year) + '_' + file_suffix
-                        )
-                    shutil.copy2(frac_fn, frac_wo_c4_fn)
-                    nco = netCDF4.Dataset(frac_wo_c4_fn, 'r+')
-                    frac = nco['land_cover_lccs'][:].copy()
-                    frac[5, ...] += frac[6, ...]
-                    frac[6, ...] = 0
-                    nco['land_cover_lccs'][:] = frac
-                    nco.close()
-                
-                if landuse in ['rainfed']:
-                    # as above, we copy rainfed data to fallow 
-                    fallow_frac_fn = os.path.join(
-                        destdir,
-                        'jules_frac_fallow_9pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    shutil.copy2(frac_fn, fallow_frac_fn)
-                    fallow_frac_wo_c4_fn = os.path.join(
-                        destdir,
-                        'jules_frac_fallow_no_c4_crops_9pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    shutil.copy2(frac_wo_c4_fn, fallow_frac_wo_c4_fn)                        
+    years = range(year0, year1 + 1)
+    if n_workers <= 1:
+        for year in years:
+            make_ants_frac_input(
+                cache, destdir, year, file_suffix, read_threads, block_rows
+            )
+        return
+    # Read the grid and land mask before any workers are started:
+    # forked workers share it, others load its sidecar file
+    region_grid().load(land_frac=block_rows is None)
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(
+                make_ants_frac_input, cache, destdir, year, file_suffix,
+                read_threads, block_rows
+            )
+            for year in years
+        ]
+        for future in futures:
+            future.result()
 
 if __name__ == '__main__':
     main()
@@ -3,10 +3,12 @@
 
 import os
 import click
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import netCDF4
 
-from write_jules_frac import write_jules_frac_ants
+from utils import region_grid
+from write_jules_frac import write_jules_frac_ants, FracReader
 
 # Read environment variables from parent
 ONE_D = False
@@ -16,6 +18,10 @@ REGION = str(os.environ['REGION'])
 PRODUCT = str(os.environ['PRODUCT'])
 OUTDIR = str(os.environ['OUTDIR'])
 
+# Default period of the fraction files
+YEAR0 = 2015
+YEAR1 = 2015
+
 # names of JULES land cover types
 LC_NAMES_5PFT = [
     'tree_broadleaf_natural',
@@ -56,36 +62,84 @@ LC_NAMES_9PFT = [
     'snow_ice_natural'
 ]
 
+def make_frac_input(destdir, year, file_suffix, read_threads=4,
+                    block_rows=None):
+    """Write the 5 and/or 9 PFT fraction files of one year."""
+    # the 5 and 9 PFT classes overlap; read each raster once
+    lc_names = []
+    if FIVEPFT:
+        lc_names += LC_NAMES_5PFT
+    if NINEPFT:
+        lc_names += LC_NAMES_9PFT
+    reader = FracReader(year, lc_names, n_workers=read_threads)
+    if FIVEPFT:
+        frac_fn = os.path.join(
+            destdir,
+            'jules_frac_5pft_ants_' + str(year) + '_' + file_suffix
+        )
+        write_jules_frac_ants(
+            year,
+            LC_NAMES_5PFT,
+            frac_fn,
+            reader,
+            block_rows
+        )
+
+    if NINEPFT:
+        frac_fn = os.path.join(
+            destdir,
+            'jules_frac_9pft_ants_' + str(year) + '_' + file_suffix
+        )
+        write_jules_frac_ants(
+            year,
+            LC_NAMES_9PFT,
+            frac_fn,
+            reader,
+            block_rows
+        )
+
 @click.command()
 @click.option(
     '-d', 'destdir', nargs=1, default='.', type=str,
     help='Destination directory.'
 )
-def main(destdir):
+@click.option('--year0', default=YEAR0, type=int)
+@click.option('--year1', default=YEAR1, type=int)
+@click.option(
+    '--read-threads', 'read_threads', default=4, type=int,
+    help='Number of land cover rasters read concurrently.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of years processed concurrently.'
+)
+@click.option(
+    '--block-rows', 'block_rows', default=None, type=int,
+    help='Process the domain in blocks of this many rows, for grids '
+    'too large to hold in memory.'
+)
+def main(destdir, year0, year1, read_threads, n_workers, block_rows):
     file_suffix = PRODUCT + '_' + REGION + '.nc'    
-    years = [2015]
-    for year in years:
-        if FIVEPFT:
-            frac_fn = os.path.join(
-                destdir,
-                'jules_frac_5pft_ants_' + str(year) + '_' + file_suffix
-            )
-            write_jules_frac_ants(
-                year,
-                LC_NAMES_5PFT,
-                frac_fn
-            )
-
-        if NINEPFT:
-            frac_fn = os.path.join(
-                destdir,
-                'jules_frac_9pft_ants_' + str(year) + '_' + file_suffix
+    years = range(year0, year1 + 1)
+    # Read the grid and land mask before any workers are started:
+    # forked workers share it, others load its sidecar file
+    region_grid().load(land_frac=block_rows is None)
+    if n_workers <= 1:
+        for year in years:
+            make_frac_input(
+                destdir, year, file_suffix, read_threads, block_rows
             )
-            write_jules_frac_ants(
-                year,
-                LC_NAMES_9PFT,
-                frac_fn
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(
+                make_frac_input, destdir, year, file_suffix, read_threads,
+                block_rows
             )
+            for year in years
+        ]
+        for future in futures:
+            future.result()
 
 if __name__ == '__main__':
     main()
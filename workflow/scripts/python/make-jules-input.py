@@ -3,10 +3,13 @@
 
 import os
 import click
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import netCDF4
 
-from write_jules_frac import write_jules_frac, write_jules_frac_ants
+from utils import region_grid
+from landpoints import LandIndex
+from write_jules_frac import write_jules_frac, write_jules_frac_ants, FracReader
 # from write_jules_land_frac import write_jules_land_frac
 # from write_jules_latlon import write_jules_latlon
 # from write_jules_overbank_props import write_jules_overbank_props
@@ -16,8 +19,14 @@ from write_jules_frac import write_jules_frac, write_jules_frac_ants
 # from write_jules_top import write_jules_top
 
 # Read environment variables from parent
-ONE_D = False
-# ONE_D = bool(int(os.environ['ONE_D']))
+# Write the JULES format fractions on land points only (see
+# landpoints.py): those of the index written by
+# 07_select-wfdei-ancil-data.py with --land-points, which the other
+# JULES ancillaries share
+ONE_D = bool(int(os.environ.get('ONE_D', '0')))
+LAND_INDEX_FN = os.environ.get(
+    'LAND_INDEX_FN', '../data/wfdei/ancils/jules_land_index_igp.nc'
+)
 # PDM = bool(int(os.environ['PDM']))
 # TOPMODEL = bool(int(os.environ['TOPMODEL']))
 # ROUTING = bool(int(os.environ['ROUTING']))
@@ -35,6 +44,10 @@ REGION = str(os.environ['REGION'])
 PRODUCT = str(os.environ['PRODUCT'])
 OUTDIR = str(os.environ['OUTDIR'])
 
+# Default period of the fraction files
+YEAR0 = 2015
+YEAR1 = 2015
+
 # names of JULES land cover types
 LC_NAMES_5PFT = [
     'tree_broadleaf', 'tree_needleleaf',
@@ -52,66 +65,118 @@ LC_NAMES_9PFT = [
 ]
 LU_NAMES = ['combined', 'natural', 'rainfed', 'irrigated']
 
-@click.command()
-@click.option(
-    '-d', 'destdir', nargs=1, default='.', type=str,
-    help='Destination directory.'
-)
-def main(destdir):
-    file_suffix = PRODUCT + '_' + REGION + '.nc'    
-    years = [2015]
-    for year in years:
-        for landuse in LU_NAMES:
-            if FIVEPFT:
-                lc_names = [lc + '_' + landuse for lc in LC_NAMES_5PFT]
-                if ANTSFORMAT:
-                    frac_fn = os.path.join(
-                        destdir,
-                        'jules_frac_' + landuse + '_5pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    write_jules_frac_ants(
-                        year,
-                        lc_names,
-                        # LC_NAMES_5PFT,
-                        frac_fn
-                    )
-
+def make_jules_input(destdir, year, file_suffix, block_rows=None,
+                     land_index=None):
+    """Write the fraction files of every land use of one year, on
+    the points of `land_index` if it is given."""
+    # read each class raster of the year once, for all land uses
+    lc_names = []
+    for landuse in LU_NAMES:
+        if FIVEPFT:
+            lc_names += [lc + '_' + landuse for lc in LC_NAMES_5PFT]
+        if NINEPFT:
+            lc_names += [lc + landuse for lc in LC_NAMES_9PFT]
+    reader = FracReader(year, lc_names)
+    for landuse in LU_NAMES:
+        if FIVEPFT:
+            lc_names = [lc + '_' + landuse for lc in LC_NAMES_5PFT]
+            if ANTSFORMAT:
                 frac_fn = os.path.join(
                     destdir,
-                    'jules_frac_' + landuse + '_5pft_' + str(year) + '_' + file_suffix
+                    'jules_frac_' + landuse + '_5pft_ants_' + str(year) + '_' + file_suffix
                 )
-                write_jules_frac(
+                write_jules_frac_ants(
                     year,
                     lc_names,
                     # LC_NAMES_5PFT,
                     frac_fn,
-                    ONE_D
+                    reader,
+                    block_rows
                 )
 
-            if NINEPFT:            
-                lc_names = [lc + landuse for lc in LC_NAMES_9PFT]
-                if ANTSFORMAT:
-                    frac_fn = os.path.join(
-                        destdir,
-                        'jules_frac' + landuse + '_9pft_ants_' + str(year) + '_' + file_suffix
-                    )
-                    write_jules_frac_ants(
-                        year,
-                        lc_names,
-                        # LC_NAMES_9PFT,
-                        frac_fn
-                    )
+            frac_fn = os.path.join(
+                destdir,
+                'jules_frac_' + landuse + '_5pft_' + str(year) + '_' + file_suffix
+            )
+            write_jules_frac(
+                year,
+                lc_names,
+                # LC_NAMES_5PFT,
+                frac_fn,
+                land_index,
+                reader,
+                block_rows
+            )
 
+        if NINEPFT:            
+            lc_names = [lc + landuse for lc in LC_NAMES_9PFT]
+            if ANTSFORMAT:
                 frac_fn = os.path.join(
                     destdir,
-                    'jules_frac' + landuse + '_9pft_' + str(year) + '_' + file_suffix
+                    'jules_frac' + landuse + '_9pft_ants_' + str(year) + '_' + file_suffix
                 )
-                write_jules_frac(
+                write_jules_frac_ants(
                     year,
                     lc_names,
                     # LC_NAMES_9PFT,
                     frac_fn,
-                    ONE_D)
+                    reader,
+                    block_rows
+                )
+
+            frac_fn = os.path.join(
+                destdir,
+                'jules_frac' + landuse + '_9pft_' + str(year) + '_' + file_suffix
+            )
+            write_jules_frac(
+                year,
+                lc_names,
+                # LC_NAMES_9PFT,
+                frac_fn,
+                land_index,
+                reader,
+                block_rows
+            )
+
+@click.command()
+@click.option(
+    '-d', 'destdir', nargs=1, default='.', type=str,
+    help='Destination directory.'
+)
+@click.option('--year0', default=YEAR0, type=int)
+@click.option('--year1', default=YEAR1, type=int)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of years processed concurrently.'
+)
+@click.option(
+    '--block-rows', 'block_rows', default=None, type=int,
+    help='Process the domain in blocks of this many rows, for grids '
+    'too large to hold in memory.'
+)
+def main(destdir, year0, year1, n_workers, block_rows):
+    file_suffix = PRODUCT + '_' + REGION + '.nc'    
+    years = range(year0, year1 + 1)
+    # Read the grid and land mask before any workers are started:
+    # forked workers share it, others load its sidecar file
+    region_grid().load(land_frac=block_rows is None)
+    land_index = LandIndex.read(LAND_INDEX_FN) if ONE_D else None
+    if n_workers <= 1:
+        for year in years:
+            make_jules_input(
+                destdir, year, file_suffix, block_rows, land_index
+            )
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(
+                make_jules_input, destdir, year, file_suffix, block_rows,
+                land_index
+            )
+            for year in years
+        ]
+        for future in futures:
+            future.result()
 
 if __name__ == '__main__':
     main()
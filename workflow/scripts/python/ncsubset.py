@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import netCDF4
+
+# Subset netCDF files to a lat/lon box without writing a global
+# intermediate. This replaces the copy -> ncrename -> add lat/lon
+# -> `ncks -d lon,XMIN,XMAX -d lat,YMIN,YMAX` sequence: the index
+# window is computed from the coordinate values (inclusive at both
+# ends, as ncks does), only that hyperslab is read from the source,
+# and the regional file is written with renamed dimensions in one
+# pass. Data are copied without masking or scaling, so values and
+# attributes are carried over unchanged, as are the compression,
+# shuffle and checksum filters and (clipped to the window) the
+# chunking of each variable.
+
+def coord_window(vals, vmin, vmax):
+    """Return the slice of `vals` lying within [vmin, vmax]."""
+    index = np.flatnonzero((vals >= vmin) & (vals <= vmax))
+    if index.size == 0:
+        raise ValueError(
+            'No coordinate values between ' + str(vmin) + ' and ' + str(vmax)
+        )
+    return slice(index[0], index[-1] + 1)
+
+def netcdf_window(fpath, xmin, xmax, ymin, ymax):
+    """Return the lat/lon index window of a region in a netCDF file."""
+    with netCDF4.Dataset(fpath, 'r') as nc:
+        return {
+            'lat': coord_window(nc['lat'][:], ymin, ymax),
+            'lon': coord_window(nc['lon'][:], xmin, xmax)
+        }
+
+# Filters of `Variable.filters()` which `createVariable` accepts
+FILTERS = ['zlib', 'complevel', 'shuffle', 'fletcher32']
+
+def storage_kwargs(var, shape):
+    """Return the `createVariable` keywords which give a copy of
+    `var`, of shape `shape`, the filters and chunking of `var`.
+    Chunks are clipped to `shape`."""
+    filters = var.filters()
+    if not filters:
+        # netCDF3 or scalar variables
+        return {}
+    kwargs = {k: filters[k] for k in FILTERS if k in filters}
+    chunks = var.chunking()
+    if chunks and chunks != 'contiguous':
+        kwargs['chunksizes'] = [
+            max(1, min(c, n)) for c, n in zip(chunks, shape)
+        ]
+    return kwargs
+
+def _add_coord(nco, name, units, vals):
+    var = nco.createVariable(name, np.float32, (name,))
+    var.units = units
+    var[:] = vals
+
+def subset_netcdf(src_fpath, dst_fpath, xmin, xmax, ymin, ymax,
+                  rename_dims=None, lat_vals=None, lon_vals=None,
+                  window=None):
+    """Write the region [xmin, xmax] x [ymin, ymax] of a netCDF file.
+
+    `rename_dims` maps source dimension names to output names, and
+    must map onto 'lat' and 'lon' where the source uses other
+    names (e.g. {'x': 'lon', 'y': 'lat'}). If the source has no
+    'lat'/'lon' variables, `lat_vals` and `lon_vals` give the
+    coordinates of the full grid; the subset is then written as
+    float32 'lat'/'lon' variables, as the global files were
+    previously patched.
+
+    A precomputed `window` (see `netcdf_window`) may be given when
+    many files share a grid. The output is written to a temporary
+    file which is renamed on completion, so an interrupted call
+    never leaves a partial `dst_fpath`.
+    """
+    rename_dims = dict(rename_dims or {})
+    with netCDF4.Dataset(src_fpath, 'r') as src:
+        src.set_auto_maskandscale(False)
+        dims = {nm: rename_dims.get(nm, nm) for nm in src.dimensions}
+        add_coords = 'lat' not in src.variables
+        if add_coords:
+            lat_vals = np.asarray(lat_vals)
+            lon_vals = np.asarray(lon_vals)
+        elif window is None:
+            lat_vals = src['lat'][:]
+            lon_vals = src['lon'][:]
+        if window is None:
+            window = {
+                'lat': coord_window(lat_vals, ymin, ymax),
+                'lon': coord_window(lon_vals, xmin, xmax)
+            }
+        tmp_fpath = dst_fpath + '.tmp'
+        with netCDF4.Dataset(tmp_fpath, 'w', format=src.data_model) as dst:
+            dst.setncatts(src.__dict__)
+            sizes = {}
+            for nm, dim in src.dimensions.items():
+                if dims[nm] in window:
+                    sl = window[dims[nm]]
+                    sizes[dims[nm]] = sl.stop - sl.start
+                else:
+                    sizes[dims[nm]] = len(dim)
+                dst.createDimension(
+                    dims[nm], None if dim.isunlimited() else sizes[dims[nm]]
+                )
+            for nm, var in src.variables.items():
+                out_dims = tuple(dims[d] for d in var.dimensions)
+                attrs = var.__dict__.copy()
+                fill_value = attrs.pop('_FillValue', None)
+                out = dst.createVariable(
+                    nm, var.datatype, out_dims, fill_value=fill_value,
+                    **storage_kwargs(var, [sizes[d] for d in out_dims])
+                )
+                out.setncatts(attrs)
+                if var.ndim == 0:
+                    out.assignValue(var.getValue())
+                    continue
+                index = tuple(
+                    window.get(d, slice(None)) for d in out_dims
+                )
+                out[:] = var[index]
+            if add_coords:
+                _add_coord(dst, 'lat', 'degrees North', lat_vals[window['lat']])
+                _add_coord(dst, 'lon', 'degrees East', lon_vals[window['lon']])
+    os.replace(tmp_fpath, dst_fpath)
+    return dst_fpath
+
+def _subset_job(job):
+    return subset_netcdf(**job)
+
+def subset_many(jobs, n_workers=1):
+    """Run several `subset_netcdf` jobs (given as keyword dicts),
+    concurrently if `n_workers` > 1.
+    """
+    if n_workers <= 1:
+        return [_subset_job(job) for job in jobs]
+    with ProcessPoolExecutor(n_workers) as pool:
+        return list(pool.map(_subset_job, jobs))
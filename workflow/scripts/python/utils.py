@@ -5,24 +5,18 @@ import os
 import netCDF4
 import rasterio
 import numpy as np
+from rasterio.coords import BoundingBox
+from rasterio.windows import Window
+from filecache import file_fingerprint
 
 # Default fill vals for netCDF 
 F8_FILLVAL = netCDF4.default_fillvals['f8']
 F4_FILLVAL = netCDF4.default_fillvals['f4']
 I4_FILLVAL = netCDF4.default_fillvals['i4']
 
-def get_region_data():
-    """Function to obtain geospatial parameters."""
-    ds = rasterio.open(os.environ['JULES_LAND_FRAC_FN'])
-    land_frac = ds.read(1, masked=False).squeeze()  # squeeze to remove unit dimension
-    transform = ds.transform                        # affine
-    extent = ds.bounds
-    nlat = land_frac.shape[0]                       # nrow
-    nlon = land_frac.shape[1]                       # ncol
-    lon_vals = np.arange(nlon) * transform[0] + transform[2] + transform[0]/2
-    lat_vals = np.arange(nlat) * transform[4] + transform[5] + transform[4]/2
-    return land_frac, lat_vals, lon_vals, extent
-
+# Radius of the Earth (m), as given by the grid mapping of the
+# netCDF files
+EARTH_RADIUS = 6371229.
 
 def get_lat_lon_grids(lat_vals, lon_vals):
     """Expand latitude and longitude values to grid."""
@@ -39,18 +33,165 @@ def get_lat_lon_bnds(vals, extent):
     bounds = np.array([bound[:-1], bound[1:]]).T
     return bounds
 
-# Constants:
-LAND_FRAC, LAT_VALS, LON_VALS, EXTENT = get_region_data()
-NLAT = len(LAT_VALS)
-NLON = len(LON_VALS)
-LAT_BNDS = get_lat_lon_bnds(LAT_VALS, (EXTENT.top, EXTENT.bottom))
-LON_BNDS = get_lat_lon_bnds(LON_VALS, (EXTENT.left, EXTENT.right))
 
-def add_lat_lon_dims_2d(nco):
+class RegionGrid(object):
+    """Geospatial parameters of a template raster.
+
+    Nothing is read until an attribute is first used. The raster's
+    geometry, and its values (the land fraction) when first needed,
+    are then read once and saved to a sidecar file,
+    `<fpath>.grid.npz`, which later processes load instead for as
+    long as the raster is unchanged. Use `region_grid` to share a
+    single instance per file within a process, and `land_frac_rows`
+    to read part of a map too large to hold in memory.
+    """
+    def __init__(self, fpath):
+        self.fpath = os.path.abspath(fpath)
+        self.sidecar_fpath = self.fpath + '.grid.npz'
+        self._data = None
+        self._fingerprint = None
+
+    def _read_geometry(self):
+        with rasterio.open(self.fpath) as ds:
+            transform = ds.transform
+            extent = ds.bounds
+            nlat, nlon = ds.height, ds.width
+        lon_vals = np.arange(nlon) * transform[0] + transform[2] + transform[0]/2
+        lat_vals = np.arange(nlat) * transform[4] + transform[5] + transform[4]/2
+        return dict(
+            lat_vals=lat_vals, lon_vals=lon_vals,
+            extent=np.array(extent, dtype=np.float64)
+        )
+
+    def _read_sidecar(self):
+        try:
+            with np.load(self.sidecar_fpath) as f:
+                if str(f['fingerprint']) != self._fingerprint:
+                    return None
+                return {k: f[k] for k in f.files if k != 'fingerprint'}
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_sidecar(self):
+        tmp_fpath = self.sidecar_fpath + '.tmp.npz'
+        try:
+            np.savez(
+                tmp_fpath, fingerprint=np.array(self._fingerprint),
+                **self._data
+            )
+            os.replace(tmp_fpath, self.sidecar_fpath)
+        except OSError:
+            # e.g. a read-only data directory: the grid is then
+            # read from the raster by each process
+            pass
+
+    def _load(self, land_frac=False):
+        if self._data is None:
+            self._fingerprint = file_fingerprint([self.fpath])
+            self._data = self._read_sidecar()
+            if self._data is None:
+                self._data = self._read_geometry()
+                self._write_sidecar()
+        if land_frac and 'land_frac' not in self._data:
+            with rasterio.open(self.fpath) as ds:
+                # squeeze to remove unit dimension
+                self._data['land_frac'] = ds.read(1, masked=False).squeeze()
+            self._write_sidecar()
+        return self._data
+
+    def load(self, land_frac=True):
+        """Read the grid now (e.g. before starting worker processes
+        which share it), with or without the land fraction.
+        """
+        self._load(land_frac)
+        return self
+
+    @property
+    def land_frac(self):
+        return self._load(land_frac=True)['land_frac']
+
+    def land_frac_rows(self, row0, row1):
+        """Rows `row0:row1` of the land fraction. Unless the whole map
+        is already in memory only these rows are read.
+        """
+        data = self._load()
+        if 'land_frac' in data:
+            return data['land_frac'][row0:row1]
+        with rasterio.open(self.fpath) as ds:
+            return ds.read(
+                1, window=Window(0, row0, ds.width, row1 - row0),
+                masked=False
+            )
+
+    @property
+    def land(self):
+        """Boolean land mask."""
+        return self.land_frac > 0
+
+    @property
+    def lat_vals(self):
+        return self._load()['lat_vals']
+
+    @property
+    def lon_vals(self):
+        return self._load()['lon_vals']
+
+    @property
+    def extent(self):
+        return BoundingBox(*self._load()['extent'])
+
+    @property
+    def nlat(self):
+        return len(self.lat_vals)
+
+    @property
+    def nlon(self):
+        return len(self.lon_vals)
+
+    @property
+    def lat_bnds(self):
+        extent = self.extent
+        return get_lat_lon_bnds(self.lat_vals, (extent.top, extent.bottom))
+
+    @property
+    def lon_bnds(self):
+        extent = self.extent
+        return get_lat_lon_bnds(self.lon_vals, (extent.left, extent.right))
+
+    @property
+    def cell_area(self):
+        """Area of each gridbox (m2), on a sphere of radius EARTH_RADIUS."""
+        lat_bnds = np.deg2rad(self.lat_bnds)
+        lon_bnds = np.deg2rad(self.lon_bnds)
+        dy = np.abs(np.sin(lat_bnds[:, 0]) - np.sin(lat_bnds[:, 1]))
+        dx = np.abs(lon_bnds[:, 1] - lon_bnds[:, 0])
+        return EARTH_RADIUS ** 2 * dy[:, None] * dx[None, :]
+
+_GRIDS = {}
+
+def region_grid(fpath=None):
+    """Return the (memoized) RegionGrid of `fpath`, which defaults
+    to the land fraction map, `JULES_LAND_FRAC_FN`.
+    """
+    if fpath is None:
+        fpath = os.environ['JULES_LAND_FRAC_FN']
+    fpath = os.path.abspath(fpath)
+    if fpath not in _GRIDS:
+        _GRIDS[fpath] = RegionGrid(fpath)
+    return _GRIDS[fpath]
+
+
+def get_region_data():
+    """Function to obtain geospatial parameters."""
+    grid = region_grid()
+    return grid.land_frac, grid.lat_vals, grid.lon_vals, grid.extent
+
+def add_lat_lon_dims_2d(nco, grid=None):
     """Add 2d latitude/longitude data to a netCDF object."""
-    
-    nco.createDimension('latitude', NLAT)
-    nco.createDimension('longitude', NLON)
+    if grid is None:
+        grid = region_grid()
+    nco.createDimension('latitude', grid.nlat)
+    nco.createDimension('longitude', grid.nlon)
     nco.createDimension('bnds', 2)
     var = nco.createVariable(
         'longitude', 'f8', ('longitude',)
@@ -59,11 +200,11 @@ def add_lat_lon_dims_2d(nco):
     var.bounds = 'longitude_bnds'
     var.units = 'degrees_east'
     var.standard_name = 'longitude'
-    var[:] = LON_VALS
+    var[:] = grid.lon_vals
     var = nco.createVariable(
         'longitude_bnds', 'f8', ('longitude', 'bnds')
     )
-    var[:] = LON_BNDS        
+    var[:] = grid.lon_bnds        
     var = nco.createVariable(
         'latitude', 'f8', ('latitude',)
     )
@@ -71,11 +212,11 @@ def add_lat_lon_dims_2d(nco):
     var.bounds = 'latitude_bnds'
     var.units = 'degrees_north'
     var.standard_name = 'latitude'
-    var[:] = LAT_VALS        
+    var[:] = grid.lat_vals        
     var = nco.createVariable(
         'latitude_bnds', 'f8', ('latitude', 'bnds')
     )
-    var[:] = LAT_BNDS
+    var[:] = grid.lat_bnds
     var = nco.createVariable(
         'latitude_longitude', 'i4'
     )
@@ -4,37 +4,16 @@
 import os
 # from calendar import monthrange
 import datetime
+import click
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 import netCDF4
 
-DATADIR = os.path.join(os.environ['DATADIR'], 'aux/lai')
-
-def get_region_data(fn):
-    """Function to obtain geospatial parameters."""
-    ds = rasterio.open(fn)
-    # squeeze to remove unit dimension
-    land_frac = ds.read(1, masked=False).squeeze()
-    land_frac = land_frac > 0
-    transform = ds.transform
-    extent = ds.bounds
-    nlat = land_frac.shape[0]
-    nlon = land_frac.shape[1]
-    lon_vals = (
-        np.arange(nlon) * transform[0] + transform[2] + transform[0]/2
-    )    
-    lat_vals = (
-        np.arange(nlat) * transform[4] + transform[5] + transform[4]/2
-    )
-    return land_frac, lat_vals, lon_vals, extent
+from utils import region_grid
 
-def get_lat_lon_bnds(vals, extent):
-    """Calculate lat/lon bounds."""
-    bound = np.linspace(
-        extent[0], extent[1], endpoint=True, num=len(vals)+1
-    )
-    bounds = np.array([bound[:-1], bound[1:]]).T
-    return bounds
+DATADIR = os.path.join(os.environ['DATADIR'], 'aux/lai')
 
 # ##################################### #
 # Assign constants:
@@ -55,23 +34,12 @@ LCS = [
 # Number of LAI points during the year (3 per month)
 LYRS = np.arange(36) + 1
 
-# Spatial information
-# OFFSET = 180.
-OFFSET = 0.
+# Spatial information, read on first use (see utils.RegionGrid)
 TEMPLATE_FN = os.path.join(
     DATADIR,
     'lai_natural_avg_1_igp_0.041667Deg.tif'
 )
-_, LAT_VALS, LON_VALS, EXTENT = get_region_data(TEMPLATE_FN)
-LON_VALS += OFFSET
-NLAT = len(LAT_VALS)
-NLON = len(LON_VALS)
-LAT_BNDS = get_lat_lon_bnds(
-    LAT_VALS, (EXTENT.top, EXTENT.bottom)
-)
-LON_BNDS = get_lat_lon_bnds(
-    LON_VALS, (EXTENT.left+OFFSET, EXTENT.right+OFFSET)
-)
+GRID = region_grid(TEMPLATE_FN)
 
 # Define time series - because LAI is dealt with as a
 # climateology we choose an arbitrary non-leap year
@@ -91,87 +59,118 @@ for i in np.arange(1, 36):
 #     tms.append(datetime.datetime(yr, month, , 0, 0))
 #     # tms.append(datetime.datetime(yr, month, monthrange(yr, month)[1], 0, 0))
 
-def main():
-
-    for LC in LCS:
-        
-        # Load LAI data
-        lai = []
-        for LYR in LYRS:
-            lai_ds = rasterio.open(
-                os.path.join(
-                    DATADIR,
-                    'lai_' + LC + '_avg_' + str(LYR) + '_igp_0.041667Deg.tif'
-                )
+def create_lai_netcdf(fpath, block_rows=None):
+    """Create an empty LAI dataset with one chunk per time slice or,
+    with `block_rows`, per time slice and block of rows, matching
+    the blocks in which it is written (see `write_lai`)."""
+    nco = netCDF4.Dataset(fpath, 'w', format='NETCDF4')
+    nco.createDimension('time', None)
+    nco.createDimension('latitude', GRID.nlat)
+    nco.createDimension('longitude', GRID.nlon)
+    nco.createDimension('bnds', 2)
+    var = nco.createVariable(
+        'longitude', 'f8', ('longitude',)
+    )
+    var.axis = 'X'
+    var.bounds = 'longitude_bnds'
+    var.units = 'degrees_east'
+    var.standard_name = 'longitude'
+    var[:] = GRID.lon_vals
+
+    var = nco.createVariable(
+        'longitude_bnds', 'f8', ('longitude', 'bnds')
+    )
+    var[:] = GRID.lon_bnds
+
+    var = nco.createVariable(
+        'latitude', 'f8', ('latitude',)
+    )
+    var.axis = 'Y'
+    var.bounds = 'latitude_bnds'
+    var.units = 'degrees_north'
+    var.standard_name = 'latitude'
+    var[:] = GRID.lat_vals
+    var = nco.createVariable(
+        'latitude_bnds', 'f8', ('latitude', 'bnds')
+    )
+    var[:] = GRID.lat_bnds
+
+    var = nco.createVariable(
+        'latitude_longitude', 'i4'
+    )
+    var.grid_mapping_name = 'latitude_longitude'
+    var.longitude_of_prime_meridian = 0.
+    var.earth_radius = 6371229.
+
+    var = nco.createVariable(
+        'time', 'i4', ('time',)
+    )
+    var.units = 'hours since 1970-01-01 00:00:00'
+    var.calendar = 'gregorian'
+    var[:] = netCDF4.date2num(TMS, var.units, var.calendar)
+
+    var = nco.createVariable(
+        'leaf_area_index', 'f8', ('time', 'latitude', 'longitude'),
+        chunksizes=(1, min(block_rows or GRID.nlat, GRID.nlat), GRID.nlon)
+    )
+    var.standard_name = 'leaf_area_index'
+    var.units = '1'
+    var.um_stash_source = 'm01s00i217'
+    var.cell_methods = 'time: mean within days time: mean over years'
+    var.grid_mapping = 'latitude_longitude'
+    return nco
+
+def write_lai(LC, block_rows=512):
+    """Write the LAI climatology of one land cover type.
+
+    Each raster is read in blocks of `block_rows` rows, and each
+    block is written to its time slice as soon as it is read, so
+    that at most one block is held in memory.
+    """
+    fpath = os.path.join(DATADIR, 'lai_' + LC + '_igp.nc')
+    nco = create_lai_netcdf(fpath, block_rows)
+    var = nco['leaf_area_index']
+    for i, LYR in enumerate(LYRS):
+        with rasterio.open(
+            os.path.join(
+                DATADIR,
+                'lai_' + LC + '_avg_' + str(LYR) + '_igp_0.041667Deg.tif'
             )
-            lai_map = lai_ds.read(1, masked=True).squeeze()
-            lai.append(lai_map)
-
-        mask = [x.mask for x in lai]
-        lai = np.stack(lai)
-        lai.mask = np.stack(mask)
-
-        # Create LAI dataset
-        nco = netCDF4.Dataset(
-            os.path.join(DATADIR, 'lai_' + LC + '_igp.nc'),
-            'w',
-            format='NETCDF4'
-        )
-        nco.createDimension('time', None)
-        nco.createDimension('latitude', NLAT)
-        nco.createDimension('longitude', NLON)
-        nco.createDimension('bnds', 2)
-        var = nco.createVariable(
-            'longitude', 'f8', ('longitude',)
-        )
-        var.axis = 'X'
-        var.bounds = 'longitude_bnds'
-        var.units = 'degrees_east'
-        var.standard_name = 'longitude'
-        var[:] = LON_VALS
-
-        var = nco.createVariable(
-            'longitude_bnds', 'f8', ('longitude', 'bnds')
-        )
-        var[:] = LON_BNDS        
-
-        var = nco.createVariable(
-            'latitude', 'f8', ('latitude',)
-        )
-        var.axis = 'Y'
-        var.bounds = 'latitude_bnds'
-        var.units = 'degrees_north'
-        var.standard_name = 'latitude'
-        var[:] = LAT_VALS        
-        var = nco.createVariable(
-            'latitude_bnds', 'f8', ('latitude', 'bnds')
-        )
-        var[:] = LAT_BNDS
-
-        var = nco.createVariable(
-            'latitude_longitude', 'i4'
-        )
-        var.grid_mapping_name = 'latitude_longitude'
-        var.longitude_of_prime_meridian = 0.
-        var.earth_radius = 6371229.
-
-        var = nco.createVariable(
-            'time', 'i4', ('time',)
-        )
-        var.units = 'hours since 1970-01-01 00:00:00'
-        var.calendar = 'gregorian'
-        var[:] = netCDF4.date2num(TMS, var.units, var.calendar)
-
-        var = nco.createVariable(
-            'leaf_area_index', 'f8', ('time', 'latitude', 'longitude')
-        )
-        var.standard_name = 'leaf_area_index'
-        var.units = '1'
-        var.um_stash_source = 'm01s00i217'
-        var.cell_methods = 'time: mean within days time: mean over years'
-        var.grid_mapping = 'latitude_longitude'
-        var[:] = lai 
-        nco.close()
+        ) as lai_ds:
+            for row0 in range(0, GRID.nlat, block_rows):
+                row1 = min(row0 + block_rows, GRID.nlat)
+                window = Window(0, row0, GRID.nlon, row1 - row0)
+                var[i, row0:row1, :] = lai_ds.read(
+                    1, window=window, masked=True
+                )
+    nco.close()
+    return fpath
+
+@click.command()
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of processes across which land cover types are split.'
+)
+@click.option(
+    '--block-rows', 'block_rows', default=512, type=int,
+    help='Number of raster rows read at once.'
+)
+@click.option(
+    '-l', '--land-cover', 'land_covers', multiple=True,
+    type=click.Choice(LCS), default=LCS,
+    help='Land cover type(s) to write (default: all).'
+)
+def main(n_workers, block_rows, land_covers):
+    if n_workers <= 1:
+        for LC in land_covers:
+            write_lai(LC, block_rows)
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(write_lai, LC, block_rows) for LC in land_covers
+        ]
+        for future in futures:
+            future.result()
 
 if __name__ == '__main__':
     main()
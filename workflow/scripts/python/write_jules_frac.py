@@ -3,84 +3,173 @@
 
 import numpy as np
 import netCDF4
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.windows import Window
 from utils import *
+from landpoints import LAND_DIM
 
-def get_jules_frac(year, frac_type_names):
-    ntype = len(frac_type_names)
-    frac = []
-    for lc_name in frac_type_names:
-        frac_ds = rasterio.open(
-            os.environ['LC_' + lc_name.upper() + '_' + str(year) + '_FN']
-        )
-        frac_map = frac_ds.read(1, masked=False).squeeze()
-        frac.append(frac_map)
-
-    # Divide by sum to ensure the fractions sum to one
-    frac = np.stack(frac)
-    frac_sum = frac.sum(axis=0)
-    frac_sum = np.nan_to_num(frac_sum)  # TEST
-    frac = np.divide(frac, frac_sum, out=np.zeros_like(frac), where=frac_sum>0)
-    
-    # original ice/soil fractions
-    ice_orig = frac[-1, ...]
-    soil_orig = frac[-2, ...]
-
-    ice = np.zeros_like(ice_orig).astype(np.bool)
-    ice[ice_orig > 0.5] = True
-    not_ice = np.logical_not(ice)
-
-    # initially set all fractions/heights in ice gridboxes to zero
-    frac *= not_ice[None, ...]
-    # then set ice fraction to one
-    frac[-1][ice] = 1
-    frac[-1][not_ice] = 0
-    # in non-ice gridboxes, add original ice fraction to bare soil
-    frac[-2] = (soil_orig + ice_orig) * not_ice
-    frac_sum = frac.sum(axis=0)
-    frac = np.divide(frac, frac_sum, out=np.zeros_like(frac), where=frac_sum>0)    
+def normalise_jules_frac(frac, land, work=None):
+    """Normalise a (ntype, lat, lon) fraction array in place.
+
+    Fractions are divided by their sum, gridboxes with more than
+    50% ice are set entirely to ice, and the result is renormalised.
+    Cells outside the boolean `land` mask are set to zero. Operates
+    on a plain ndarray of any float dtype; `work` is an optional
+    (lat, lon) buffer of the same dtype. In float32 the result
+    differs from float64 by at most ~1e-6 (absolute), i.e. a few
+    float32 roundings of O(1) values.
+    """
+    frac_sum = np.sum(frac, axis=0, out=work)
+    np.nan_to_num(frac_sum, copy=False)  # TEST
+    valid = frac_sum > 0
+    np.divide(frac, frac_sum, out=frac, where=valid)
+    np.copyto(frac, 0., where=~valid)
+
+    # Initially set all fractions/heights in ice gridboxes
+    # to zero, then set ice fraction to one.
+    # NB in earlier versions the original ice fraction was
+    # meant to be added to bare soil in non-ice gridboxes,
+    # but because the ice/soil fractions were views of `frac`
+    # it was in fact dropped, with the remaining fractions
+    # rescaled below. That behaviour is kept here.
+    ice = frac[-1] > 0.5
+    np.copyto(frac, 0., where=ice)
+    frac[-1] = ice
+    np.sum(frac, axis=0, out=frac_sum)
+    valid = frac_sum > 0
+    np.divide(frac, frac_sum, out=frac, where=valid)
+    np.copyto(frac, 0., where=~valid)
+    np.copyto(frac, 0., where=~land)
+    return frac
+
+def lc_frac_fn(lc_name, year):
+    return os.environ['LC_' + lc_name.upper() + '_' + str(year) + '_FN']
+
+class FracReader(object):
+    """Land cover fractions of one year, read once and shared.
+
+    The first call to `get` reads the rasters of all of `lc_names`,
+    concurrently, into one preallocated (ntype, lat, lon) cube; this
+    and later calls then select from the cube, so that the fractions
+    of every landuse and PFT variant come from a single read pass.
+    """
+    def __init__(self, year, lc_names, dtype=np.float64, n_workers=4):
+        self.year = year
+        # unique, in order of first appearance
+        self.lc_names = list(OrderedDict.fromkeys(lc_names))
+        self.dtype = dtype
+        self.n_workers = n_workers
+        self._index = {nm: i for i, nm in enumerate(self.lc_names)}
+        self._cube = None
+
+    def _read(self, i):
+        with rasterio.open(lc_frac_fn(self.lc_names[i], self.year)) as ds:
+            ds.read(1, out=self._cube[i], masked=False)
+
+    def load(self):
+        if self._cube is None:
+            grid = region_grid()
+            self._cube = np.empty(
+                (len(self.lc_names), grid.nlat, grid.nlon), dtype=self.dtype
+            )
+            with ThreadPoolExecutor(max(1, self.n_workers)) as pool:
+                list(pool.map(self._read, range(len(self.lc_names))))
+        return self._cube
+
+    def get(self, lc_names):
+        """Return a copy of the fractions of `lc_names`, in order."""
+        missing = [nm for nm in lc_names if nm not in self._index]
+        if missing:
+            raise KeyError(
+                'Not read for ' + str(self.year) + ': ' + ', '.join(missing)
+            )
+        idx = [self._index[nm] for nm in lc_names]
+        return np.take(self.load(), idx, axis=0)
+
+def get_jules_frac(year, frac_type_names, dtype=np.float64, reader=None):
+    if reader is None:
+        reader = FracReader(year, frac_type_names, dtype)
+    frac = reader.get(frac_type_names).astype(dtype, copy=False)
+    land = region_grid().land_frac.astype(bool)
+    normalise_jules_frac(frac, land)
     frac = np.ma.array(
         frac,
-        mask=np.broadcast_to(
-            np.logical_not(LAND_FRAC),
-            (ntype, NLAT, NLON)
-        ),
-        dtype=np.float64,
+        mask=np.broadcast_to(np.logical_not(land), frac.shape),
+        copy=False,
         fill_value=F8_FILLVAL
     )
     return frac
 
-# def write_jules_frac_2d(frac_fn, frac, var_name, var_units):
-#     nco = netCDF4.Dataset(frac_fn, 'w', format='NETCDF4')
-#     ntype = frac.shape[0]
-#     nco = add_lat_lon_dims_2d(nco)
-
-#     nco.createDimension('pseudo', ntype)
-#     pseu = nco.createVariable('pseudo', 'i4', ('pseudo',))
-#     pseu.units = '1'
-#     pseu.standard_name = 'pseudo'
-#     pseu.long_name = 'pseudo'
-#     pseu[:] = np.arange(1, ntype+1)
-    
-#     var = nco.createVariable(
-#         var_name, 'f8', ('pseudo', 'latitude', 'longitude'),
-#         fill_value=F8_FILLVAL
-#     )
-#     var.units = var_units
-#     var.standard_name = var_name
-#     var.grid_mapping = 'latitude_longitude'
-#     var[:] = frac
-#     nco.close()
-
-def write_jules_frac_ants(year, lc_names, frac_fn):
-    frac = get_jules_frac(year, lc_names)
-    ntype = frac.shape[0]
-    # extract region characteristics, and move western
-    # hemisphere east of east hemisphere.
-    _, lat_vals, lon_vals, extent = get_region_data()
-    nlat = len(lat_vals)
-    nlon = len(lon_vals)
-    lat_bnds = get_lat_lon_bnds(lat_vals, (extent.top, extent.bottom))
-    lon_bnds = get_lat_lon_bnds(lon_vals, (extent.left, extent.right))
+def iter_jules_frac_blocks(year, frac_type_names, block_rows=512,
+                           dtype=np.float64):
+    """Yield `(row0, row1, frac)` for successive blocks of rows, where
+    `frac` is as `get_jules_frac(...)[:, row0:row1, :]`.
+
+    Only `block_rows` rows of each raster (and of the land fraction)
+    are read at a time, into buffers which are reused, so that memory
+    use depends on the block size rather than the size of the domain.
+    The array yielded is overwritten by the next block.
+    """
+    grid = region_grid()
+    ntype = len(frac_type_names)
+    nlon = grid.nlon
+    frac = np.empty((ntype, block_rows, nlon), dtype=dtype)
+    work = np.empty((block_rows, nlon), dtype=dtype)
+    srcs = [rasterio.open(lc_frac_fn(nm, year)) for nm in frac_type_names]
+    try:
+        for row0 in range(0, grid.nlat, block_rows):
+            row1 = min(row0 + block_rows, grid.nlat)
+            nrow = row1 - row0
+            window = Window(0, row0, nlon, nrow)
+            block = frac[:, :nrow, :]
+            for i, ds in enumerate(srcs):
+                ds.read(1, window=window, out=block[i], masked=False)
+            land = grid.land_frac_rows(row0, row1).astype(bool)
+            normalise_jules_frac(block, land, work[:nrow])
+            yield row0, row1, np.ma.array(
+                block,
+                mask=np.broadcast_to(np.logical_not(land), block.shape),
+                copy=False,
+                fill_value=F8_FILLVAL
+            )
+    finally:
+        for ds in srcs:
+            ds.close()
+
+def write_jules_frac_ants(year, lc_names, frac_fn, reader=None,
+                          block_rows=None):
+    """Write the fractions of `lc_names` in ANTS format. If
+    `block_rows` is given the domain is processed in blocks of rows
+    (see `iter_jules_frac_blocks`), and `reader` is not used.
+    """
+    if block_rows is None:
+        frac = get_jules_frac(year, lc_names, reader=reader)
+        write_frac_ants_netcdf(frac, frac_fn)
+        return
+    nco = create_frac_ants_netcdf(frac_fn, len(lc_names))
+    var = nco['land_cover_lccs']
+    for row0, row1, frac in iter_jules_frac_blocks(year, lc_names, block_rows):
+        var[:, row0:row1, :] = frac
+    nco.close()
+
+def write_frac_ants_netcdf(frac, frac_fn):
+    """Write a (ntype, lat, lon) fraction array in ANTS format."""
+    nco = create_frac_ants_netcdf(frac_fn, frac.shape[0])
+    nco['land_cover_lccs'][:] = frac
+    nco.close()
+
+def create_frac_ants_netcdf(frac_fn, ntype):
+    """Create an ANTS format fraction file with `ntype` types,
+    returning the open dataset; `land_cover_lccs` is left unset.
+    """
+    # extract region characteristics (read once per process, see
+    # utils.RegionGrid), and move western hemisphere east of east
+    # hemisphere.
+    grid = region_grid()
+    lat_vals, lon_vals = grid.lat_vals, grid.lon_vals
+    nlat, nlon = grid.nlat, grid.nlon
+    lat_bnds, lon_bnds = grid.lat_bnds, grid.lon_bnds
 
     # REMOVED THIS SECTION:
     # west_hemisphere = lon_vals < 0.
@@ -139,46 +228,79 @@ def write_jules_frac_ants(year, lc_names, frac_fn):
     var.standard_name = 'land_cover_lccs'
     var.grid_mapping = 'latitude_longitude'
     var.coordinates = 'pseudo_level'
-    var[:] = frac
         
     pseu = nco.createVariable('pseudo_level', 'i4', ('dim0',))
     pseu.units = '1'
     pseu.long_name = 'pseudo_level'
     pseu[:] = np.arange(1, ntype+1)
-    nco.close()
+    return nco
     
-# def write_jules_frac_1d(frac_fn, frac, var_name, var_units):
-#     nco = netCDF4.Dataset(frac_fn, 'w', format='NETCDF4')
-#     ntype, nland = frac.shape[0], frac.shape[1]
-#     nco.createDimension('land', nland)
-#     nco.createDimension('pseudo', ntype)
-
-#     var = nco.createVariable('pseudo', 'i4', ('pseudo',))
-#     var.units = '1'
-#     var.standard_name = 'pseudo'
-#     var[:] = np.arange(1, ntype+1)
-
-#     var = nco.createVariable(
-#         var_name, 'f8', ('pseudo', 'land'),
-#         fill_value=F8_FILLVAL
-#     )
-#     var.units = var_units
-#     var.standard_name = var_name
-#     var[:] = frac
-#     nco.close()
-
-# def write_jules_frac(year, lc_names, frac_fn, one_d=False):
-#     # frac, surf_hgt = get_jules_frac(year, lc_names)
-#     frac = get_jules_frac(year, lc_names)    
-#     ntype = frac.shape[0]
-#     if one_d:
-#         mask = LAND_FRAC > 0.
-#         mask = mask[None, :, :] * np.ones(ntype)[:, None, None]
-#         mask = mask.astype(bool)
-#         frac = frac.transpose()[mask.transpose()]
-#         # surf_hgt = surf_hgt.transpose()[mask.transpose()]        
-#         write_jules_frac_1d(frac_fn, frac, 'frac', '1')
-#         # write_jules_frac_1d(surf_hgt_fn, surf_hgt, 'elevation', 'm')
-#     else:
-#         write_jules_frac_2d(frac_fn, frac, 'frac', '1')
-#         # write_jules_frac_2d(surf_hgt_fn, surf_hgt, 'elevation', 'm')
+def create_jules_frac_netcdf(frac_fn, ntype, var_name='frac',
+                             var_units='1', land_index=None):
+    """Create a JULES format file of `ntype` types, on the 2-D grid
+    or, if `land_index` is given, on its land points (see
+    landpoints.py), returning the open dataset; `var_name` is left
+    unset.
+    """
+    nco = netCDF4.Dataset(frac_fn, 'w', format='NETCDF4')
+    if land_index is None:
+        nco = add_lat_lon_dims_2d(nco)
+        dims = ('latitude', 'longitude')
+    else:
+        land_index.add_to_netcdf(nco, 'latitude', 'longitude')
+        dims = (LAND_DIM,)
+
+    nco.createDimension('pseudo', ntype)
+    pseu = nco.createVariable('pseudo', 'i4', ('pseudo',))
+    pseu.units = '1'
+    pseu.standard_name = 'pseudo'
+    pseu.long_name = 'pseudo'
+    pseu[:] = np.arange(1, ntype+1)
+
+    var = nco.createVariable(
+        var_name, 'f8', ('pseudo',) + dims,
+        fill_value=F8_FILLVAL
+    )
+    var.units = var_units
+    var.standard_name = var_name
+    if land_index is None:
+        var.grid_mapping = 'latitude_longitude'
+    return nco
+
+def write_jules_frac(year, lc_names, frac_fn, land_index=None, reader=None,
+                     block_rows=None):
+    """Write the fractions of `lc_names` in JULES format. If
+    `land_index` is given, only its land points are written, gathered
+    into a vector (see landpoints.py). It should be the index shared
+    by the other JULES ancillaries (see `LandIndex.read`), so that
+    their points line up; the rows of the region's rasters are
+    flipped to its orientation. `reader` and `block_rows` are as for
+    `write_jules_frac_ants`.
+    """
+    flip = False
+    if land_index is not None:
+        grid = region_grid()
+        flip = land_index.grid_flipped(grid.lat_vals, grid.lon_vals)
+    nco = create_jules_frac_netcdf(
+        frac_fn, len(lc_names), land_index=land_index
+    )
+    var = nco['frac']
+    if block_rows is None:
+        frac = get_jules_frac(year, lc_names, reader=reader)
+        if land_index is None:
+            var[:] = frac
+        else:
+            var[:] = land_index.gather(np.flip(frac, axis=-2) if flip else frac)
+    else:
+        blocks = iter_jules_frac_blocks(year, lc_names, block_rows)
+        for row0, row1, frac in blocks:
+            if land_index is None:
+                var[:, row0:row1, :] = frac
+                continue
+            if flip:
+                frac = np.flip(frac, axis=-2)
+                row0, row1 = grid.nlat - row1, grid.nlat - row0
+            points = land_index.row_slice(row0, row1)
+            if points.stop > points.start:
+                var[:, points] = land_index.gather_rows(frac, row0, row1)
+    nco.close()
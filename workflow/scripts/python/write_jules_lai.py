@@ -2,53 +2,23 @@
 # -*- coding: utf-8 -*-
 
 import os
+import click
 import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import rasterio
 import netCDF4
 import xarray
 
-def get_region_data(fn):
-    """Function to obtain geospatial parameters."""
-    ds = rasterio.open(fn)
-    # squeeze to remove unit dimension
-    land_frac = ds.read(1, masked=False).squeeze()
-    land_frac = land_frac > 0
-    transform = ds.transform
-    extent = ds.bounds
-    nlat = land_frac.shape[0]
-    nlon = land_frac.shape[1]
-    lon_vals = (
-        np.arange(nlon) * transform[0] + transform[2] + transform[0]/2
-    )    
-    lat_vals = (
-        np.arange(nlat) * transform[4] + transform[5] + transform[4]/2
-    )
-    return land_frac, lat_vals, lon_vals, extent
-
-def get_lat_lon_bnds(vals, extent):
-    """Calculate lat/lon bounds."""
-    bound = np.linspace(
-        extent[0], extent[1], endpoint=True, num=len(vals)+1
-    )
-    bounds = np.array([bound[:-1], bound[1:]]).T
-    return bounds
+from utils import region_grid
 
 DATADIR = str(os.environ['DATADIR'])
 LAIDATADIR = os.path.join(DATADIR, 'netcdf')
 LCDATADIR = os.path.join(DATADIR, 'geotiff')
 LAND_FRAC_FN = os.path.join(LCDATADIR, 'jamr_custom_land_frac_igp.tif')
 
-OFFSET = 0.
-LAND_FRAC, LAT_VALS, LON_VALS, EXTENT = get_region_data(LAND_FRAC_FN)
-NLAT = len(LAT_VALS)
-NLON = len(LON_VALS)
-LAT_BNDS = get_lat_lon_bnds(
-    LAT_VALS, (EXTENT.top, EXTENT.bottom)
-)
-LON_BNDS = get_lat_lon_bnds(
-    LON_VALS, (EXTENT.left + OFFSET, EXTENT.right + OFFSET)
-)
+# Read on first use (see utils.RegionGrid)
+GRID = region_grid(LAND_FRAC_FN)
 
 LC_DICT = {
     'tree_broadleaf' : {
@@ -174,8 +144,8 @@ def create_template_veg_climatology_netcdf(fpath):
     nco = netCDF4.Dataset(fpath, 'w', format='NETCDF4')
     nco.createDimension('time', None)
     nco.createDimension('dim1', NVEG)
-    nco.createDimension('latitude', NLAT)
-    nco.createDimension('longitude', NLON)
+    nco.createDimension('latitude', GRID.nlat)
+    nco.createDimension('longitude', GRID.nlon)
     nco.createDimension('bnds', 2)
     
     var = nco.createVariable('longitude', 'f8', ('longitude',))
@@ -183,18 +153,18 @@ def create_template_veg_climatology_netcdf(fpath):
     var.bounds = 'longitude_bnds'
     var.units = 'degrees_east'
     var.standard_name = 'longitude'
-    var[:] = LON_VALS
+    var[:] = GRID.lon_vals
     var = nco.createVariable('longitude_bnds', 'f8', ('longitude', 'bnds'))
-    var[:] = LON_BNDS        
+    var[:] = GRID.lon_bnds        
 
     var = nco.createVariable('latitude', 'f8', ('latitude',))
     var.axis = 'Y'
     var.bounds = 'latitude_bnds'
     var.units = 'degrees_north'
     var.standard_name = 'latitude'
-    var[:] = LAT_VALS        
+    var[:] = GRID.lat_vals        
     var = nco.createVariable('latitude_bnds', 'f8', ('latitude', 'bnds'))
-    var[:] = LAT_BNDS
+    var[:] = GRID.lat_bnds
 
     var = nco.createVariable('latitude_longitude', 'i4')
     var.grid_mapping_name = 'latitude_longitude'
@@ -242,26 +212,134 @@ def create_canopy_height_netcdf(fpath):
 LAI_NCFILE = str(os.environ['LAI_NCFILE'])
 CANOPY_HEIGHT_NCFILE = str(os.environ['CANOPY_HEIGHT_NCFILE'])
 
-def main():
+def _open_dataset(handles, fn, max_open):
+    """Open a dataset through a small LRU cache of open handles."""
+    if fn in handles:
+        handles.move_to_end(fn)
+        return handles[fn]
+    if len(handles) >= max_open:
+        _, ds = handles.popitem(last=False)
+        ds.close()
+    handles[fn] = xarray.open_dataset(fn)
+    return handles[fn]
+
+def _read_source_block(fn, var_name, nc_index, t0, t1):
+    """Read a (time, nc_index) block from a single source file."""
+    with xarray.open_dataset(fn) as ds:
+        return ds[var_name][t0:t1, nc_index, :, :].values
+
+def veg_climatology_sources(product):
+    """Group the land covers of `product` by source file, returning
+    an ordered dict of file name -> [(nc_index, jules_index), ...]."""
+    sources = OrderedDict()
+    for LC in LC_DICT.keys():
+        if LC_DICT[LC][product] is None:
+            continue
+        fn = os.path.join(LAIDATADIR, LC_DICT[LC][product])
+        sources.setdefault(fn, []).append(
+            (LC_DICT[LC]['nc_index'], LC_DICT[LC]['jules_index'])
+        )
+    return sources
+
+def write_veg_climatology(nco, product, var_name, time_chunk=NT,
+                          max_open=4):
+    """Assemble a (time, dim1, latitude, longitude) variable from
+    the per-land-cover source files listed under `product` in
+    `LC_DICT`.
+
+    Land covers are grouped by source file, so that each file is
+    read once per time chunk as a single (time, nc_index) block,
+    and each time chunk is written to `nco` in one call.
+    """
+    sources = veg_climatology_sources(product)
+    handles = OrderedDict()
+    for t0 in range(0, NT, time_chunk):
+        t1 = min(t0 + time_chunk, NT)
+        x = np.ma.masked_all((t1 - t0, NVEG, GRID.nlat, GRID.nlon))
+        for fn, index in sources.items():
+            nc_index = [i for i, _ in index]
+            jules_index = [j for _, j in index]
+            ds = _open_dataset(handles, fn, max_open)
+            x[:, jules_index, ...] = (
+                ds[var_name][t0:t1, nc_index, :, :].values
+            )
+        nco[var_name][t0:t1, ...] = x
+    for ds in handles.values():
+        ds.close()
+
+def write_veg_climatologies(ncos, products, executor, time_chunk=NT):
+    """Assemble several products concurrently, as
+    `write_veg_climatology` does each one.
+
+    The source reads of all products are submitted to `executor`
+    together, one time chunk ahead of the writes. `executor` must be
+    a process pool: the netCDF/HDF5 library is not thread-safe, and
+    concurrent calls from threads can crash. Each product is written
+    to its own file, chunk by chunk, from this process only.
+    """
+    sources = [veg_climatology_sources(product) for product, _ in products]
+    chunks = [
+        (t0, min(t0 + time_chunk, NT)) for t0 in range(0, NT, time_chunk)
+    ]
+
+    def submit(t0, t1):
+        return [
+            OrderedDict(
+                (fn, executor.submit(
+                    _read_source_block, fn, var_name,
+                    [i for i, _ in index], t0, t1
+                ))
+                for fn, index in src.items()
+            )
+            for src, (_, var_name) in zip(sources, products)
+        ]
+
+    pending = submit(*chunks[0])
+    for k, (t0, t1) in enumerate(chunks):
+        futures = pending
+        if k + 1 < len(chunks):
+            pending = submit(*chunks[k + 1])
+        for nco, src, blocks, (_, var_name) in zip(
+                ncos, sources, futures, products):
+            x = np.ma.masked_all((t1 - t0, NVEG, GRID.nlat, GRID.nlon))
+            for fn, index in src.items():
+                jules_index = [j for _, j in index]
+                x[:, jules_index, ...] = blocks[fn].result()
+            nco[var_name][t0:t1, ...] = x
+
+# (LC_DICT key, variable name) for each product
+PRODUCTS = [
+    ('lai', 'leaf_area_index'),
+    ('canopy_height', 'canopy_height')
+]
+
+@click.command()
+@click.option(
+    '--time-chunk', 'time_chunk', default=NT, type=int,
+    help='Number of time points assembled in memory at once.'
+)
+@click.option(
+    '--max-open', 'max_open', default=4, type=int,
+    help='Maximum number of source files held open at once.'
+)
+@click.option(
+    '-j', '--n-workers', 'n_workers', default=1, type=int,
+    help='Number of processes used to read the source files.'
+)
+def main(time_chunk, max_open, n_workers):
     lai_nc = create_lai_netcdf(LAI_NCFILE)
     canopy_height_nc = create_canopy_height_netcdf(CANOPY_HEIGHT_NCFILE)
-    for time_index in range(len(TMS)):
-        for LC in LC_DICT.keys():
-            nc_index = LC_DICT[LC]['nc_index']
-            jules_index = LC_DICT[LC]['jules_index']
-            lai_fn = os.path.join(LAIDATADIR, LC_DICT[LC]['lai'])
-            canopy_height_fn = os.path.join(LAIDATADIR, LC_DICT[LC]['canopy_height'])
-
-            if lai_fn is not None:
-                lai_nc['leaf_area_index'][time_index, jules_index, :, :] = (
-                    xarray.open_dataset(lai_fn)
-                )['leaf_area_index'][time_index, nc_index, :, :].values
-                
-            if canopy_height_fn is not None:
-                canopy_height_nc['canopy_height'][time_index, jules_index, :, :] = (
-                    xarray.open_dataset(canopy_height_fn)
-                )['canopy_height'][time_index, nc_index, :, :].values
-                
+    ncos = [lai_nc, canopy_height_nc]
+    if n_workers <= 1:
+        for nco, (product, var_name) in zip(ncos, PRODUCTS):
+            write_veg_climatology(
+                nco, product, var_name, time_chunk, max_open
+            )
+    else:
+        # The source files of both products are read concurrently in
+        # worker processes; all writes stay in this process
+        with ProcessPoolExecutor(n_workers) as readers:
+            write_veg_climatologies(ncos, PRODUCTS, readers, time_chunk)
     lai_nc.close()
     canopy_height_nc.close()
 